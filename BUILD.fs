@@ -43,3 +43,13 @@ phony_target(
         'artifact',
     ]
 )
+
+command_target(
+    name='test',
+    command='py.test',
+    command_options={
+        'inputs': [
+            '**/*.py',
+        ],
+    },
+)
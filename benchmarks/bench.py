@@ -0,0 +1,450 @@
+#!/usr/bin/env python
+""" Benchmarks of fusilly's own overhead on synthetic monorepos.
+
+    python benchmarks/bench.py run --output results.json
+    python benchmarks/bench.py compare before.json after.json
+
+Each scenario generates a project in a temporary directory and is measured in
+a fresh python process, as fusilly keeps its configuration and targets in
+globals. Nothing needs the network: the targets only run `true`.
+"""
+
+import argparse
+import copy
+import inspect
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> shape of the dependency graph, number of BUILD files, command targets
+# per BUILD file and python files per BUILD file
+SCENARIOS = {
+    'wide': ('wide', 100, 10, 50),
+    'deep': ('deep', 50, 4, 50),
+    'diamond': ('diamond', 40, 8, 50),
+    'files': ('wide', 10, 2, 5000),
+}
+
+QUICK_SCENARIOS = {
+    'wide': ('wide', 10, 4, 20),
+    'deep': ('deep', 10, 2, 20),
+    'diamond': ('diamond', 5, 4, 20),
+    'files': ('wide', 2, 2, 500),
+}
+
+# former benchmark name -> its current name, so reports made before a rename
+# still line up in compare
+RENAMED = {
+    # both measure building the parser of `fusilly run`
+    'add_target_subparser': 'target_parser',
+}
+
+# directories the python files are spread over, levels below src/
+TREE_DEPTH = 3
+TREE_FANOUT = 4
+
+
+def _write(path, content):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def _dependencies(shape, names, width):
+    """ Return the dependencies of each of names, a list of the command
+    targets, and the targets the top target depends on. """
+    deps = dict((name, []) for name in names)
+    if shape == 'wide':
+        return deps, list(names)
+    if shape == 'deep':
+        for before, name in zip(names, names[1:]):
+            deps[name] = [before]
+        return deps, names[-1:]
+
+    # layers of width targets, each depending on two of the layer before, so
+    # most targets are reached along several paths
+    layers = [names[i:i + width] for i in range(0, len(names), width)]
+    for previous, layer in zip(layers, layers[1:]):
+        for i, name in enumerate(layer):
+            deps[name] = sorted(set([previous[i % len(previous)],
+                                     previous[(i + 1) % len(previous)]]))
+    return deps, layers[-1]
+
+
+def _build_file(package, targets, deps):
+    lines = []
+    for name in targets:
+        lines.append(
+            "command_target(\n"
+            "    name='%s',\n"
+            "    command='true {{opt_%s}} {{sha_short}}',\n"
+            "    opt_%s='%s',\n"
+            "    deps=%r,\n"
+            ")\n" % (name, name, name, name, deps[name])
+        )
+    lines.append(
+        "artifact_target(\n"
+        "    name='%s_artifact',\n"
+        "    files=['src/**/*.py', 'README'],\n"
+        "    exclude_files=['**/test/**'],\n"
+        "    artifact={\n"
+        "        'name': '%s',\n"
+        "        'type': 'deb',\n"
+        "        'target_directory': '/opt/%s',\n"
+        "        'fpm_options': {\n"
+        "            'deb-user': 'nobody',\n"
+        "            'deb-group': 'nogroup',\n"
+        "            'maintainer': 'bench@localhost',\n"
+        "            'version': '{{sha_short}}',\n"
+        "        },\n"
+        "    },\n"
+        ")\n" % (package, package, package)
+    )
+    return '\n'.join(lines)
+
+
+def _source_path(index):
+    parts = []
+    for _ in range(TREE_DEPTH):
+        parts.append('d%d' % (index % TREE_FANOUT))
+        index //= TREE_FANOUT
+    if index % 5 == 0:
+        parts.append('test')
+    return os.path.join('src', os.path.join(*parts), 'm%d.py' % index)
+
+
+def generate(root, shape, build_files, targets, files):
+    """ Write a project to root with build_files BUILD files each defining
+    targets command targets, depending on each other as shape says, and an
+    artifact target over its files python files. A phony target `all`
+    depends on every command target. """
+    _write(os.path.join(root, '.fusilly.toml'), '')
+    packages = ['pkg%03d' % i for i in range(build_files)]
+    names = ['%s_t%d' % (package, i)
+             for package in packages for i in range(targets)]
+    deps, top = _dependencies(shape, names, targets)
+
+    for package in packages:
+        directory = os.path.join(root, package)
+        defined = [name for name in names if name.startswith(package + '_')]
+        _write(os.path.join(directory, 'BUILD.fs'),
+               _build_file(package, defined, deps))
+        _write(os.path.join(directory, 'README'), package)
+        for i in range(files):
+            _write(os.path.join(directory, _source_path(i + files * 7)),
+                   '# %s %d\n' % (package, i))
+
+    _write(os.path.join(root, 'BUILD.fs'),
+           "phony_target(\n    name='all',\n    deps=%r,\n)\n" % top)
+
+    # a repository gives the sha templates something to read
+    try:
+        with open(os.devnull, 'w') as devnull:
+            for argv in (['git', 'init', '-q'],
+                         ['git', 'add', '.'],
+                         ['git', '-c', 'user.name=bench',
+                          '-c', 'user.email=bench@localhost',
+                          'commit', '-q', '-m', 'bench']):
+                subprocess.check_call(argv, cwd=root, stdout=devnull,
+                                      stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return names
+
+
+def measure(fn, repeat, setup=None):
+    """ Return the seconds each of repeat calls of fn took. setup is called,
+    untimed, before each. """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = timeit.default_timer()
+        fn()
+        times.append(timeit.default_timer() - start)
+    return times
+
+
+def _fusilly_run(root, target, jobs):
+    env = dict(os.environ, FUSILLY_NO_DAEMON='1', FUSILLY_ROOT=root)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [REPO_ROOT] + [p for p in [env.get('PYTHONPATH')] if p]
+    )
+    argv = [sys.executable, '-m', 'fusilly.main', 'run', '-j', str(jobs),
+            target]
+
+    def run():
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(argv, cwd=root, env=env, stdout=devnull,
+                                  stderr=devnull)
+    return run
+
+
+def worker(root, leaf, repeat, jobs):
+    """ Measure everything in the project at root, which must be the
+    current directory. leaf is a command target depending on no other.
+    Return benchmark name -> times or error. """
+    from fusilly import globbing
+    from fusilly.buildfiles import BuildFiles
+    from fusilly.config import get_fusilly_config
+    from fusilly import main
+    from fusilly.targets import Targets
+    from fusilly.targets.artifact import ArtifactTarget
+
+    config = get_fusilly_config()
+    cache_dir = config.cache_dir()
+    results = {}
+
+    def record(name, fn, setup=None, times=repeat):
+        try:
+            results[name] = measure(fn, times, setup)
+        except (Exception, SystemExit) as e:
+            results[name] = {'error': '%s: %s' % (type(e).__name__, e)}
+
+    record('find_build_files_in', lambda: BuildFiles(
+        root, cache_dir).find_build_files_in(root))
+
+    record('load', lambda: BuildFiles().load(),
+           setup=lambda: Targets.target_dict.clear())
+
+    # the parser of `fusilly run all`. Older versions built the options of
+    # every target whatever the target run
+    spec = getattr(inspect, 'getfullargspec', None) or inspect.getargspec
+    lazy = len(spec(main.target_parser).args) > 2
+
+    def parse_run_all():
+        if lazy:
+            parser = main.target_parser('run', 'Run target', ['all'],
+                                        BuildFiles())
+            main.parse_target_args(parser, ['all'])
+        else:
+            main.target_parser('run', 'Run target').parse_args(['all'])
+    record('target_parser', parse_run_all)
+
+    # hydration replaces the templates of a target, so each repetition works
+    # on fresh copies
+    options = {'sha': '0' * 40, 'sha_short': '0' * 7}
+    for target in Targets.itervalues():
+        options.update(target.custom_options)
+    templated = [target for target in Targets.itervalues()
+                 if target.TEMPLATE_ATTRS]
+    copies = []
+
+    def copy_targets():
+        copies[:] = [copy.deepcopy(target) for target in templated]
+
+    def templating():
+        for target in copies:
+            target._templating(options)
+    record('templating', templating, setup=copy_targets)
+
+    artifacts = [target for target in Targets.itervalues()
+                 if isinstance(target, ArtifactTarget)]
+
+    def globs():
+        for target in artifacts:
+            target._globs()
+    record('globs_cold', globs, setup=globbing._listings.clear)
+    record('globs_warm', globs)
+
+    # the first run fills the caches of fusilly; leaf is a single target
+    for name, target in (('run_all', 'all'), ('run_leaf', leaf)):
+        run = _fusilly_run(root, target, jobs)
+        record(name, run, times=1)
+        if not isinstance(results[name], dict):
+            record(name, run)
+    return results
+
+
+def summarize(times):
+    if isinstance(times, dict):
+        return times
+    ordered = sorted(times)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        median = ordered[middle]
+    else:
+        median = (ordered[middle - 1] + ordered[middle]) / 2.0
+    return {
+        'runs': len(times),
+        'min': ordered[0],
+        'median': median,
+        'mean': sum(times) / len(times),
+    }
+
+
+def _fusilly_version():
+    sys.path.insert(0, REPO_ROOT)
+    import fusilly
+    return fusilly.__version__
+
+
+def _commit():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, stderr=devnull
+            ).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_scenario(name, params, repeat, jobs):
+    shape, build_files, targets, files = params
+    root = tempfile.mkdtemp(prefix='fusilly-bench-')
+    try:
+        names = generate(root, shape, build_files, targets, files)
+        env = dict(os.environ, FUSILLY_ROOT=root)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [REPO_ROOT] + [p for p in [env.get('PYTHONPATH')] if p]
+        )
+        argv = [sys.executable, os.path.abspath(__file__), 'worker', root,
+                '--repeat', str(repeat), '--jobs', str(jobs), names[0]]
+        output = subprocess.check_output(argv, cwd=root, env=env)
+        results = json.loads(output.decode('utf-8'))
+    finally:
+        shutil.rmtree(root)
+
+    return {
+        'params': {
+            'shape': shape,
+            'build_files': build_files,
+            'targets': build_files * targets,
+            'files': build_files * files,
+        },
+        'benchmarks': dict((benchmark, summarize(times))
+                           for benchmark, times in results.items()),
+    }
+
+
+def run(args):
+    scenarios = QUICK_SCENARIOS if args.quick else SCENARIOS
+    names = args.scenario or sorted(scenarios)
+    report = {
+        'fusilly_version': _fusilly_version(),
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': int(time.time()),
+        'repeat': args.repeat,
+        'jobs': args.jobs,
+        'quick': args.quick,
+        'scenarios': {},
+    }
+    for name in names:
+        sys.stderr.write('%s...\n' % name)
+        result = run_scenario(name, scenarios[name], args.repeat, args.jobs)
+        report['scenarios'][name] = result
+        for benchmark, summary in sorted(result['benchmarks'].items()):
+            if 'error' in summary:
+                line = summary['error']
+            else:
+                line = '%9.2fms median %9.2fms min' % (
+                    summary['median'] * 1000, summary['min'] * 1000)
+            sys.stderr.write('  %-22s %s\n' % (benchmark, line))
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+def _renamed(report):
+    for scenario in report['scenarios'].values():
+        scenario['benchmarks'] = dict(
+            (RENAMED.get(name, name), summary)
+            for name, summary in scenario['benchmarks'].items()
+        )
+    return report
+
+
+def compare(args):
+    """ Print the median times of two reports side by side. """
+    with open(args.before) as f:
+        before = _renamed(json.load(f))
+    with open(args.after) as f:
+        after = _renamed(json.load(f))
+
+    print('%-10s %-22s %12s %12s %8s' % ('scenario', 'benchmark', 'before',
+                                         'after', 'ratio'))
+    for scenario in sorted(set(before['scenarios']) & set(after['scenarios'])):
+        old = before['scenarios'][scenario]
+        new = after['scenarios'][scenario]
+        if old['params'] != new['params']:
+            print('%-10s generated with other parameters, skipped' % scenario)
+            continue
+        for benchmark in sorted(set(old['benchmarks']) |
+                                set(new['benchmarks'])):
+            cells = []
+            medians = []
+            for report in (old, new):
+                summary = report['benchmarks'].get(benchmark)
+                if summary is None or 'error' in summary:
+                    cells.append('error' if summary else '-')
+                    continue
+                medians.append(summary['median'])
+                cells.append('%.2fms' % (summary['median'] * 1000))
+            ratio = '%.2fx' % (medians[1] / medians[0]) \
+                if len(medians) == 2 and medians[0] else ''
+            print('%-10s %-22s %12s %12s %8s' % (scenario, benchmark,
+                                                 cells[0], cells[1], ratio))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command')
+
+    runParser = commands.add_parser('run', help='run the benchmarks')
+    runParser.add_argument('--output', help='write the results to this file '
+                                            'instead of stdout')
+    runParser.add_argument('--repeat', type=int, default=5,
+                           help='times each benchmark is run')
+    runParser.add_argument('-j', '--jobs', type=int, default=1,
+                           help='jobs of the `fusilly run` benchmarks')
+    runParser.add_argument('--quick', action='store_true',
+                           help='smaller projects, for a quick check')
+    runParser.add_argument('--scenario', action='append',
+                           choices=sorted(SCENARIOS),
+                           help='run only this scenario, can be repeated')
+
+    compareParser = commands.add_parser('compare',
+                                        help='compare two result files')
+    compareParser.add_argument('before')
+    compareParser.add_argument('after')
+
+    workerParser = commands.add_parser('worker')
+    workerParser.add_argument('root')
+    workerParser.add_argument('leaf')
+    workerParser.add_argument('--repeat', type=int, default=5)
+    workerParser.add_argument('--jobs', type=int, default=1)
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    if args.command == 'run':
+        run(args)
+    elif args.command == 'compare':
+        compare(args)
+    elif args.command == 'worker':
+        results = worker(args.root, args.leaf, args.repeat, args.jobs)
+        print(json.dumps(results))
+    else:
+        parse_args(['--help'])
+
+
+if __name__ == '__main__':
+    main()
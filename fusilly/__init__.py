@@ -0,0 +1,6 @@
+import time
+
+__version__ = '0.0.1'
+
+# when fusilly started being imported, for the startup timings
+IMPORT_TIME = time.time()
@@ -0,0 +1,107 @@
+import logging
+import os
+
+from fusilly import globbing
+from fusilly.command import Command
+from fusilly.exceptions import FusillyConfigError
+from fusilly.targets import Targets
+
+
+logger = logging.getLogger(__name__)
+
+
+def _git_files(project_root, cmd):
+    ret, stdout = Command(cmd, project_root).run(capture_stdout=True)
+    if ret != 0:
+        raise FusillyConfigError("%s failed in %s" % (cmd, project_root))
+    return [
+        os.path.join(project_root, relpath)
+        for relpath in stdout.split('\0') if relpath
+    ]
+
+
+def changed_files(project_root, since):
+    """ Return the absolute paths of the files under project_root changed
+    between the revision since and the working tree, including deleted files
+    and files git does not track yet. """
+    return sorted(set(
+        _git_files(project_root,
+                   'git diff --name-only --relative -z %s --' % since) +
+        _git_files(project_root,
+                   'git ls-files -z --others --exclude-standard')
+    ))
+
+
+def _owner(path, build_dirs):
+    """ Return the directory of the BUILD file closest to path, going up. """
+    directory = os.path.dirname(path)
+    while directory not in build_dirs:
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+    return directory
+
+
+def directly_affected(paths, targets):
+    """ Return the names of the targets affected by a change to the files at
+    paths themselves: those defined in the BUILD file of the directory
+    containing a path, or of its closest parent directory with one, and those
+    whose input globs match a path. """
+    by_dir = {}
+    for target in targets:
+        by_dir.setdefault(target.buildFile.dir, []).append(target.name)
+
+    affected = set()
+    for path in paths:
+        affected.update(by_dir.get(_owner(path, by_dir), ()))
+
+    for target in targets:
+        if target.name in affected:
+            continue
+        globs, exclude_globs = target.input_globs()
+        if not globs:
+            continue
+        match = globbing.matcher(target.buildFile.dir, globs, exclude_globs)
+        if any(match(path) for path in paths):
+            affected.add(target.name)
+    return affected
+
+
+def with_dependents(names, targets):
+    """ Return names along with the names of all targets depending on them,
+    directly or not. """
+    dependents = {}
+    for target in targets:
+        for dep in target.deps:
+            dep_target = Targets.get(dep)
+            if dep_target is not None:
+                dependents.setdefault(dep_target.name, []).append(target.name)
+
+    result = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in result:
+            result.add(name)
+            pending.extend(dependents.get(name, ()))
+    return result
+
+
+def affected_targets(paths):
+    """ Return the names of the loaded targets affected by changes to the
+    files at paths. """
+    targets = [t for t in Targets.itervalues() if t.buildFile is not None]
+    return with_dependents(directly_affected(paths, targets), targets)
+
+
+def roots(names):
+    """ Return the names of the targets in names that no other target in
+    names depends on. Building those builds all of names. """
+    deps = set()
+    for name in names:
+        for dep in Targets.get(name).deps:
+            dep_target = Targets.get(dep)
+            if dep_target is not None:
+                deps.add(dep_target.name)
+    return sorted(set(names) - deps)
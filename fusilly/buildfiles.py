@@ -1,9 +1,17 @@
+import hashlib
+import imp
 import os
 import json     # noqa
 import logging
+import marshal
 import sys
+import tempfile
 
+import fusilly
+from fusilly.cache import makedirs
 from fusilly.config import get_fusilly_config
+from fusilly.index import DiscoveryIndex, TargetIndex, git_build_files
+from fusilly.labels import parse_label
 from fusilly.targets import Targets
 # Import all the targets so that the build files can find them when exec'd
 from fusilly.targets import *   # noqa
@@ -15,10 +23,12 @@ FusillyBuildFile = 'BUILD.fs'
 
 
 class BuildFile(object):
-    def __init__(self, project_root, path):
+    def __init__(self, project_root, path, cache_dir=None):
         self.project_root = project_root
         self.path = path
         self.dir = os.path.dirname(path)
+        # where compiled BUILD files are kept between runs, if anywhere
+        self.cache_dir = cache_dir
         self._source = None
 
     def source(self):
@@ -27,15 +37,66 @@ class BuildFile(object):
                 self._source = buildfile.read()
         return self._source
 
+    def _cache_path(self):
+        name = hashlib.sha1(self.path.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, 'buildfiles', name)
+
+    def _stamp(self):
+        """ Identifies the BUILD file contents a compiled code object was
+        produced from, much like the header of a .pyc file. """
+        st = os.stat(self.path)
+        return (self.path, st.st_mtime, st.st_size, fusilly.__version__,
+                imp.get_magic())
+
+    def _load_cached(self, stamp):
+        try:
+            with open(self._cache_path(), 'rb') as f:
+                cached_stamp, code = marshal.load(f)
+        except (IOError, EOFError, ValueError, TypeError):
+            return None
+        if cached_stamp != stamp:
+            return None
+        return code
+
+    def _store_cached(self, stamp, code):
+        path = self._cache_path()
+        try:
+            makedirs(os.path.dirname(path))
+            fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path),
+                                           prefix='.tmp-')
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump((stamp, code), f)
+            os.rename(tmppath, path)
+        except (IOError, OSError) as e:
+            logger.debug("Could not cache compiled %s: %s", self.path, e)
+
+    def code(self):
+        """ Return the compiled BUILD file, reusing the code object compiled
+        on a previous run while the file is unchanged. """
+        if self.cache_dir is None:
+            return compile(self.source(), self.path, 'exec')
+
+        stamp = self._stamp()
+        code = self._load_cached(stamp)
+        if code is None:
+            logger.debug("Compiling %s", self.path)
+            code = compile(self.source(), self.path, 'exec')
+            self._store_cached(stamp, code)
+        return code
+
 
 class BuildFiles(object):
     """ A collection of BuildFiles that is able to locate all the BUILD files
     of a project. """
-    def __init__(self):
-        self.project_root = None
+    def __init__(self, project_root=None, cache_dir=None):
+        self.project_root = project_root
+        self.cache_dir = cache_dir
         self.builds = []
+        # paths of the BUILD files executed so far
+        self.loaded = set()
 
     def find_build_files_in(self, directory):
+        """ Walk directory for BUILD files, without using the index. """
         builds = []
         ignore_paths = get_fusilly_config().ignore_paths()
 
@@ -43,24 +104,58 @@ class BuildFiles(object):
             # skip over hidden directories...
             # skip over the case where go has brought in deps that contain
             # their own BUILD files.
-            dirs[:] = [d for d in dirs if not d[0] == '.' or
-                       d in ignore_paths]
+            dirs[:] = [d for d in dirs if not d[0] == '.' and
+                       d not in ignore_paths]
             logger.debug("Checking %s for build files", root)
             if FusillyBuildFile in files:
                 buildFilePath = os.path.join(root, FusillyBuildFile)
-                buildFile = BuildFile(self.project_root, buildFilePath)
+                buildFile = BuildFile(self.project_root, buildFilePath,
+                                      self.cache_dir)
                 logger.debug("Found %s", buildFilePath)
                 builds.append(buildFile)
         return builds
 
-    def find_build_files(self):
-        self.project_root = get_fusilly_config().project_root
+    def _discover(self):
+        """ Return the paths of all BUILD files of the project. """
+        config = get_fusilly_config()
+        ignore_paths = config.ignore_paths()
+        if config.build_file_discovery() == 'git':
+            return git_build_files(self.project_root, FusillyBuildFile,
+                                   ignore_paths)
+
+        index = DiscoveryIndex(self.project_root, self.cache_dir,
+                               FusillyBuildFile, ignore_paths)
+        return index.build_files()
+
+    def _find_project_root(self):
+        if self.project_root is not None:
+            return
+        config = get_fusilly_config()
+        self.project_root = config.project_root
+        self.cache_dir = config.cache_dir()
         if self.project_root is None:
             logger.error("Could not find project root. Check directory.")
             sys.exit(1)
-        self.builds = self.find_build_files_in(self.project_root)
+
+    def find_build_files(self):
+        self._find_project_root()
+        self.builds = [
+            BuildFile(self.project_root, path, self.cache_dir)
+            for path in self._discover()
+        ]
         return self
 
+    def _exec(self, buildFile):
+        logger.debug("Loading BUILD from %s", buildFile.dir)
+        self.loaded.add(buildFile.path)
+        # pylint: disable=W0122
+        exec(buildFile.code())
+
+        # We don't know which targets were just loaded, but we need each
+        # one to know which buildFile its associated with.
+        # This is so hacky..
+        Targets.maybe_set_buildfile(buildFile)
+
     def load(self):
         self.find_build_files()
         if not self.builds:
@@ -69,15 +164,70 @@ class BuildFiles(object):
             sys.exit(1)
 
         for buildFile in self.builds:
-            logger.debug("Loading BUILD from %s", buildFile.dir)
-            # pylint: disable=W0122
-            exec(buildFile.source())
-
-            # We don't know which targets were just loaded, but we need each
-            # one to know which buildFile its associated with.
-            # This is so hacky..
-            Targets.maybe_set_buildfile(buildFile)
+            if buildFile.path not in self.loaded:
+                self._exec(buildFile)
 
         if not Targets:
             logger.error("No targets found")
             sys.exit(1)
+
+        TargetIndex(self.project_root, self.cache_dir).update(Targets)
+
+    def reload(self, paths):
+        """ Execute the BUILD files at paths again, replacing the targets
+        they defined. Only the targets of removed BUILD files are dropped. A
+        BUILD file failing to load is logged and leaves the others loaded. """
+        for path in paths:
+            Targets.remove_defined_in(path)
+            self.loaded.discard(path)
+
+        for path in paths:
+            if not os.path.isfile(path):
+                logger.info("%s removed", path)
+                continue
+            logger.info("Reloading %s", path)
+            buildFile = BuildFile(self.project_root, path, self.cache_dir)
+            try:
+                self._exec(buildFile)
+            except Exception:
+                logger.exception("Could not load %s", path)
+                # targets defined before the failure are dropped on the next
+                # reload of the file
+                Targets.maybe_set_buildfile(buildFile)
+
+        TargetIndex(self.project_root, self.cache_dir).update(Targets)
+
+    def _build_file_path(self, label, index):
+        package, name = parse_label(label)
+        if package is not None:
+            return os.path.join(self.project_root, package, FusillyBuildFile)
+        return index.lookup(name)
+
+    def load_for(self, label):
+        """ Load only the BUILD files defining the target with the given label
+        and, transitively, its dependencies. Labels without a package are
+        located with the target index. Everything is loaded when the index
+        does not know a target or is out of date. """
+        self._find_project_root()
+        index = TargetIndex(self.project_root, self.cache_dir)
+
+        pending = [label]
+        seen = set()
+        while pending:
+            label = pending.pop()
+            if label in seen:
+                continue
+            seen.add(label)
+
+            if label not in Targets:
+                path = self._build_file_path(label, index)
+                if path is None or path in self.loaded or \
+                        not os.path.isfile(path):
+                    logger.debug("%s not indexed, loading all BUILD files",
+                                 label)
+                    return self.load()
+                self._exec(BuildFile(self.project_root, path, self.cache_dir))
+                if label not in Targets:
+                    logger.debug("Index out of date for %s", label)
+                    return self.load()
+            pending.extend(Targets.get(label).deps)
@@ -0,0 +1,125 @@
+import errno
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def write_json_atomic(path, data):
+    """ Write data as json to path such that readers see either the old or
+    the new content, never a partially written file. """
+    directory = os.path.dirname(path)
+    makedirs(directory)
+    fd, tmppath = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, sort_keys=True)
+        os.rename(tmppath, path)
+    except Exception:
+        os.remove(tmppath)
+        raise
+
+
+def read_json(path):
+    """ Return the json content of path, or None if it does not exist or
+    cannot be parsed. """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+class BuildCache(object):
+    """ On-disk store of target results, keyed by target fingerprint.
+
+    File hashes are remembered together with the size and mtime of the file
+    they were computed from, so unchanged files are not read again on the next
+    run.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.hashes_path = os.path.join(directory, 'file-hashes.json')
+        self.hashes = None
+        self.hashes_dirty = False
+
+    def _result_path(self, fingerprint):
+        return os.path.join(self.directory, 'results', fingerprint[:2],
+                            '%s.json' % fingerprint)
+
+    def file_hash(self, path):
+        """ Return the sha1 of the content of path, or None if it does not
+        exist. """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        stamp = [st.st_size, st.st_mtime]
+
+        with self.lock:
+            if self.hashes is None:
+                self.hashes = read_json(self.hashes_path) or {}
+            known = self.hashes.get(path)
+        if known is not None and known[0] == stamp:
+            return known[1]
+
+        sha = hash_file(path)
+        with self.lock:
+            self.hashes[path] = [stamp, sha]
+            self.hashes_dirty = True
+        return sha
+
+    def file_hashes(self, paths):
+        return dict((path, self.file_hash(path)) for path in paths)
+
+    def lookup(self, target):
+        """ Return the output recorded for the fingerprint of target, or None
+        if there is no result or the files it produced have since changed. """
+        entry = read_json(self._result_path(target.fingerprint))
+        if entry is None:
+            return None
+        if self.file_hashes(entry['files']) != entry['files']:
+            logger.debug("Outputs of %s changed since it was cached",
+                         target.name)
+            return None
+        return entry['output']
+
+    def store(self, target, outputdict):
+        entry = {
+            'target': target.name,
+            'output': outputdict or {},
+            'files': self.file_hashes(target.output_files()),
+        }
+        write_json_atomic(self._result_path(target.fingerprint), entry)
+
+    def save(self):
+        """ Persist the file hashes computed during this run. """
+        with self.lock:
+            if self.hashes_dirty:
+                write_json_atomic(self.hashes_path, self.hashes)
+                self.hashes_dirty = False
@@ -0,0 +1,139 @@
+""" Thin client forwarding fusilly commands to a running daemon, see
+fusilly.daemon. Kept free of imports of the rest of fusilly so that it starts
+quickly. """
+
+import errno
+import json
+import os
+import signal
+import socket
+import sys
+
+
+# the daemon listens on this socket in the cache directory
+SOCKET_NAME = 'daemon.sock'
+
+# ends the output of a request, followed by the exit status and a newline
+SENTINEL = b'\0fusilly-exit:'
+
+# options of fusilly itself taking a value
+VALUE_OPTS = ['--logging']
+
+
+def socket_path(cache_dir):
+    return os.path.join(cache_dir, SOCKET_NAME)
+
+
+def connect(path):
+    """ Return a socket connected to the daemon listening at path, or None if
+    there is none. """
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        return None
+    return sock
+
+
+def _recv(sock):
+    while True:
+        try:
+            return sock.recv(64 * 1024)
+        except socket.error as e:
+            # interrupted by a forwarded signal
+            if e.args[0] != errno.EINTR:
+                raise
+
+
+def request(sock, argv, output=None):
+    """ Run the fusilly command line argv in the daemon, writing its output
+    to output. Returns the exit status of the command. SIGINT and SIGTERM are
+    passed on to the process running the command. """
+    output = output or sys.stdout
+    message = {'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ)}
+    sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+    buf = b''
+    while b'\n' not in buf:
+        chunk = _recv(sock)
+        if not chunk:
+            return 1
+        buf += chunk
+    header, buf = buf.split(b'\n', 1)
+    pid = json.loads(header.decode('utf-8'))['pid']
+
+    def forward(sig, frame):
+        os.kill(pid, sig)
+
+    handlers = {}
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        handlers[sig] = signal.signal(sig, forward)
+    try:
+        while True:
+            idx = buf.find(SENTINEL)
+            if idx >= 0:
+                output.write(buf[:idx])
+                buf = buf[idx:]
+                if b'\n' in buf:
+                    output.flush()
+                    return int(buf[len(SENTINEL):buf.index(b'\n')])
+            else:
+                # the sentinel may be split across reads
+                cut = max(0, len(buf) - len(SENTINEL))
+                output.write(buf[:cut])
+                buf = buf[cut:]
+            output.flush()
+
+            chunk = _recv(sock)
+            if not chunk:
+                # the daemon went away
+                output.write(buf)
+                return 1
+            buf += chunk
+    finally:
+        for sig, handler in handlers.items():
+            signal.signal(sig, handler)
+
+
+def command(argv):
+    """ Return the fusilly command named in argv. """
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in VALUE_OPTS:
+            skip = True
+        elif not arg.startswith('-'):
+            return arg
+    return None
+
+
+def _connect_to_project_daemon():
+    from fusilly.config import get_fusilly_config
+
+    try:
+        config = get_fusilly_config()
+    except Exception:
+        # not in a project, which running the command locally reports
+        return None
+    return connect(socket_path(config.cache_dir()))
+
+
+def main():
+    """ Entry point of the fusilly executable. Commands are run by the
+    daemon of the project when one is running, and in this process
+    otherwise. """
+    argv = sys.argv[1:]
+    if command(argv) not in (None, 'daemon') and \
+            not os.environ.get('FUSILLY_NO_DAEMON'):
+        sock = _connect_to_project_daemon()
+        if sock is not None:
+            status = request(sock, argv)
+            sock.close()
+            sys.exit(status)
+
+    from fusilly.main import main as run_locally
+    run_locally()
@@ -1,46 +1,187 @@
-import os
+import collections
+import errno
 import logging
+import os
+import signal
 import subprocess
+import sys
+import threading
+import time
+
+from fusilly import trace
 
 logger = logging.getLogger(__name__)
 
-PROCESSES = []
+# running processes, shared by all threads running commands. The lock is
+# reentrant as the SIGTERM handler takes it on the main thread, which may
+# hold it already when running commands itself.
+PROCESSES = set()
+PROCESSES_LOCK = threading.RLock()
+
+# number of trailing output lines kept to report when a command fails
+TAIL_LINES = 50
+# longest chunk read at once from a command that does not write newlines
+MAX_LINE = 64 * 1024
+# seconds a terminated command has to exit before it is killed
+TERMINATE_GRACE = 5
+
+# commands of targets running concurrently share the terminal
+OUTPUT_LOCK = threading.Lock()
+
+
+def _signal_group(process, sig):
+    try:
+        os.killpg(process.pid, sig)
+    except OSError:
+        # already exited
+        pass
+
+
+def terminate(processes):
+    """ Terminate the process groups of processes, killing those that do not
+    exit within TERMINATE_GRACE seconds. """
+    processes = list(processes)
+    for process in processes:
+        _signal_group(process, signal.SIGTERM)
+
+    deadline = time.time() + TERMINATE_GRACE
+    while time.time() < deadline:
+        if all(process.poll() is not None for process in processes):
+            return
+        time.sleep(0.1)
+
+    for process in processes:
+        if process.poll() is None:
+            _signal_group(process, signal.SIGKILL)
+
+
+def _reap(process):
+    """ Wait for process to exit, adding the resources it and the processes
+    it waited for used to the target that started it. """
+    while True:
+        try:
+            _, status, rusage = os.wait4(process.pid, 0)
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            # reaped by a poll() while being terminated
+            process.wait()
+            return
+        break
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    trace.record_child(rusage)
 
 
 class Command(object):
-    def __init__(self, command, directory=None):
+    def __init__(self, command, directory=None, name=None, log_file=None,
+                 env=None, timeout=None):
         self.command = command
         self.directory = directory
+        # prefixed to each line of output shown on the terminal, usually the
+        # name of the target running the command
+        self.name = name
+        # file the output is appended to, if any
+        self.log_file = log_file
+        # variables added to the environment of the command
+        self.env = env
+        # seconds after which the command is terminated
+        self.timeout = timeout
+        self.timed_out = False
+        self.output_tail = collections.deque(maxlen=TAIL_LINES)
+
+    def _popen(self, cmd, stderr):
+        """ Start the command in a process group of its own, so that it can be
+        terminated along with everything it started. """
+        env = None
+        if self.env:
+            env = dict(os.environ)
+            env.update((k, str(v)) for k, v in self.env.iteritems())
 
-    def _run_inherit_stdout(self, cmd):
         process = subprocess.Popen(
             cmd,
+            cwd=self.directory,
+            env=env,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+            stderr=stderr,
+            preexec_fn=os.setsid,
         )
-        PROCESSES.append(process)
-        stdout, _ = process.communicate()
-        PROCESSES.remove(process)
+        with PROCESSES_LOCK:
+            PROCESSES.add(process)
+        return process
+
+    def _wait(self, process, communicate):
+        """ Run communicate() for the process, terminating it if it is still
+        running after the timeout. """
+        timer = None
+        if self.timeout:
+            timer = threading.Timer(self.timeout, self._expire, [process])
+            timer.daemon = True
+            timer.start()
+        try:
+            return communicate()
+        finally:
+            if timer is not None:
+                timer.cancel()
+            with PROCESSES_LOCK:
+                PROCESSES.discard(process)
+
+    def _expire(self, process):
+        self.timed_out = True
+        logger.error("Command timed out after %ss: %s", self.timeout,
+                     self.command)
+        terminate([process])
+
+    def _forward(self, line, log):
+        """ Pass a line of output on to the terminal and the log file. """
+        self.output_tail.append(line)
+        if self.name:
+            line = '[%s] %s' % (self.name, line)
+        with OUTPUT_LOCK:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+        if log is not None:
+            log.write(line)
+
+    def _report_failure(self, returncode):
+        logger.error("Command failed with exit code %d: %s", returncode,
+                     self.command)
+        if self.output_tail:
+            logger.error("Last %d lines of output:\n%s",
+                         len(self.output_tail), ''.join(self.output_tail))
+
+    def _run_inherit_stdout(self, cmd):
+        """ Stream the output of the command line by line as it is produced,
+        so that it is never held in memory in full. """
+        process = self._popen(cmd, subprocess.STDOUT)
+
+        def stream():
+            log = open(self.log_file, 'a') if self.log_file else None
+            try:
+                for line in iter(lambda: process.stdout.readline(MAX_LINE),
+                                 b''):
+                    self._forward(line, log)
+                _reap(process)
+            finally:
+                if log is not None:
+                    log.close()
+
+        self._wait(process, stream)
+        if process.returncode != 0:
+            self._report_failure(process.returncode)
         return process.returncode
 
     def _run_capture_stdout(self, cmd):
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        PROCESSES.append(process)
-        stdout, _ = process.communicate()
-        PROCESSES.remove(process)
+        process = self._popen(cmd, subprocess.PIPE)
+        stdout, _ = self._wait(process, process.communicate)
         return process.returncode, stdout
 
     def run(self, capture_stdout=False):
-        if self.directory:
-            last_directory = os.getcwd()
-            os.chdir(self.directory)
-        else:
-            last_directory = None
-
+        # the working directory and environment are passed to the child
+        # rather than changed in this process, so that commands may run from
+        # several threads at once.
         logger.info("Running command: %s", self.command)
 
         cmd = self.command.split(' ')
@@ -49,9 +190,6 @@ class Command(object):
         else:
             ret = self._run_inherit_stdout(cmd)
 
-        if last_directory:
-            os.chdir(last_directory)
-
         if not capture_stdout:
             return ret
 
@@ -59,5 +197,7 @@ class Command(object):
 
     @classmethod
     def sigterm_handler(cls):
-        for process in PROCESSES:
-            process.terminate()
+        """ Terminate every running command and whatever it started. """
+        with PROCESSES_LOCK:
+            processes = list(PROCESSES)
+        terminate(processes)
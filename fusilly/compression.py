@@ -0,0 +1,227 @@
+import bz2
+import collections
+import distutils.spawn
+import os
+import struct
+import subprocess
+import zlib
+from multiprocessing.pool import ThreadPool
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+from fusilly.exceptions import BuildConfigError
+
+
+# compression -> extension of the files it writes. dpkg reads data.tar.zst
+# from version 1.21.18 on.
+EXTENSIONS = {
+    'gz': '.gz',
+    'bzip2': '.bz2',
+    'xz': '.xz',
+    'zstd': '.zst',
+    'none': '',
+}
+
+# compression -> (lowest, highest, default) level
+LEVELS = {
+    'gz': (1, 9, 9),
+    'bzip2': (1, 9, 9),
+    'xz': (0, 9, 6),
+    'zstd': (1, 19, 3),
+}
+
+# uncompressed bytes each thread of the parallel gzip compresses at once
+BLOCK_SIZE = 1024 * 1024
+# the window of deflate, the data of a block its successor may refer to
+WINDOW_SIZE = 32 * 1024
+
+# gzip header without a file name or modification time, made on unix
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\x03'
+
+try:
+    zlib.compressobj(9, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, b'')
+    HAS_ZDICT = True
+except TypeError:
+    HAS_ZDICT = False
+
+
+def _program(compression):
+    return distutils.spawn.find_executable(compression)
+
+
+def check(compression, level=None, reproducible=False):
+    """ Raise BuildConfigError unless compression is known and can be used
+    at level on this machine, with the same output on every machine when
+    reproducible. """
+    if compression not in EXTENSIONS:
+        raise BuildConfigError("Unknown compression %s, use one of %s" %
+                               (compression, ', '.join(sorted(EXTENSIONS))))
+    if level is not None and compression in LEVELS:
+        lowest, highest, _ = LEVELS[compression]
+        if not lowest <= level <= highest:
+            raise BuildConfigError(
+                "%s compression level must be between %d and %d" %
+                (compression, lowest, highest)
+            )
+    if compression == 'xz' and _program('xz') is None:
+        # the lzma module writes other bytes than the xz program
+        if reproducible:
+            raise BuildConfigError(
+                "Reproducible xz compression needs xz to be installed"
+            )
+        if lzma is None:
+            raise BuildConfigError(
+                "xz compression needs xz or the lzma module"
+            )
+    if compression == 'zstd' and _program('zstd') is None:
+        raise BuildConfigError("zstd compression needs zstd to be installed")
+
+
+class CompressedWriter(object):
+    """ Write-only file object compressing what is written to it into
+    fileobj, so a tar stream is compressed as it is produced. A compressor of
+    None writes the data as is. """
+
+    def __init__(self, fileobj, compressor):
+        self.fileobj = fileobj
+        self.compressor = compressor
+
+    def write(self, data):
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        if data:
+            self.fileobj.write(data)
+
+    def close(self):
+        if self.compressor is not None:
+            self.fileobj.write(self.compressor.flush())
+
+
+def _deflate(block, level, dictionary, last):
+    if dictionary and HAS_ZDICT:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 9,
+                                      zlib.Z_DEFAULT_STRATEGY, dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    # a sync flush ends on a byte boundary without ending the stream, so the
+    # output of the next block can follow
+    return compressor.compress(block) + compressor.flush(
+        zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+    )
+
+
+class ParallelGzipWriter(object):
+    """ Writes a single gzip member whose blocks are deflated by a pool of
+    threads, as pigz does. Each block is primed with the end of the previous
+    one where zlib allows, so the output is nearly as small as that of a
+    single deflate stream. zlib releases the GIL while compressing. """
+
+    def __init__(self, fileobj, level, jobs):
+        self.fileobj = fileobj
+        self.level = level
+        self.jobs = jobs
+        self.pool = ThreadPool(jobs)
+        # compressed blocks in the order they are written
+        self.pending = collections.deque()
+        self.buf = []
+        self.buffered = 0
+        self.dictionary = b''
+        self.crc = 0
+        self.size = 0
+        self.fileobj.write(GZIP_HEADER)
+
+    def write(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        self.buf.append(data)
+        self.buffered += len(data)
+        while self.buffered >= BLOCK_SIZE:
+            self._submit(last=False)
+
+    def _submit(self, last):
+        # blocks are cut at the same offsets however the data is written
+        data = b''.join(self.buf)
+        block = data[:BLOCK_SIZE] if not last else data
+        rest = data[len(block):]
+        self.buf = [rest] if rest else []
+        self.buffered = len(rest)
+        self.pending.append(self.pool.apply_async(
+            _deflate, (block, self.level, self.dictionary, last)
+        ))
+        self.dictionary = block[-WINDOW_SIZE:]
+        # bound the memory held by blocks waiting to be written
+        while self.pending and (len(self.pending) > 2 * self.jobs or
+                                self.pending[0].ready()):
+            self.fileobj.write(self.pending.popleft().get())
+
+    def close(self):
+        try:
+            self._submit(last=True)
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().get())
+            self.fileobj.write(struct.pack('<II', self.crc & 0xffffffff,
+                                           self.size & 0xffffffff))
+        finally:
+            self.pool.terminate()
+            self.pool.join()
+
+
+class ProcessWriter(object):
+    """ Compresses with an external program writing straight to the file
+    descriptor of fileobj, which must be a real file. """
+
+    def __init__(self, fileobj, argv):
+        fileobj.flush()
+        self.fileobj = fileobj
+        self.argv = argv
+        self.process = subprocess.Popen(argv, stdin=subprocess.PIPE,
+                                        stdout=fileobj.fileno())
+
+    def write(self, data):
+        self.process.stdin.write(data)
+
+    def close(self):
+        self.process.stdin.close()
+        ret = self.process.wait()
+        if ret != 0:
+            raise IOError("%s exited with %d" % (self.argv[0], ret))
+        # the program moved the offset shared with fileobj
+        self.fileobj.seek(0, os.SEEK_END)
+
+
+def writer(fileobj, compression, level=None, jobs=1, reproducible=False):
+    """ Return a file object compressing what is written to it into fileobj
+    with compression at level, or the default level of compression, using
+    up to jobs threads where the compression allows. When reproducible, the
+    output does not depend on the number of jobs. """
+    if compression == 'none':
+        return CompressedWriter(fileobj, None)
+    if level is None:
+        level = LEVELS[compression][2]
+
+    if compression == 'gz':
+        if jobs > 1 or reproducible:
+            return ParallelGzipWriter(fileobj, level, jobs)
+        # wbits of 31 writes a gzip header and trailer
+        return CompressedWriter(fileobj,
+                                zlib.compressobj(level, zlib.DEFLATED, 31))
+    if compression == 'bzip2':
+        return CompressedWriter(fileobj, bz2.BZ2Compressor(level))
+    if compression == 'xz':
+        program = _program('xz')
+        if program is not None:
+            # a single thread makes xz write a single block
+            if reproducible:
+                jobs = max(jobs, 2)
+            return ProcessWriter(fileobj, [program, '--compress', '--stdout',
+                                           '-T%d' % jobs, '-%d' % level])
+        check(compression, level, reproducible)
+        return CompressedWriter(fileobj, lzma.LZMACompressor(preset=level))
+    if compression == 'zstd':
+        return ProcessWriter(fileobj, [_program('zstd'), '--compress',
+                                       '--stdout', '--quiet', '-T%d' % jobs,
+                                       '-%d' % level])
+    raise BuildConfigError("Unknown compression %s" % compression)
@@ -1,13 +1,22 @@
+import multiprocessing
 import os
-import toml
 
+from fusilly.cache import read_json, write_json_atomic
 from fusilly.exceptions import FusillyConfigError
 from fusilly.repo import GitRepo
-from fusilly.utils import to_iterable
+from fusilly.utils import startup_timings, to_iterable
 
 
 FUSILLY_CONFIG = None
 
+# a directory containing either of these is the project root
+ROOT_MARKERS = ['.fusilly.toml', '.git']
+
+# parsed .fusilly.toml, relative to the project root. This stays in the
+# default cache directory, as the configured one is only known once the
+# config has been read.
+CONFIG_CACHE = os.path.join('.fusilly', 'config.json')
+
 
 class Config(object):
     def __init__(self, project_root, toml_config=None):
@@ -43,11 +52,73 @@ class Config(object):
         relpath = relpath.replace("/", ".")
         return relpath
 
+    def cache_dir(self):
+        """ Directory where fusilly keeps state between runs. """
+        cache = self.config.get('cache', {})
+        directory = cache.get('directory', '.fusilly')
+        return os.path.join(self.project_root, directory)
+
+    def virtualenv_cache_dir(self):
+        """ Directory of reusable virtualenvs, or None if virtualenvs are
+        built from scratch on every run. """
+        virtualenv = self.config.get('virtualenv', {})
+        if not virtualenv.get('cache', True):
+            return None
+        directory = virtualenv.get('cache_directory')
+        if directory is None:
+            return os.path.join(self.cache_dir(), 'virtualenvs')
+        return os.path.join(self.project_root, os.path.expanduser(directory))
+
+    def virtualenv_cache_limits(self):
+        """ Return the maximum total size in bytes of cached virtualenvs and
+        the maximum age in seconds of an unused one. """
+        virtualenv = self.config.get('virtualenv', {})
+        max_size_mb = virtualenv.get('cache_max_size_mb', 5 * 1024)
+        max_age_days = virtualenv.get('cache_max_age_days', 30)
+        return max_size_mb * 1024 * 1024, max_age_days * 24 * 60 * 60
+
+    def wheelhouse(self):
+        """ Return the wheelhouse directory virtualenvs are installed from,
+        or None if they install straight from the package index, along with
+        the number of wheels to build at once and whether to work offline. """
+        virtualenv = self.config.get('virtualenv', {})
+        directory = virtualenv.get('wheelhouse', True)
+        if directory is False:
+            return None, 0, False
+        if directory is True:
+            directory = os.path.join(self.cache_dir(), 'wheelhouse')
+        else:
+            directory = os.path.join(self.project_root,
+                                     os.path.expanduser(directory))
+        jobs = virtualenv.get('wheel_jobs', multiprocessing.cpu_count())
+        return directory, jobs, virtualenv.get('offline', False)
+
+    def target_log_dir(self):
+        """ Directory where the output of each target's commands is logged,
+        or None if it is only shown on the terminal. """
+        output = self.config.get('output', {})
+        directory = output.get('log_directory')
+        if directory is None:
+            return None
+        return os.path.join(self.project_root, directory)
+
     def ignore_paths(self):
         build_files = self.config.get('build_files', {})
         ignore_paths = build_files.get('ignore_paths')
         return to_iterable(ignore_paths)
 
+    def build_file_discovery(self):
+        """ How BUILD files are found: 'walk' the project directories, or
+        ask 'git' for the files it knows about. """
+        build_files = self.config.get('build_files', {})
+        discovery = build_files.get('discovery', 'walk')
+        if discovery not in ('walk', 'git'):
+            raise FusillyConfigError(
+                "build_files discovery must be 'walk' or 'git', not '%s'" %
+                discovery
+            )
+        return discovery
+
     def repo_head_sha(self):
         """ Return the sha of the local HEAD. """
         return self.repo.head_sha()
@@ -57,33 +128,66 @@ class Config(object):
 
 
 def find_project_root():
-    dirs = ['.git']
+    """ Return the closest directory, starting from the current one and going
+    up, containing a .git directory or a .fusilly.toml file. The FUSILLY_ROOT
+    environment variable skips the search. """
+    root = os.environ.get('FUSILLY_ROOT')
+    if root:
+        return os.path.abspath(root)
 
     cwd = os.getcwd()
     while cwd != '/':
-        # config file can also indicate project root
-        if os.path.isfile(os.path.join(cwd, '.fusilly.toml')):
-            return cwd
-        roots = [os.path.join(cwd, d) for d in dirs]
-        for root in roots:
-            if os.path.exists(root):
+        # a single listing tells whether any of the markers is present
+        try:
+            entries = set(os.listdir(cwd))
+        except OSError:
+            entries = set()
+        for marker in ROOT_MARKERS:
+            if marker in entries:
                 return cwd
 
-        cwd = os.path.abspath(os.path.join(cwd, '..'))
+        cwd = os.path.dirname(cwd)
 
     raise Exception("could not locate project root")
 
 
-def _load_fusilly_config():
-    root = find_project_root()
-    config = os.path.join(root, '.fusilly.toml')
+def _read_toml(root, path):
+    """ Return the parsed toml file at path. The parsed content is kept as
+    json in the project cache directory, which is much quicker to load, and
+    reused until the mtime of the file changes. """
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+
+    cache_path = os.path.join(root, CONFIG_CACHE)
+    cached = read_json(cache_path)
+    if cached is not None and cached['mtime'] == mtime:
+        return cached['config']
+
+    # pylint: disable=W0621
+    import toml
+    with open(path) as configfile:
+        toml_config = toml.load(configfile, _dict=dict)
 
     try:
-        with open(config) as configfile:
-            toml_config = toml.load(configfile, _dict=dict)
-            return Config(root, toml_config)
-    except IOError:
-        return Config(root)
+        write_json_atomic(cache_path, {'mtime': mtime, 'config': toml_config})
+    except (IOError, OSError, TypeError):
+        # e.g. toml dates cannot be written as json; just parse every time
+        pass
+    return toml_config
+
+
+def _load_fusilly_config():
+    with startup_timings.measure('project root'):
+        root = find_project_root()
+
+    with startup_timings.measure('config'):
+        config = os.path.join(root, '.fusilly.toml')
+        toml_config = _read_toml(root, config)
+        if toml_config is None:
+            return Config(root)
+        return Config(root, toml_config)
 
 
 def get_fusilly_config():
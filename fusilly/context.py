@@ -0,0 +1,111 @@
+import collections
+import threading
+
+from fusilly.config import get_fusilly_config
+from fusilly.utils import filter_dict
+
+
+# Options of the run command itself that are not available to templates.
+RUN_OPTS = [
+    'subparser_name',
+    'args',
+    'jobs',
+    'no_cache',
+    'compression_level',
+    'trace',
+]
+
+BUILTIN_TEMPLATE_OPTS = [
+    'sha',
+    'sha_short',
+    'git_branch',
+    'git_dirty',
+    'git_commit_timestamp',
+]
+
+
+class Builtins(object):
+    """ The built-in template values, describing the git repository of the
+    project. Each is read when a template first uses it, then kept for the
+    rest of the run. """
+
+    def __init__(self, repo=None):
+        self.repo = repo
+        self.values = {}
+        self.lock = threading.RLock()
+
+    def _read(self, name):
+        repo = self.repo or get_fusilly_config().repo
+        if name == 'sha':
+            return repo.head_sha()
+        if name == 'sha_short':
+            sha = self.get('sha')
+            return sha[:12] if sha is not None else None
+        if name == 'git_branch':
+            return repo.branch()
+        if name == 'git_dirty':
+            # as git describe --dirty suffixes versions
+            dirty = repo.is_dirty()
+            if dirty is None:
+                return None
+            return '-dirty' if dirty else ''
+        if name == 'git_commit_timestamp':
+            return repo.head_timestamp()
+        raise KeyError(name)
+
+    def get(self, name):
+        with self.lock:
+            if name not in self.values:
+                self.values[name] = self._read(name)
+            return self.values[name]
+
+
+class TemplateValues(collections.Mapping):
+    """ The values templates are rendered with: the built-in values and the
+    options of the targets. """
+
+    def __init__(self, options, builtins):
+        self.options = options
+        self.builtins = builtins
+
+    def __getitem__(self, name):
+        if name in BUILTIN_TEMPLATE_OPTS:
+            return self.builtins.get(name)
+        return self.options[name]
+
+    def __iter__(self):
+        for name in BUILTIN_TEMPLATE_OPTS:
+            yield name
+        for name in self.options:
+            if name not in BUILTIN_TEMPLATE_OPTS:
+                yield name
+
+    def __len__(self):
+        return len(set(self.options) | set(BUILTIN_TEMPLATE_OPTS))
+
+
+class RunContext(object):
+    """ What the targets of a run share, read only: the arguments of the
+    command line, which are also its attributes, and the values templates
+    are rendered with. It is made once per run. Runs sharing builtins read
+    the repository once. """
+
+    def __init__(self, args, builtins=None):
+        self.args = args
+        self.builtins = builtins or Builtins()
+        self.template_values = TemplateValues(
+            filter_dict(vars(args), RUN_OPTS), self.builtins
+        )
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name == 'args':
+            raise AttributeError(name)
+        return getattr(self.args, name)
+
+    @classmethod
+    def of(cls, args):
+        """ Return args if it is a context already, else the context of a
+        run with the arguments args. """
+        if isinstance(args, RunContext):
+            return args
+        return cls(args)
@@ -0,0 +1,229 @@
+import errno
+import fcntl
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+
+from fusilly.client import SENTINEL, connect
+from fusilly.index import TargetIndex
+from fusilly.watcher import watcher
+
+
+logger = logging.getLogger(__name__)
+
+# seconds between checks for changed BUILD files while no request comes in
+REFRESH_INTERVAL = 1.0
+
+
+class DaemonError(Exception):
+    pass
+
+
+def _native(s):
+    # json gives unicode strings, the rest of fusilly expects str
+    if isinstance(s, str):
+        return s
+    return s.encode('utf-8')
+
+
+class Daemon(object):
+    """ Long-lived process keeping the BUILD files of a project loaded.
+
+    Requests of the thin client in fusilly.client arrive over a Unix socket.
+    Each one is run by handler in a child forked from the daemon, so that it
+    starts with every target, target module and the config already loaded,
+    and whatever it does to them is thrown away when it exits. The output of
+    the child goes straight to the client; the daemon adds the exit status
+    once the child is done.
+
+    BUILD files are watched and those that changed are executed again between
+    requests, replacing the targets they defined. BUILD files added to the
+    project are first loaded by a child needing them, which records them in
+    the target index; the daemon then loads them too.
+    """
+
+    def __init__(self, path, buildFiles, handler, config_files=()):
+        self.path = path
+        self.buildFiles = buildFiles
+        # called with the argument list of a request in the forked child
+        self.handler = handler
+        # files whose change makes the daemon exit, as it cannot reload them
+        self.config_files = [os.path.abspath(f) for f in config_files]
+        self.index_path = TargetIndex(buildFiles.project_root,
+                                      buildFiles.cache_dir).path
+        self.watcher = watcher(sorted(buildFiles.loaded) + self.config_files +
+                               [self.index_path])
+        self.sock = None
+        self.running = False
+        # connections of requests still running, by pid of their child
+        self.requests = {}
+        self.lock = threading.Lock()
+
+    def _listen(self):
+        existing = connect(self.path)
+        if existing is not None:
+            existing.close()
+            raise DaemonError("A daemon is already listening on %s" %
+                              self.path)
+        try:
+            os.unlink(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # not inherited by the commands run for requests
+        flags = fcntl.fcntl(sock.fileno(), fcntl.F_GETFD)
+        fcntl.fcntl(sock.fileno(), fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+        sock.bind(self.path)
+        sock.listen(16)
+        sock.settimeout(REFRESH_INTERVAL)
+        return sock
+
+    def refresh(self):
+        """ Reload the BUILD files that changed since the last refresh.
+        Returns False if the daemon has to stop as its config changed. """
+        changed = self.watcher.changes(0)
+        if not changed:
+            return True
+
+        if changed.intersection(self.config_files):
+            logger.warning("Configuration changed, stopping the daemon")
+            return False
+
+        if changed:
+            self.buildFiles.reload(sorted(changed - set([self.index_path])))
+        if self.index_path in changed:
+            try:
+                self.buildFiles.load()
+            except Exception:
+                logger.exception("Could not load new BUILD files")
+        self.watcher.watch(self.buildFiles.loaded)
+        return True
+
+    def serve(self):
+        self.sock = self._listen()
+        self.running = True
+        logger.info("Listening on %s", self.path)
+        try:
+            while self.running:
+                if not self.refresh():
+                    break
+                try:
+                    conn, _ = self.sock.accept()
+                except socket.timeout:
+                    continue
+                except socket.error as e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                self.refresh()
+                self._start(conn)
+        finally:
+            self.sock.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            self.watcher.close()
+
+    def stop(self):
+        self.running = False
+
+    def _read_request(self, conn):
+        reader = conn.makefile('rb')
+        try:
+            line = reader.readline()
+        finally:
+            reader.close()
+        return json.loads(line.decode('utf-8'))
+
+    def _start(self, conn):
+        conn.setblocking(1)
+        try:
+            request = self._read_request(conn)
+        except (ValueError, socket.error) as e:
+            logger.error("Invalid request: %s", e)
+            conn.close()
+            return
+
+        # no lock is held while forking, as the child could never release
+        # it. Only this thread adds requests, and _finish only removes those
+        # already added.
+        pid = os.fork()
+        if pid == 0:
+            self._child(conn, request)
+        with self.lock:
+            self.requests[pid] = conn
+
+        thread = threading.Thread(target=self._finish, args=(pid, conn))
+        thread.daemon = True
+        thread.start()
+
+    def _finish(self, pid, conn):
+        """ Wait for the child running a request, then tell the client how it
+        exited. """
+        _, status = os.waitpid(pid, 0)
+        if os.WIFEXITED(status):
+            status = os.WEXITSTATUS(status)
+        else:
+            status = 128 + os.WTERMSIG(status)
+
+        with self.lock:
+            del self.requests[pid]
+        try:
+            conn.sendall(SENTINEL + str(status).encode('ascii') + b'\n')
+        except socket.error:
+            # the client went away
+            pass
+        conn.close()
+
+    def _child(self, conn, request):
+        status = 1
+        try:
+            # only the connection of this request may keep its client
+            # waiting, and the daemon's watches are of no use to the child
+            self.sock.close()
+            for other in list(self.requests.values()):
+                other.close()
+            self.watcher.close()
+
+            conn.sendall(json.dumps({'pid': os.getpid()}).encode('utf-8') +
+                         b'\n')
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(conn.fileno(), 1)
+            os.dup2(conn.fileno(), 2)
+            conn.close()
+            sys.stdout = os.fdopen(1, 'w')
+            sys.stderr = os.fdopen(2, 'w')
+
+            os.chdir(request['cwd'])
+            os.environ.clear()
+            for name, value in request['env'].items():
+                os.environ[_native(name)] = _native(value)
+            status = self._handle([_native(arg) for arg in request['argv']])
+        except Exception:
+            logger.exception("Request failed")
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+    def _handle(self, argv):
+        try:
+            self.handler(argv)
+        except SystemExit as e:
+            if e.code is None:
+                return 0
+            if isinstance(e.code, int):
+                return e.code
+            sys.stderr.write('%s\n' % e.code)
+            return 1
+        except Exception:
+            logger.exception("Command failed")
+            return 1
+        return 0
@@ -1,70 +1,582 @@
+import collections
+import hashlib
+import io
 import logging
+import multiprocessing
 import os
-from tempfile import NamedTemporaryFile
+import platform
+import stat
+import tarfile
+import time
 
-from fusilly.command import Command
+from fusilly import compression
+from fusilly.cache import CHUNK_SIZE, read_json, write_json_atomic
 from fusilly.exceptions import DebCreationFailure
+from fusilly.utils import to_iterable
 
 
 logger = logging.getLogger(__name__)
 
+AR_MAGIC = b'!<arch>\n'
+DEB_VERSION = b'2.0\n'
+
+# the fpm options the deb writer understands, named as fpm names them
+OPTIONS = [
+    'architecture',
+    'deb-compression',
+    'deb-group',
+    'deb-user',
+    'depends',
+    'description',
+    'maintainer',
+    'version',
+]
+
+BLOCK_SIZE = 512
+# the two empty blocks ending a tar archive
+TAR_END = b'\0' * 2 * BLOCK_SIZE
+
+# A segment of the data member is closed once it holds SEGMENT_SIZE bytes,
+# after a member whose name hashes to a multiple of SEGMENT_SPREAD, so that
+# its boundaries do not move when the size of a file changes.
+SEGMENT_SIZE = 4 * 1024 * 1024
+SEGMENT_SPREAD = 16
+
+# compressions whose streams may be concatenated, so that the segments of a
+# previous package can be copied into the next one
+SEGMENTED = ['gz', 'none']
+
+# platform.machine() -> debian architecture
+ARCHITECTURES = {
+    'x86_64': 'amd64',
+    'i386': 'i386',
+    'i686': 'i386',
+    'aarch64': 'arm64',
+    'armv7l': 'armhf',
+    'ppc64le': 'ppc64el',
+    's390x': 's390x',
+}
+
+
+def native_architecture():
+    machine = platform.machine()
+    return ARCHITECTURES.get(machine, machine)
+
+
+def _ar_header(name, size, mtime):
+    header = '%-16s%-12d%-6d%-6d%-8s%-10d`\n' % (
+        name, mtime, 0, 0, '100644', size
+    )
+    return header.encode('ascii')
+
+
+def _padding(size):
+    return b'\0' * (-size % BLOCK_SIZE)
+
+
+def _boundary(name):
+    sha = hashlib.sha1(name.encode('utf-8')).hexdigest()
+    return int(sha[:8], 16) % SEGMENT_SPREAD == 0
+
+
+def _copy(src, dst, length):
+    while length:
+        chunk = src.read(min(CHUNK_SIZE, length))
+        if not chunk:
+            raise IOError("%s is shorter than expected" % src.name)
+        dst.write(chunk)
+        length -= len(chunk)
+
+
+def _control_field(name, value):
+    # continuation lines start with a space, empty ones are a lone dot
+    lines = str(value).strip().splitlines() or ['']
+    rest = [' ' + (line if line.strip() else '.') for line in lines[1:]]
+    return '\n'.join(['%s: %s' % (name, lines[0])] + rest)
+
+
+Entry = collections.namedtuple('Entry', 'name src st info header')
+
+
+class Manifest(object):
+    """ Record of a written package: where it is, the settings its data
+    member was written with, the size, mtime and sha1 of its files and the
+    key, offset and length of each segment of its data member. The next
+    package of the same artifact copies the segments whose key did not
+    change, and is not written at all when nothing changed. """
+
+    def __init__(self, data=None):
+        data = data or {}
+        # [path, size, mtime] of the package
+        self.deb = data.get('deb')
+        # [control file, compression, level, reproducible, epoch]
+        self.settings = data.get('settings')
+        # names of the directories leading to the files
+        self.parents = data.get('parents', [])
+        # name -> [size, mtime, sha1] of the regular files
+        self.files = data.get('files', {})
+        # [key, offset, length] of the segments, in order
+        self.segments = data.get('segments', [])
+
+    @classmethod
+    def load(cls, path):
+        """ Return the manifest at path, or None if there is none or the
+        package it describes changed since it was written. """
+        data = read_json(path)
+        if data is None or not data.get('deb'):
+            return None
+        manifest = cls(data)
+        try:
+            st = os.stat(manifest.deb[0])
+        except OSError:
+            return None
+        if manifest.deb[1:] != [st.st_size, st.st_mtime]:
+            logger.debug("%s changed since it was written", manifest.deb[0])
+            return None
+        return manifest
+
+    def save(self, path):
+        write_json_atomic(path, {
+            'deb': self.deb,
+            'settings': self.settings,
+            'parents': self.parents,
+            'files': self.files,
+            'segments': self.segments,
+        })
+
+    def keys(self):
+        return [key for key, _, _ in self.segments]
+
 
 class Deb(object):
-    def __init__(self, package_name, files, options, dir_mappings):
+    """ Writes a .deb package, an ar archive of the debian-binary version, a
+    control.tar.gz holding the control file and a data.tar of the files to
+    install. Files are streamed from where they are into the compressed
+    data.tar; nothing is copied beforehand.
+
+    The data.tar starts with the directories leading to the files added,
+    followed by the members added with add() and add_tree() in the order
+    they were added. The members are written in segments, which for gz and
+    uncompressed packages are separate streams: given the Manifest of the
+    previous package of the artifact, segments whose members did not change
+    are copied from it rather than compressed again.
+    """
+
+    def __init__(self, package_name, options, level=None, jobs=None,
+                 epoch=None):
+        for key in options:
+            if key not in OPTIONS:
+                logger.warning("fpm option '%s' is not supported, ignored",
+                               key)
+
         self.package_name = package_name
-        self.files = files
         self.options = options
+        self.version = str(options.get('version', '1.0'))
+        self.architecture = str(options.get('architecture') or
+                                native_architecture())
+        self.user = str(options['deb-user'])
+        self.group = str(options['deb-group'])
 
-        self.options_str = ""
-        options_list = ["--%s=%s" % (k, v) for k, v in options.iteritems()]
-        self.options_str = ' '.join(options_list)
-        self.dir_mappings = dir_mappings
+        # bzip compresses better, but takes a little longer
+        self.compression = str(options.get('deb-compression', 'bzip2'))
+        self.level = level
+        self.jobs = jobs or multiprocessing.cpu_count()
+        # set for a reproducible package: the time its files are dated no
+        # later than, and the date of everything else
+        self.epoch = epoch
+        compression.check(self.compression, level, self.reproducible)
 
-    def create_mapping(self, project_root, target_directory, files):
-        srcs = []
+        # (name in the archive, source path, lstat of the source) in the
+        # order they are written
+        self.members = []
+        # directories leading to the members
+        self.parents = set()
+        self.names = set()
+        self.path = None
+        self.manifest = None
+        # set when the package was left as it was by the previous build
+        self.unchanged = False
 
-        for filename in files:
-            destination = os.path.join(
-                target_directory,
-                filename[len(project_root)+1:]
-            )
-            srcs.append("%s=%s" % (filename, destination))
+    @property
+    def filename(self):
+        return '%s_%s_%s.deb' % (self.package_name, self.version,
+                                 self.architecture)
 
-        return srcs
+    def _add_parents(self, name):
+        parent = os.path.dirname(name)
+        if parent not in ('', '.') and parent not in self.names:
+            self._add_parents(parent)
+            self.names.add(parent)
+            self.parents.add(parent)
 
-    def write_mapping(self, fd, srcs):
-        files_str = '\n'.join(srcs)  # fpm expects src=dst, one per line
+    def _add(self, name, src, st):
+        if name in self.names:
+            logger.debug("%s is already in %s, skipping %s", name,
+                         self.package_name, src)
+            return
+        if not (stat.S_ISDIR(st.st_mode) or stat.S_ISLNK(st.st_mode) or
+                stat.S_ISREG(st.st_mode)):
+            logger.warning("%s is not a file, link or directory, skipped",
+                           src)
+            return
+        self._add_parents(name)
+        self.names.add(name)
+        self.members.append((name, src, st))
 
-        fd.write(files_str)
-        fd.flush()
+    def add(self, src, destination):
+        """ Add the file, link or directory tree at src, installed at the
+        absolute path destination. """
+        st = os.lstat(src)
+        if stat.S_ISDIR(st.st_mode):
+            self.add_tree(src, destination)
+        else:
+            self._add(self._name(destination), src, st)
 
-        # try to ensure that content is on disk before fpm tries to read it
-        os.fsync(fd.fileno())
+    def add_tree(self, directory, destination):
+        """ Add directory and everything below it, installed at the absolute
+        path destination. """
+        self._add(self._name(destination), directory, os.lstat(directory))
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            relroot = os.path.relpath(root, directory)
+            for name in dirs + sorted(files):
+                src = os.path.join(root, name)
+                self._add(
+                    self._name(os.path.join(destination, relroot, name)),
+                    src, os.lstat(src)
+                )
+
+    def _name(self, destination):
+        return './' + os.path.normpath(destination).lstrip('/')
+
+    def installed_size(self):
+        size = sum(st.st_size for _, _, st in self.members
+                   if stat.S_ISREG(st.st_mode))
+        return (size + 1023) // 1024
+
+    def control(self):
+        fields = [
+            ('Package', self.package_name),
+            ('Version', self.version),
+            ('Architecture', self.architecture),
+            ('Maintainer', self.options['maintainer']),
+            ('Installed-Size', self.installed_size()),
+        ]
+        if self.options.get('depends'):
+            fields.append(('Depends', ', '.join(
+                str(dep) for dep in to_iterable(self.options['depends'])
+            )))
+        fields.append(('Description', self.options.get(
+            'description', 'no description given')))
+        return '\n'.join(_control_field(k, v) for k, v in fields) + '\n'
+
+    @property
+    def reproducible(self):
+        return self.epoch is not None
+
+    def _now(self):
+        if self.reproducible:
+            return self.epoch
+        return int(time.time())
+
+    def _mode(self, st):
+        if not self.reproducible:
+            return stat.S_IMODE(st.st_mode)
+        # only whether a file is executable survives
+        if stat.S_ISLNK(st.st_mode):
+            return 0o777
+        if stat.S_ISDIR(st.st_mode) or st.st_mode & 0o111:
+            return 0o755
+        return 0o644
+
+    def _tarinfo(self, name, src, st):
+        info = tarfile.TarInfo(name)
+        info.uid = info.gid = 0
+        info.uname = self.user
+        info.gname = self.group
+        if st is None:
+            # a directory leading to the files added
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            info.mtime = self._now()
+            return info
+
+        info.mode = self._mode(st)
+        info.mtime = int(st.st_mtime)
+        if self.reproducible:
+            info.mtime = min(info.mtime, self.epoch)
+        if stat.S_ISDIR(st.st_mode):
+            info.type = tarfile.DIRTYPE
+        elif stat.S_ISLNK(st.st_mode):
+            info.type = tarfile.SYMTYPE
+            info.linkname = os.readlink(src)
+        else:
+            info.size = st.st_size
+        return info
+
+    def _entry(self, name, src, st):
+        info = self._tarinfo(name, src, st)
+        return Entry(name, src, st, info, info.tobuf(tarfile.GNU_FORMAT))
+
+    def _parent_entries(self):
+        root = self._entry('./', None, None)
+        root.info.uname = root.info.gname = 'root'
+        root = root._replace(header=root.info.tobuf(tarfile.GNU_FORMAT))
+        return [root] + [self._entry(name, None, None)
+                         for name in sorted(self.parents)]
+
+    def _segments(self, entries):
+        segments = []
+        current = []
+        size = 0
+        for entry in entries:
+            current.append(entry)
+            size += len(entry.header) + entry.info.size
+            if size >= SEGMENT_SIZE and _boundary(entry.name):
+                segments.append(current)
+                current = []
+                size = 0
+        if current:
+            segments.append(current)
+        return segments
+
+    def _segment_key(self, segment, files):
+        """ Return the key of the bytes segment is written as: the headers
+        of its members and the sha1 of its files, as given by files when
+        their size and mtime match. None when one of them is unknown. """
+        sha = hashlib.sha1()
+        for entry in segment:
+            sha.update(entry.header)
+            if entry.info.isreg():
+                known = files.get(entry.name)
+                if known is None or \
+                        known[:2] != [entry.st.st_size, entry.st.st_mtime]:
+                    return None
+                sha.update(known[2].encode('ascii'))
+        return sha.hexdigest()
+
+    def _write_tar(self, writer, entries):
+        """ Write the tar members of entries to writer, recording the sha1
+        of the files in the manifest. """
+        for entry in entries:
+            writer.write(entry.header)
+            if not entry.info.isreg():
+                continue
+            sha = hashlib.sha1()
+            with open(entry.src, 'rb') as f:
+                remaining = entry.info.size
+                while remaining:
+                    chunk = f.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        raise IOError("%s shrank while being written" %
+                                      entry.src)
+                    sha.update(chunk)
+                    writer.write(chunk)
+                    remaining -= len(chunk)
+            writer.write(_padding(entry.info.size))
+            self.manifest.files[entry.name] = [
+                entry.st.st_size, entry.st.st_mtime, sha.hexdigest()
+            ]
+
+    def _write_stream(self, fileobj, entries, jobs=1):
+        writer = compression.writer(fileobj, self.compression, self.level,
+                                    jobs, self.reproducible)
+        self._write_tar(writer, entries)
+        writer.close()
+
+    def _write_segments(self, fileobj, parents, segments, keys, previous):
+        """ Write parents and segments as separate streams, copying those of
+        previous with the same key from the package it describes. """
+        reusable = {}
+        if previous is not None and \
+                previous.settings[1:4] == self.manifest.settings[1:4]:
+            reusable = dict((key, (offset, length))
+                            for key, offset, length in previous.segments
+                            if key is not None)
+
+        self._write_stream(fileobj, parents)
+        reused = 0
+        old = None
+        try:
+            for segment, key in zip(segments, keys):
+                offset = fileobj.tell()
+                if key in reusable:
+                    if old is None:
+                        old = open(previous.deb[0], 'rb')
+                    old.seek(reusable[key][0])
+                    _copy(old, fileobj, reusable[key][1])
+                    reused += 1
+                    for entry in segment:
+                        if entry.info.isreg():
+                            self.manifest.files[entry.name] = \
+                                previous.files[entry.name]
+                else:
+                    self._write_stream(fileobj, segment, self.jobs)
+                    key = self._segment_key(segment, self.manifest.files)
+                self.manifest.segments.append(
+                    [key, offset, fileobj.tell() - offset]
+                )
+        finally:
+            if old is not None:
+                old.close()
+
+        writer = compression.writer(fileobj, self.compression, self.level,
+                                    reproducible=self.reproducible)
+        writer.write(TAR_END)
+        writer.close()
+        if previous is not None:
+            logger.info("Reused %d of %d segments of %s", reused,
+                        len(segments), previous.deb[0])
+
+    def _write_data(self, fileobj, parents, segments, keys, previous):
+        """ Write the data.tar member, its size patched into its header once
+        the compressed stream is written. """
+        name = 'data.tar' + compression.EXTENSIONS[self.compression]
+        header_offset = fileobj.tell()
+        fileobj.write(_ar_header(name, 0, 0))
+        start = fileobj.tell()
+
+        if self.compression in SEGMENTED:
+            self._write_segments(fileobj, parents, segments, keys, previous)
+        else:
+            writer = compression.writer(fileobj, self.compression,
+                                        self.level, self.jobs,
+                                        self.reproducible)
+            self._write_tar(writer, parents)
+            for segment in segments:
+                self._write_tar(writer, segment)
+                self.manifest.segments.append(
+                    [self._segment_key(segment, self.manifest.files),
+                     None, None]
+                )
+            writer.write(TAR_END)
+            writer.close()
+
+        end = fileobj.tell()
+        size = end - start
+        fileobj.seek(header_offset)
+        fileobj.write(_ar_header(name, size, self._now()))
+        fileobj.seek(end)
+        if size % 2:
+            fileobj.write(b'\n')
+
+    def _write_member(self, fileobj, name, data):
+        fileobj.write(_ar_header(name, len(data), self._now()))
+        fileobj.write(data)
+        if len(data) % 2:
+            fileobj.write(b'\n')
+
+    def _control_tar(self, control):
+        buf = io.BytesIO()
+        writer = compression.writer(buf, 'gz')
+        tar = tarfile.open(fileobj=writer, mode='w|',
+                           format=tarfile.GNU_FORMAT)
+        control = control.encode('utf-8')
+        info = tarfile.TarInfo('./control')
+        info.size = len(control)
+        info.mode = 0o644
+        info.mtime = self._now()
+        tar.addfile(info, io.BytesIO(control))
+        tar.close()
+        writer.close()
+        return buf.getvalue()
+
+    def _report(self, previous):
+        """ Log how the files of the package differ from those of the
+        previous one. """
+        files = dict((name, [st.st_size, st.st_mtime])
+                     for name, _, st in self.members
+                     if stat.S_ISREG(st.st_mode))
+        added = sorted(set(files) - set(previous.files))
+        removed = sorted(set(previous.files) - set(files))
+        changed = sorted(name for name in files if name in previous.files and
+                         previous.files[name][:2] != files[name])
+        logger.info("%s: %d files changed, %d added and %d removed since "
+                    "the previous build", self.package_name, len(changed),
+                    len(added), len(removed))
+        for label, names in [('changed', changed), ('added', added),
+                             ('removed', removed)]:
+            for name in names:
+                logger.debug("%s %s", label, name)
+
+    def write(self, path, manifest_path=None, incremental=True):
+        """ Write the package to path, replacing it once complete. The
+        manifest of the package is kept at manifest_path; unless incremental
+        is False, the package recorded there is reused. """
+        previous = None
+        if manifest_path is not None and incremental:
+            previous = Manifest.load(manifest_path)
+
+        control = self.control()
+        parents = self._parent_entries()
+        members = self.members
+        if self.reproducible:
+            members = sorted(members)
+        segments = self._segments(self._entry(*member) for member in members)
+        keys = [self._segment_key(segment, previous.files if previous else {})
+                for segment in segments]
+        self.manifest = Manifest()
+        self.manifest.settings = [control, self.compression, self.level,
+                                  self.reproducible, self.epoch]
+        self.manifest.parents = sorted(self.parents)
+
+        if previous is not None:
+            if previous.deb[0] == path and \
+                    previous.settings == self.manifest.settings and \
+                    previous.parents == self.manifest.parents and \
+                    None not in keys and previous.keys() == keys:
+                logger.info("%s is unchanged", path)
+                self.path = path
+                self.manifest = previous
+                self.unchanged = True
+                return
+            self._report(previous)
+
+        tmp_path = '%s.tmp' % path
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(AR_MAGIC)
+                self._write_member(f, 'debian-binary', DEB_VERSION)
+                self._write_member(f, 'control.tar.gz',
+                                   self._control_tar(control))
+                self._write_data(f, parents, segments, keys, previous)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise DebCreationFailure("Could not write %s: %s" % (path, e))
+        self.path = path
+
+        if manifest_path is not None:
+            st = os.stat(path)
+            self.manifest.deb = [path, st.st_size, st.st_mtime]
+            self.manifest.save(manifest_path)
 
     @classmethod
     def create(cls, project_root, package_name, target_directory, files,
-               options, dir_mappings):
-        # bzip compresses better, but takes a little longer
-        if 'deb-compression' not in options:
-            options['deb-compression'] = 'bzip2'
-
-        with NamedTemporaryFile(prefix='%s-includes-' % package_name) as f:
-            deb = Deb(package_name, files, options, dir_mappings)
-            srcs = deb.create_mapping(project_root, target_directory, files)
-            deb.write_mapping(f, srcs)
-
-            cmd = 'fpm --output-type deb {user_options} ' \
-                  '--name {package_name} ' \
-                  '--input-type dir ' \
-                  '--inputs {src_input}'.format(
-                    user_options=deb.options_str,
-                    package_name=package_name,
-                    src_input=f.name
-                  )
-            if dir_mappings:
-                cmd += ' %s' % ' '.join(dir_mappings)
-
-            ret = Command(cmd).run()
-            if ret:
-                raise DebCreationFailure()
-            return deb
+               options, dir_mappings, directory=None, level=None,
+               jobs=None, manifest_path=None, incremental=True, epoch=None):
+        """ Write the package of files, installed under target_directory at
+        their path relative to project_root, and of the directories of
+        dir_mappings, given as 'source/=destination'. The package is written
+        in directory, the current directory by default, compressed at level
+        by up to jobs threads. See write() for the manifest. Given an epoch,
+        the package is reproducible: the same files give the same bytes. """
+        deb = Deb(package_name, options, level, jobs, epoch)
+        try:
+            for filename in sorted(files):
+                deb.add(filename, os.path.join(
+                    target_directory, os.path.relpath(filename, project_root)
+                ))
+            for dir_mapping in dir_mappings:
+                source_dir, target_dir = dir_mapping.split('=', 1)
+                deb.add_tree(source_dir.rstrip('/'), target_dir)
+        except OSError as e:
+            raise DebCreationFailure("Could not read %s: %s" %
+                                     (e.filename, e.strerror))
+
+        deb.write(os.path.join(directory or os.getcwd(), deb.filename),
+                  manifest_path, incremental)
+        if not deb.unchanged:
+            logger.info("Wrote %s", deb.path)
+        return deb
@@ -14,6 +14,10 @@ class DuplicateTargetError(BuildConfigError):
     pass
 
 
+class DependencyCycleError(BuildConfigError):
+    pass
+
+
 class VirtualenvCreationFailure(BuildError):
     pass
 
@@ -0,0 +1,227 @@
+import os
+import re
+import time
+
+
+# directory -> (stat, subdirectories, files), shared by every expansion.
+# A directory's mtime changes whenever an entry is added to it or removed
+# from it, so a listing stays valid while the directory's stat is unchanged,
+# even across targets creating files. As git does for its index, a listing
+# taken in the same tick as the mtime it recorded is not trusted, since an
+# entry could still have been added within that tick.
+_listings = {}
+
+# seconds an mtime must be older than its listing for the listing to be reused
+RACY_SECONDS = 2
+# listings kept at most, as the daemon and watch sessions live long
+MAX_LISTINGS = 100000
+
+
+def _stat_key(st):
+    return (st.st_mtime, st.st_ino, st.st_dev, st.st_size)
+
+
+def _list(directory):
+    """ Return the names of the subdirectories and of the other entries of
+    directory. Symbolic links to directories are entries, not subdirectories,
+    so they are never walked into and link cycles cannot trap the walk. """
+    try:
+        st = os.stat(directory)
+    except OSError:
+        _listings.pop(directory, None)
+        return [], []
+    key = _stat_key(st)
+    cached = _listings.get(directory)
+    if cached is not None and cached[0] == key:
+        return cached[1], cached[2]
+
+    listed_at = time.time()
+    dirs = []
+    files = []
+    if hasattr(os, 'scandir'):
+        # the entry type comes with the listing, without a stat per entry
+        for entry in os.scandir(directory):
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entry.name)
+            else:
+                files.append(entry.name)
+    else:
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                dirs.append(name)
+            else:
+                files.append(name)
+
+    if listed_at - st.st_mtime > RACY_SECONDS:
+        if len(_listings) >= MAX_LISTINGS:
+            _listings.clear()
+        _listings[directory] = (key, dirs, files)
+    else:
+        _listings.pop(directory, None)
+    return dirs, files
+
+
+def _is_wild(segment):
+    return any(c in segment for c in '*?[')
+
+
+def _absolute(directory, globs):
+    return [os.path.normpath(os.path.join(directory, g)) for g in globs]
+
+
+def _bases(patterns):
+    """ Return the directories to walk for patterns, mapped to how many levels
+    below them to look, or None for no limit. Directories below another one
+    to walk are walked as part of it. """
+    bases = {}
+    for pattern in patterns:
+        segments = pattern.strip('/').split('/')
+        wild = [i for i, segment in enumerate(segments) if _is_wild(segment)]
+        if not wild:
+            # a plain path, looked at from its directory
+            first = len(segments) - 1
+        else:
+            first = wild[0]
+        base = '/' + '/'.join(segments[:first])
+        depth = None if '**' in segments else len(segments) - first
+        if base in bases:
+            if bases[base] is not None and depth is not None:
+                depth = max(bases[base], depth)
+            else:
+                depth = None
+        bases[base] = depth
+
+    def covered(base):
+        for other, depth in bases.items():
+            if other != base and base.startswith(other.rstrip('/') + '/'):
+                below = base[len(other.rstrip('/')):].count('/')
+                if depth is None or (bases[base] is not None and
+                                     depth >= below + bases[base]):
+                    return True
+        return False
+
+    return dict((b, d) for b, d in bases.items() if not covered(b))
+
+
+def expand(directory, file_globs, exclude_globs=None):
+    """ Return the set of absolute paths matched by file_globs and not by
+    exclude_globs. Relative globs are expanded from directory. The working
+    directory is left alone, as it is shared by all targets running at the
+    same time.
+
+    All globs are compiled into a single matcher and the tree is walked once.
+    Directories excluded with everything below them, like '**/test/**', are
+    not entered.
+
+    This differs from glob2, which fusilly used before:
+    - Symbolic links to directories are matched as entries but not walked
+      into, as the BUILD file discovery does. glob2 followed them and never
+      returned on a link cycle.
+    - Entries whose name starts with a dot, at any depth, are only matched by
+      a pattern component starting with a dot. glob2 only left them out at
+      the top of the walk. """
+    patterns = _absolute(directory, file_globs)
+    if not patterns:
+        return set()
+    excludes = _absolute(directory, exclude_globs or [])
+    include = _compile(patterns)
+    exclude = _compile(excludes)
+    prune = _compile([e[:-len('/**')] for e in excludes if e.endswith('/**')])
+    # hidden directories can only match patterns naming them
+    hidden = any(segment.startswith('.') and segment not in ('.', '..')
+                 for p in patterns for segment in p.split('/'))
+
+    def wanted(path):
+        return include.match(path) and not (exclude and exclude.match(path))
+
+    matched = set()
+    for base, depth in _bases(patterns).items():
+        pending = [(base, 0)]
+        while pending:
+            current, level = pending.pop()
+            dirs, files = _list(current)
+            for name in files:
+                path = os.path.join(current, name)
+                if wanted(path):
+                    matched.add(path)
+            for name in dirs:
+                path = os.path.join(current, name)
+                if wanted(path):
+                    matched.add(path)
+                if depth is not None and level + 1 >= depth:
+                    continue
+                if prune and prune.match(path):
+                    continue
+                if name.startswith('.') and not hidden:
+                    continue
+                pending.append((path, level + 1))
+    return matched
+
+
+def _translate_segment(segment):
+    """ Regex matching a single path component against a glob component.
+    Wildcards do not match a leading dot, as with glob(). """
+    regex = ''
+    i = 0
+    while i < len(segment):
+        c = segment[i]
+        if c == '*':
+            regex += '[^/]*'
+        elif c == '?':
+            regex += '[^/]'
+        elif c == '[':
+            end = segment.find(']', i + 1)
+            if end == -1:
+                regex += re.escape(c)
+            else:
+                chars = segment[i + 1:end]
+                if chars.startswith('!'):
+                    chars = '^' + chars[1:]
+                regex += '[%s]' % chars.replace('\\', '\\\\')
+                i = end
+        else:
+            regex += re.escape(c)
+        i += 1
+    if segment[:1] in ('*', '?', '['):
+        regex = '(?!\\.)' + regex
+    return regex
+
+
+def translate(pattern):
+    """ Return a regex matching the absolute paths matched by the absolute
+    glob pattern. A '**' component matches any number of directories. """
+    segments = pattern.strip('/').split('/')
+    regex = ''
+    for i, segment in enumerate(segments):
+        last = i == len(segments) - 1
+        if segment == '**':
+            regex += '(?:(?!\\.)[^/]*(?:/|$))*' if last else \
+                '(?:(?!\\.)[^/]*/)*'
+        else:
+            regex += _translate_segment(segment) + ('' if last else '/')
+    return '/' + regex + '$'
+
+
+def _compile(patterns):
+    """ Compile absolute glob patterns into a single regex, or None. """
+    if not patterns:
+        return None
+    return re.compile('|'.join('(?:%s)' % translate(p) for p in patterns))
+
+
+def matcher(directory, file_globs, exclude_globs=None):
+    """ Return a function telling whether a path is matched by file_globs and
+    not by exclude_globs, without looking at the filesystem, so that it also
+    applies to paths that no longer exist. Relative globs are relative to
+    directory. """
+    include = _compile(_absolute(directory, file_globs))
+    exclude = _compile(_absolute(directory, exclude_globs or []))
+
+    def match(path):
+        path = os.path.abspath(path)
+        if include is None or not include.match(path):
+            return False
+        return exclude is None or not exclude.match(path)
+
+    return match
@@ -0,0 +1,152 @@
+import os
+import time
+
+from fusilly.cache import read_json, write_json_atomic
+from fusilly.command import Command
+from fusilly.exceptions import FusillyConfigError
+from fusilly.globbing import RACY_SECONDS
+
+
+class TargetIndex(object):
+    """ Persisted map of target name to the BUILD file defining it, relative
+    to the project root. It is rewritten whenever all BUILD files are loaded
+    and lets a single target be loaded without executing every BUILD file.
+
+    The index is only a hint: a BUILD file it points to that no longer
+    defines the target is detected by the loader, which then falls back to
+    loading everything.
+    """
+
+    def __init__(self, project_root, cache_dir):
+        self.project_root = project_root
+        self.path = os.path.join(cache_dir, 'target-index.json')
+        self.targets = None
+
+    def _load(self):
+        if self.targets is None:
+            self.targets = read_json(self.path) or {}
+        return self.targets
+
+    def lookup(self, name):
+        """ Return the absolute path of the BUILD file defining the named
+        target, or None if unknown. """
+        relpath = self._load().get(name)
+        if relpath is None:
+            return None
+        return os.path.join(self.project_root, relpath)
+
+    def names(self):
+        """ Return the names of the indexed targets. """
+        return sorted(self._load())
+
+    def update(self, targets):
+        """ Replace the index with the BUILD files of targets, a mapping of
+        name to target. """
+        targets = dict(
+            (name, os.path.relpath(target.buildFile.path, self.project_root))
+            for name, target in targets.iteritems()
+            if target.buildFile is not None
+        )
+        if targets != self._load():
+            write_json_atomic(self.path, targets)
+        self.targets = targets
+
+
+class DiscoveryIndex(object):
+    """ Persisted record of the directories of a project, the subdirectories
+    worth descending into and whether each holds a BUILD file.
+
+    A directory's mtime changes whenever an entry is added to it or removed
+    from it, so only directories whose mtime differs from the recorded one
+    are listed again. Everything else is answered from the index at the cost
+    of a stat. A directory listed within RACY_SECONDS of its mtime could
+    still have had an entry added without its mtime changing, so it is
+    listed again on the next run.
+    """
+
+    def __init__(self, project_root, cache_dir, build_file, ignore_paths):
+        self.project_root = project_root
+        self.path = os.path.join(cache_dir, 'build-file-index.json')
+        self.build_file = build_file
+        self.ignore_paths = sorted(ignore_paths)
+
+    def _skip(self, name):
+        # skip over hidden directories and configured paths, like vendored
+        # go dependencies that contain their own BUILD files.
+        return name.startswith('.') or name in self.ignore_paths
+
+    def _list(self, directory):
+        subdirs = []
+        has_build_file = False
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name == self.build_file:
+                has_build_file = True
+            elif not self._skip(name) and os.path.isdir(path) and \
+                    not os.path.islink(path):
+                subdirs.append(name)
+        return sorted(subdirs), has_build_file
+
+    def build_files(self):
+        """ Return the paths of all BUILD files under the project root,
+        updating the persisted index for directories that changed. """
+        index = read_json(self.path)
+        if index is None or index['ignore_paths'] != self.ignore_paths:
+            index = {'ignore_paths': self.ignore_paths, 'dirs': {}}
+        known = index['dirs']
+        dirs = {}
+        build_files = []
+        changed = False
+
+        pending = ['']
+        while pending:
+            relpath = pending.pop()
+            directory = os.path.join(self.project_root, relpath)
+            try:
+                mtime = os.stat(directory).st_mtime
+            except OSError:
+                changed = True
+                continue
+
+            entry = known.get(relpath)
+            if entry is None or entry[0] != mtime:
+                listed_at = time.time()
+                subdirs, has_build_file = self._list(directory)
+                if listed_at - mtime <= RACY_SECONDS:
+                    # no mtime matches, so it is not trusted next time
+                    entry = [None, subdirs, has_build_file]
+                else:
+                    entry = [mtime, subdirs, has_build_file]
+                changed = True
+            dirs[relpath] = entry
+
+            _, subdirs, has_build_file = entry
+            if has_build_file:
+                build_files.append(os.path.join(directory, self.build_file))
+            pending.extend(os.path.join(relpath, d) for d in subdirs)
+
+        if changed or len(dirs) != len(known):
+            index['dirs'] = dirs
+            write_json_atomic(self.path, index)
+        return sorted(build_files)
+
+
+def git_build_files(project_root, build_file, ignore_paths):
+    """ Return the paths of the BUILD files git knows about: tracked files and
+    untracked files that are not ignored. Nothing is walked. """
+    cmd = 'git ls-files -z --cached --others --exclude-standard -- *%s' % (
+        build_file
+    )
+    ret, stdout = Command(cmd, project_root).run(capture_stdout=True)
+    if ret != 0:
+        raise FusillyConfigError("git ls-files failed in %s" % project_root)
+
+    build_files = set()
+    for relpath in stdout.split('\0'):
+        parts = relpath.split('/')
+        if parts[-1] != build_file:
+            continue
+        if any(p.startswith('.') or p in ignore_paths for p in parts[:-1]):
+            continue
+        build_files.add(os.path.join(project_root, relpath))
+    return sorted(build_files)
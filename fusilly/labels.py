@@ -0,0 +1,29 @@
+from fusilly.exceptions import BuildConfigError
+
+
+def parse_label(label):
+    """ Split a target label into the directory of the BUILD file defining
+    the target, relative to the project root, and the target name.
+
+        //services/api:artifact -> ('services/api', 'artifact')
+        //services/api          -> ('services/api', 'api')
+        //:artifact             -> ('', 'artifact')
+        artifact                -> (None, 'artifact')
+
+    Target names are unique within a project, so a plain name is a label
+    whose package has to be looked up.
+    """
+    if not label.startswith('//'):
+        return None, label
+
+    package, _, name = label[2:].partition(':')
+    package = package.rstrip('/')
+    if not name:
+        name = package.split('/')[-1]
+    if not name:
+        raise BuildConfigError("Invalid target label '%s'" % label)
+    return package, name
+
+
+def target_name(label):
+    return parse_label(label)[1]
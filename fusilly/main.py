@@ -2,13 +2,21 @@
 
 import argparse
 import logging
+import os
 import signal
 import sys
+import time
 
+import fusilly
 from fusilly.command import Command
 from fusilly.buildfiles import BuildFiles
+from fusilly.config import get_fusilly_config
+from fusilly.context import Builtins, RunContext
+from fusilly.index import TargetIndex
+from fusilly.plan import BuildPlan
 # pylint: disable=W0611
 from fusilly.targets import Targets
+from fusilly.utils import startup_timings
 
 
 stream_handler = logging.StreamHandler()
@@ -19,47 +27,294 @@ root_logger.addHandler(stream_handler)
 logger = logging.getLogger(__name__)
 
 
-def add_dep_cmdline_opts(parser, target):
-    for dep in target.deps:
-        dep_target = Targets.get(dep)
-        add_dep_cmdline_opts(parser, dep_target)
+# options of the run and watch commands taking a value, which must not be
+# mistaken for the target name on the command line.
+RUN_VALUE_OPTS = ['-j', '--jobs', '--compression-level', '--trace']
 
-    for optname, default_value in target.custom_options.iteritems():
-        option = '--%s' % optname
+
+def requested_target(args):
+    """ Return the position and label of the target named in the arguments of
+    the run or watch command, or (None, None) if there is none. """
+    skip = False
+    for i, arg in enumerate(args):
+        if skip:
+            skip = False
+        elif arg in RUN_VALUE_OPTS:
+            skip = True
+        elif not arg.startswith('-'):
+            return i, arg
+    return None, None
+
+
+def load_build_files(args, buildFiles=None):
+    """ Load the BUILD files needed by the command, which for the run and
+    watch commands is only those defining the requested target and its
+    dependencies, or none when no target is named. Files already loaded by
+    buildFiles are not executed again.
+    """
+    buildFiles = buildFiles or BuildFiles()
+
+    position, label = None, None
+    if args.command in TARGET_COMMANDS:
+        position, label = requested_target(args.args)
+        if label is None:
+            # only the help or an error can be printed, see target_names()
+            return buildFiles
+    if label is None:
+        buildFiles.load()
+        return buildFiles
+
+    buildFiles.load_for(label)
+    target = Targets.get(label)
+    if target is not None:
+        # target subparsers are named after the target, not its label
+        args.args[position] = target.name
+    return buildFiles
+
+
+def target_names(buildFiles):
+    """ Return the names of the targets of the project as recorded by the
+    target index, along with those loaded. Every BUILD file is loaded when
+    there is no index yet. """
+    config = get_fusilly_config()
+    names = set(TargetIndex(config.project_root, config.cache_dir()).names())
+    if not names:
+        buildFiles.load()
+    return sorted(names | set(Targets))
+
+
+def plan_options(plan):
+    """ Return the options of the targets of plan with their defaults. An
+    option defined by several targets appears once, with the default of the
+    first of them to run. """
+    options = []
+    seen = set()
+    for target in plan.targets():
+        for optname, default_value in target.custom_options.iteritems():
+            if optname not in seen:
+                seen.add(optname)
+                options.append((optname, default_value))
+    return options
+
+
+def add_target_subparser(cmd, argParser, plan):
+    """ Add the subparser of the target of plan, taking the options of every
+    target of the plan. """
+    subparsers = argParser.add_subparsers(
+        dest='subparser_name', help='Target to %s' % cmd,
+        parser_class=argparse.ArgumentParser
+    )
+    tp = subparsers.add_parser(
+        plan.target.name, help='%s %s' % (cmd, plan.target.name),
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    for optname, default_value in plan_options(plan):
         # non-empty help to get the ArgumentDefaultsHelpFormatter to show
         # the defaults
-        parser.add_argument(option, type=str, default=default_value, help=' ')
+        tp.add_argument('--%s' % optname, type=str, default=default_value,
+                        help=' ')
+
+
+def add_compression_level_opt(argParser):
+    argParser.add_argument('--compression-level', type=int,
+                           help='compression level of the artifacts built, '
+                                'overriding their own')
+
+
+class TargetArgumentParser(argparse.ArgumentParser):
+    """ Parser of the arguments of a command building a target. The targets
+    of the project are only looked up when the help is printed. """
 
+    def __init__(self, buildFiles, **kwargs):
+        super(TargetArgumentParser, self).__init__(**kwargs)
+        self.buildFiles = buildFiles
 
-def add_target_subparser(cmd, argParser):
-    subparsers = argParser.add_subparsers(dest='subparser_name',
-                                          help='Target to run')
-    for target in Targets.itervalues():
-        tp = subparsers.add_parser(
-            target.name, help='%s %s' % (cmd, target.name),
-            formatter_class=argparse.ArgumentDefaultsHelpFormatter
-        )
-        add_dep_cmdline_opts(tp, target)
+    def format_help(self):
+        text = super(TargetArgumentParser, self).format_help()
+        names = target_names(self.buildFiles)
+        if not names:
+            return text
+        return text + '\ntargets:\n' + ''.join('  %s\n' % name
+                                               for name in names)
 
 
-def run_target(programArgs):
-    argParser = argparse.ArgumentParser(description='Run target')
-    add_target_subparser('run', argParser)
+def target_parser(cmd, description, args, buildFiles):
+    """ Return the parser of the arguments of a command building a target.
+    The target named in args is looked up first, so that only it and its
+    dependencies add their options to the parser. """
+    argParser = TargetArgumentParser(buildFiles, description=description)
+    argParser.add_argument('-j', '--jobs', type=int, default=1,
+                           help='number of targets to run concurrently')
+    argParser.add_argument('--no-cache', action='store_true',
+                           help='run all targets, ignoring cached results')
+    add_compression_level_opt(argParser)
+
+    _, name = requested_target(args)
+    target = Targets.get(name) if name is not None else None
+    if target is not None:
+        add_target_subparser(cmd, argParser, BuildPlan(target))
 
     argParser.add_argument('args', nargs=argparse.REMAINDER)
-    subArgs = argParser.parse_args(programArgs.args)
+    return argParser
+
+
+def parse_target_args(argParser, args):
+    subArgs = argParser.parse_args(args)
+    if getattr(subArgs, 'subparser_name', None) is None:
+        _, name = requested_target(args)
+        if name is None:
+            argParser.error("no target given, see --help for the targets")
+        argParser.error("unknown target '%s'" % name)
+    return subArgs
+
+
+def build_cache(subArgs):
+    from fusilly.cache import BuildCache
+
+    if subArgs.no_cache:
+        return None
+    return BuildCache(get_fusilly_config().cache_dir())
+
+
+def run_target(programArgs, buildFiles):
+    from fusilly.scheduler import Scheduler
+
+    argParser = target_parser('run', 'Run target', programArgs.args,
+                              buildFiles)
+    argParser.add_argument('--trace', metavar='PATH',
+                           help='write the time each target took to PATH as '
+                                'Chrome trace events')
+    subArgs = parse_target_args(argParser, programArgs.args)
     target_name = subArgs.subparser_name
     target = Targets.get(target_name)
+    plan = BuildPlan(target)
 
-    if target._check():
+    if plan.check():
         sys.exit(1)
 
     logger.info("Building %s...", target.name)
 
+    cache = build_cache(subArgs)
+    scheduler = Scheduler(plan, subArgs, jobs=subArgs.jobs, cache=cache)
+    try:
+        scheduler.run()
+    finally:
+        plan.cleanup()
+        if cache is not None:
+            cache.save()
+        scheduler.trace.log_summary(logger, plan)
+        if subArgs.trace:
+            scheduler.trace.write(subArgs.trace)
+            logger.info("Wrote trace to %s", subArgs.trace)
+
+
+def watch_target(programArgs, buildFiles):
+    from fusilly.watch import WatchSession
+
+    argParser = target_parser(
+        'watch', 'Run target, then run again the targets affected by each '
+                 'change to the files they use', programArgs.args, buildFiles
+    )
+    subArgs = parse_target_args(argParser, programArgs.args)
+    session = WatchSession(buildFiles, subArgs.subparser_name, subArgs,
+                           jobs=subArgs.jobs, cache=build_cache(subArgs))
+    sys.exit(session.run())
+
+
+def plan_args(plan, subArgs):
+    """ Return the arguments the targets of plan are run with when they are
+    not given on the command line: the defaults of their options. """
+    args = argparse.Namespace(subparser_name=plan.target.name, args=[],
+                              jobs=subArgs.jobs, no_cache=subArgs.no_cache,
+                              compression_level=subArgs.compression_level)
+    for optname, default_value in plan_options(plan):
+        if not hasattr(args, optname):
+            setattr(args, optname, default_value)
+    return args
+
+
+def run_affected(programArgs, buildFiles):
+    from fusilly.affected import affected_targets, changed_files, roots
+    from fusilly.scheduler import Scheduler
+
+    argParser = argparse.ArgumentParser(
+        description='Print the targets affected by the files changed since a '
+                    'revision, or run them'
+    )
+    argParser.add_argument('--since', required=True,
+                           help='git revision to compare the working tree to')
+    argParser.add_argument('--run', action='store_true',
+                           help='run the affected targets')
+    argParser.add_argument('-j', '--jobs', type=int, default=1,
+                           help='number of targets to run concurrently')
+    argParser.add_argument('--no-cache', action='store_true',
+                           help='run all targets, ignoring cached results')
+    add_compression_level_opt(argParser)
+    subArgs = argParser.parse_args(programArgs.args)
+
+    paths = changed_files(get_fusilly_config().project_root, subArgs.since)
+    names = affected_targets(paths)
+    if not subArgs.run:
+        for name in sorted(names):
+            print(name)
+        return
+
+    cache = build_cache(subArgs)
+    outputs = {}
+    plans = []
+    # the repository is read once for all the targets
+    builtins = Builtins()
     try:
-        target._run(subArgs, {})
+        for name in roots(names):
+            plan = BuildPlan(Targets.get(name))
+            plans.append(plan)
+            if plan.check():
+                sys.exit(1)
+
+            logger.info("Building %s...", name)
+            # targets shared with the targets built before are not run again
+            context = RunContext(plan_args(plan, subArgs), builtins)
+            scheduler = Scheduler(plan, context,
+                                  jobs=subArgs.jobs, cache=cache,
+                                  outputs=outputs)
+            scheduler.run()
+            outputs = scheduler.outputs
     finally:
-        target._cleanup()
+        done = set()
+        for plan in plans:
+            plan.cleanup(done)
+        if cache is not None:
+            cache.save()
+
+
+def run_daemon(programArgs, buildFiles):
+    from fusilly.client import socket_path
+    from fusilly.daemon import Daemon, DaemonError
+    # imported once here rather than by every request forked from the daemon
+    # pylint: disable=W0612
+    from fusilly import affected, cache, scheduler, watch   # noqa
+
+    argParser = argparse.ArgumentParser(
+        description='Keep the BUILD files loaded and run the commands of '
+                    'fusilly clients'
+    )
+    argParser.parse_args(programArgs.args)
+
+    config = get_fusilly_config()
+    config_file = os.path.join(config.project_root, '.fusilly.toml')
+
+    def handle(argv):
+        # the timings of the daemon's own startup do not apply
+        del startup_timings.durations[:]
+        dispatch(parse_args(argv), buildFiles)
+
+    daemon = Daemon(socket_path(config.cache_dir()), buildFiles, handle,
+                    config_files=[config_file])
+    try:
+        daemon.serve()
+    except DaemonError as e:
+        logger.error("%s", e)
+        sys.exit(1)
 
 
 def signal_handler(sig, frame):
@@ -68,14 +323,18 @@ def signal_handler(sig, frame):
     sys.exit(1)
 
 
-def main():
-    signal.signal(signal.SIGTERM, signal_handler)
-    signal.signal(signal.SIGINT, signal_handler)
+COMMANDS = {
+    'affected': run_affected,
+    'daemon': run_daemon,
+    'run': run_target,
+    'watch': watch_target,
+}
+
+# commands given a target on the command line
+TARGET_COMMANDS = ['run', 'watch']
 
-    COMMANDS = {
-        'run': run_target,
-    }
 
+def parse_args(argv=None):
     argParser = argparse.ArgumentParser(
         description='Interact with targets defined in fusilly BUILD files'
     )
@@ -83,14 +342,29 @@ def main():
     argParser.add_argument('--logging', choices=['info', 'warn', 'debug'],
                            help='log level', default='info')
     argParser.add_argument('args', nargs=argparse.REMAINDER)
-    args = argParser.parse_args()
+    return argParser.parse_args(argv)
 
+
+def dispatch(args, buildFiles=None):
     root_logger.setLevel(args.logging.upper())
 
-    buildFiles = BuildFiles()
-    buildFiles.load()
+    with startup_timings.measure('build files'):
+        buildFiles = load_build_files(args, buildFiles)
+    startup_timings.log(logger, 'Startup')
+
+    COMMANDS[args.command](args, buildFiles)
+
+
+def main():
+    signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGINT, signal_handler)
+
+    args = parse_args()
 
-    COMMANDS[args.command](args)
+    # the config is loaded while importing, so don't count it twice
+    measured = sum(seconds for _, seconds in startup_timings.durations)
+    startup_timings.add('imports', time.time() - fusilly.IMPORT_TIME - measured)
+    dispatch(args)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,103 @@
+import logging
+
+from fusilly.exceptions import BuildConfigError, DependencyCycleError
+from fusilly.targets import Targets
+
+
+logger = logging.getLogger(__name__)
+
+
+class BuildPlan(object):
+    """ The set of targets needed to build a target, each appearing once no
+    matter how many paths lead to it, ordered so that every target comes after
+    its dependencies. """
+
+    def __init__(self, target):
+        self.target = target
+        self.order = self._toposort()
+
+        self.dependents = dict((name, []) for name in self.order)
+        for name in self.order:
+            for depname in self.deps(name):
+                self.dependents[depname].append(name)
+
+    def deps(self, name):
+        """ Return the names of the distinct dependencies of the named target,
+        in the order they are listed. """
+        deps = []
+        for label in Targets.get(name).deps:
+            depname = Targets.get(label).name
+            if depname not in deps:
+                deps.append(depname)
+        return deps
+
+    def _lookup(self, label, parent):
+        target = Targets.get(label)
+        if target is None:
+            raise BuildConfigError(
+                "Target '%s' depends on unknown target '%s'" % (parent, label)
+            )
+        return target
+
+    def _toposort(self):
+        """ Depth first walk of the dependency graph. The walk keeps its own
+        stack so that deep graphs do not run into the recursion limit and so
+        that the chain of targets forming a cycle can be reported. """
+        order = []
+        done = set()
+        path = [self.target.name]
+        stack = [iter(self.target.deps)]
+
+        while stack:
+            label = next(stack[-1], None)
+            if label is None:
+                stack.pop()
+                name = path.pop()
+                if name not in done:
+                    done.add(name)
+                    order.append(name)
+                continue
+
+            target = self._lookup(label, path[-1])
+            if target.name in done:
+                continue
+            if target.name in path:
+                chain = path[path.index(target.name):] + [target.name]
+                raise DependencyCycleError(
+                    "Dependency cycle: %s" % ' -> '.join(chain)
+                )
+
+            path.append(target.name)
+            stack.append(iter(target.deps))
+
+        return order
+
+    def targets(self):
+        for name in self.order:
+            yield Targets.get(name)
+
+    def check(self):
+        """ Call check() on every target once. Returns the number of targets
+        whose check failed. """
+        failures = 0
+        for target in self.targets():
+            if target.check():
+                logger.error("Check of %s failed",
+                             target._target_name_for_display())
+                failures += 1
+        return failures
+
+    def cleanup(self, done=None):
+        """ Call cleanup() on every target once, whether or not the build
+        succeeded. Targets named in the set done are skipped, and the names
+        of those cleaned up are added to it. """
+        for target in self.targets():
+            if done is not None:
+                if target.name in done:
+                    continue
+                done.add(target.name)
+            try:
+                target.cleanup()
+            except Exception:
+                logger.exception("Cleanup of %s failed",
+                                 target._target_name_for_display())
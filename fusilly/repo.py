@@ -1,25 +1,395 @@
+import binascii
+import hashlib
+import os
+import stat
+import struct
+import zlib
+
 from .command import Command
 
 
+# pack object types stored whole, rather than as a delta of another object
+PACK_TYPES = {1: 'commit', 2: 'tree', 3: 'blob', 4: 'tag'}
+
+# index entry flags
+ASSUME_VALID = 0x8000
+EXTENDED = 0x4000
+SKIP_WORKTREE = 0x4000
+# the mode of submodules
+GITLINK = 0o160000
+
+# environment variables pointing git elsewhere than the files found from the
+# project root
+GIT_ENVIRONMENT = ('GIT_DIR', 'GIT_COMMON_DIR', 'GIT_WORK_TREE',
+                   'GIT_INDEX_FILE', 'GIT_OBJECT_DIRECTORY')
+
+
+def _read(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def _idx_offset(path, binsha):
+    """ Return the offset in its pack of the object binsha, looked up in the
+    version 2 pack index at path, or None if the pack does not hold it. """
+    with open(path, 'rb') as f:
+        header = f.read(8 + 256 * 4)
+        if header[:8] != b'\377tOc\x00\x00\x00\x02':
+            return None
+        fanout = struct.unpack('>256I', header[8:])
+        count = fanout[255]
+        first = ord(binsha[:1])
+        lo = fanout[first - 1] if first else 0
+        hi = fanout[first]
+
+        # the names of the objects starting with the same byte, sorted
+        f.seek(8 + 256 * 4 + lo * 20)
+        names = f.read((hi - lo) * 20)
+        start, end = 0, hi - lo
+        while start < end:
+            middle = (start + end) // 2
+            name = names[middle * 20:middle * 20 + 20]
+            if name < binsha:
+                start = middle + 1
+            elif name > binsha:
+                end = middle
+            else:
+                break
+        else:
+            return None
+
+        offsets = 8 + 256 * 4 + count * 24
+        f.seek(offsets + (lo + middle) * 4)
+        offset, = struct.unpack('>I', f.read(4))
+        if offset & 0x80000000:
+            f.seek(offsets + count * 4 + (offset & 0x7fffffff) * 8)
+            offset, = struct.unpack('>Q', f.read(8))
+        return offset
+
+
+def _pack_object(path, offset):
+    """ Return the type and content of the object at offset in the pack at
+    path, or None if it is stored as a delta. """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        byte = ord(f.read(1))
+        kind = (byte >> 4) & 7
+        size = byte & 15
+        shift = 4
+        while byte & 0x80:
+            byte = ord(f.read(1))
+            size |= (byte & 0x7f) << shift
+            shift += 7
+        if kind not in PACK_TYPES:
+            return None
+
+        decompressor = zlib.decompressobj()
+        data = b''
+        while len(data) < size:
+            chunk = f.read(4096)
+            if not chunk:
+                return None
+            data += decompressor.decompress(chunk)
+        return PACK_TYPES[kind], data[:size]
+
+
+def _index_entries(data):
+    """ Return the entries of the version 2 or 3 git index data as (path,
+    mtime, size, mode, sha, flags) tuples, along with the sha of the tree
+    it was last written as, None when unknown. Returns None for other
+    versions, and for indexes with extensions that must be understood to
+    read them, such as the link to the shared index of a split index. """
+    if data[:4] != b'DIRC':
+        return None
+    version, count = struct.unpack('>II', data[4:12])
+    if version not in (2, 3):
+        return None
+
+    entries = []
+    position = 12
+    for _ in range(count):
+        (_, _, mtime_s, mtime_ns, _, _, mode, _, _,
+         size) = struct.unpack('>10I', data[position:position + 40])
+        sha = binascii.hexlify(data[position + 40:position + 60])
+        flags, = struct.unpack('>H', data[position + 60:position + 62])
+        name_start = position + 62
+        if flags & EXTENDED:
+            extended, = struct.unpack('>H', data[name_start:name_start + 2])
+            if extended & SKIP_WORKTREE:
+                flags |= ASSUME_VALID
+            name_start += 2
+        name_end = data.index(b'\0', name_start)
+        # entries are padded with 1 to 8 NULs to a multiple of 8 bytes
+        position += ((name_end - position) // 8 + 1) * 8
+        entries.append((data[name_start:name_end].decode('utf-8'),
+                        (mtime_s, mtime_ns), size, mode, sha.decode('ascii'),
+                        flags))
+
+    # the cached tree extension starts with the root of the index, whose
+    # sha is only known if no entry changed since the tree was written
+    tree = None
+    end = len(data) - 20
+    while position + 8 <= end:
+        signature = data[position:position + 4]
+        length, = struct.unpack('>I', data[position + 4:position + 8])
+        position += 8
+        # extensions named in upper case may be ignored, others may not
+        if not b'A' <= signature[:1] <= b'Z':
+            return None
+        if signature == b'TREE':
+            root = data[position:position + length]
+            if root[:1] == b'\0':
+                header_end = root.index(b'\n')
+                if not root[1:header_end].startswith(b'-'):
+                    tree = binascii.hexlify(
+                        root[header_end + 1:header_end + 21]
+                    ).decode('ascii')
+        position += length
+    return entries, tree
+
+
 class GitRepo(object):
+    """ What fusilly needs to know about the git repository of a project,
+    read straight from the files under .git rather than by running git.
+    git is only asked what the files cannot tell without reimplementing it,
+    such as objects stored as deltas in packs. Nothing is kept between
+    calls, so the answers are always those of the repository as it is. """
+
     def __init__(self, project_root):
         self.project_root = project_root
-        self._head_sha = None
 
-    def head_sha(self):
-        if self._head_sha is None:
-            ret, stdout = Command('git rev-parse HEAD').run(
-                capture_stdout=True
-            )
-            if ret == 0:
-                self._head_sha = stdout.strip()
+    def _dirs(self):
+        """ Return the work tree, the git directory and the directory shared
+        by all the worktrees of the repository holding the project, or None
+        outside of one or when git is told where they are by the
+        environment. """
+        if any(name in os.environ for name in GIT_ENVIRONMENT):
+            return None
+        work_tree = self.project_root
+        while True:
+            path = os.path.join(work_tree, '.git')
+            if os.path.exists(path):
+                break
+            parent = os.path.dirname(work_tree)
+            if parent == work_tree:
+                return None
+            work_tree = parent
+
+        if os.path.isfile(path):
+            # worktrees and submodules point to their git directory
+            content = (_read(path) or b'').decode('utf-8').strip()
+            if not content.startswith('gitdir:'):
+                return None
+            path = os.path.normpath(os.path.join(
+                work_tree, content[len('gitdir:'):].strip()
+            ))
 
-        return self._head_sha
+        common_dir = path
+        common = _read(os.path.join(path, 'commondir'))
+        if common is not None:
+            common_dir = os.path.normpath(os.path.join(
+                path, common.decode('utf-8').strip()
+            ))
+        return work_tree, path, common_dir
+
+    def _git(self, cmd):
+        ret, stdout = Command(cmd, self.project_root).run(capture_stdout=True)
+        if ret != 0:
+            return None
+        return stdout
+
+    def _packed_ref(self, common_dir, ref):
+        packed = _read(os.path.join(common_dir, 'packed-refs'))
+        if packed is None:
+            return None
+        for line in packed.decode('utf-8').splitlines():
+            if line.startswith('#') or line.startswith('^'):
+                continue
+            sha, _, name = line.partition(' ')
+            if name == ref:
+                return sha
+        return None
+
+    def _resolve(self, dirs, ref):
+        """ Return the sha ref points to and the branch it is, following
+        symbolic refs. """
+        _, git_dir, common_dir = dirs
+        branch = None
+        for _ in range(5):
+            # HEAD is kept by each worktree, branches are shared
+            content = _read(os.path.join(git_dir, ref))
+            if content is None and common_dir != git_dir:
+                content = _read(os.path.join(common_dir, ref))
+            if content is None:
+                return self._packed_ref(common_dir, ref), branch
+
+            content = content.decode('utf-8').strip()
+            if not content.startswith('ref:'):
+                return content, branch
+            ref = content[len('ref:'):].strip()
+            if ref.startswith('refs/heads/'):
+                branch = ref[len('refs/heads/'):]
+        return None, branch
+
+    def _head(self):
+        dirs = self._dirs()
+        # refs of reftable repositories are not kept in files
+        if dirs is not None and \
+                not os.path.isdir(os.path.join(dirs[2], 'reftable')):
+            sha, branch = self._resolve(dirs, 'HEAD')
+            if sha is not None:
+                return sha, branch
+
+        sha = self._git('git rev-parse --verify -q HEAD')
+        if sha is None:
+            return None, None
+        branch = self._git('git symbolic-ref -q --short HEAD')
+        return sha.strip(), branch.strip() if branch else None
+
+    def _object(self, sha):
+        """ Return the type and content of the object named sha, or None if
+        it cannot be read from the files. """
+        dirs = self._dirs()
+        if dirs is None:
+            return None
+        _, _, common_dir = dirs
+        objects = os.path.join(common_dir, 'objects')
+        loose = _read(os.path.join(objects, sha[:2], sha[2:]))
+        if loose is not None:
+            header, _, content = zlib.decompress(loose).partition(b'\0')
+            return header.split(b' ')[0].decode('ascii'), content
+
+        pack_dir = os.path.join(objects, 'pack')
+        if not os.path.isdir(pack_dir):
+            return None
+        binsha = binascii.unhexlify(sha)
+        for name in os.listdir(pack_dir):
+            if not name.endswith('.idx'):
+                continue
+            path = os.path.join(pack_dir, name)
+            offset = _idx_offset(path, binsha)
+            if offset is not None:
+                return _pack_object(path[:-len('.idx')] + '.pack', offset)
+        return None
+
+    def _commit(self, sha):
+        """ Return the headers of the commit named sha, each name mapped to
+        its first value. """
+        obj = self._object(sha)
+        if obj is not None and obj[0] == 'commit':
+            content = obj[1].decode('utf-8', 'replace')
+        else:
+            content = self._git('git cat-file commit %s' % sha)
+            if content is None:
+                return {}
+
+        headers = {}
+        for line in content.split('\n'):
+            if not line:
+                break
+            name, _, value = line.partition(' ')
+            headers.setdefault(name, value)
+        return headers
+
+    def head_sha(self):
+        """ Return the sha of the local HEAD, None outside of a repository or
+        before the first commit. """
+        return self._head()[0]
 
     def head_sha_short(self):
-        if self._head_sha is None:
-            self.head_sha()
-        if self._head_sha is None:
+        sha = self.head_sha()
+        if sha is None:
             return None
+        return sha[:12]
+
+    def branch(self):
+        """ Return the name of the branch checked out, None if HEAD is
+        detached. """
+        return self._head()[1]
+
+    def head_timestamp(self):
+        """ Return the commit time of HEAD in seconds since the epoch. """
+        sha = self.head_sha()
+        if sha is None:
+            return None
+        committer = self._commit(sha).get('committer')
+        if committer is None:
+            return None
+        # Name <email> seconds timezone
+        return int(committer.rsplit(' ', 2)[1])
+
+    def _git_dirty(self):
+        status = self._git('git status --porcelain --untracked-files=no')
+        if status is None:
+            return None
+        return bool(status.strip())
+
+    def _changed(self, path, entry, racy):
+        """ Return whether the file at path differs from its index entry,
+        or None if git has to tell. """
+        _, (mtime_s, mtime_ns), size, mode, sha, _ = entry
+        try:
+            st = os.lstat(path)
+        except OSError:
+            return True
+        if stat.S_ISLNK(st.st_mode) != (stat.S_IFMT(mode) == stat.S_IFLNK):
+            return True
+        if st.st_size != size:
+            return True
+        if stat.S_ISREG(st.st_mode) and (st.st_mode & 0o100) != (mode & 0o100):
+            return True
+        ns = int(round((st.st_mtime - int(st.st_mtime)) * 1e9))
+        if int(st.st_mtime) == mtime_s and abs(ns - mtime_ns) < 1000 and \
+                mtime_s < racy:
+            return False
+
+        # touched, or changed too close to the index being written to tell
+        # by its stat: compare the content
+        if stat.S_ISLNK(st.st_mode):
+            content = os.readlink(path).encode('utf-8')
+        else:
+            content = _read(path)
+            if content is None:
+                return None
+        blob = hashlib.sha1(b'blob %d\0' % len(content) + content)
+        if blob.hexdigest() == sha:
+            return False
+        # filters such as line ending conversions may explain the difference
+        return None
+
+    def is_dirty(self):
+        """ Return whether tracked files differ from HEAD, staged or not, as
+        `git describe --dirty` tells, or None outside of a repository. """
+        if self.head_sha() is None:
+            return None
+        dirs = self._dirs()
+        if dirs is None:
+            return self._git_dirty()
+        work_tree, git_dir, _ = dirs
+        index_path = os.path.join(git_dir, 'index')
+        data = _read(index_path)
+        parsed = _index_entries(data) if data is not None else None
+        head_tree = self._commit(self.head_sha()).get('tree')
+        if parsed is None or parsed[1] is None or head_tree is None:
+            return self._git_dirty()
+
+        entries, tree = parsed
+        if tree != head_tree:
+            return True
 
-        return self._head_sha[:12]
+        # files modified in the second the index was written may still have
+        # its mtime after being changed
+        racy = int(os.stat(index_path).st_mtime)
+        for entry in entries:
+            if entry[3] == GITLINK or entry[5] & ASSUME_VALID:
+                continue
+            changed = self._changed(os.path.join(work_tree, entry[0]), entry,
+                                    racy)
+            if changed is None:
+                return self._git_dirty()
+            if changed:
+                return True
+        return False
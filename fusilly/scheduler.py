@@ -0,0 +1,140 @@
+import logging
+import threading
+from Queue import Empty, Queue
+
+from fusilly.context import RunContext
+from fusilly.targets import Targets
+from fusilly.trace import BuildTrace
+
+
+logger = logging.getLogger(__name__)
+
+# Blocking on a Queue without a timeout cannot be interrupted by signals on
+# python 2, so the scheduler waits in slices to keep ctrl-c working.
+WAIT_TIMEOUT = 60 * 60
+
+
+class Scheduler(object):
+    """ Runs a target and the targets it depends on. Targets whose
+    dependencies have all completed are handed to a bounded pool of worker
+    threads, so independent targets run concurrently.
+
+    Each target receives the combined output of its dependencies, merged in
+    the order the dependencies are listed, so the input of a target does not
+    depend on the order in which its dependencies happened to finish.
+    """
+
+    def __init__(self, plan, programArgs, jobs=1, cache=None, outputs=None):
+        self.plan = plan
+        # shared by all the targets, so the built-in values of templates are
+        # read once
+        self.context = RunContext.of(programArgs)
+        self.jobs = max(1, jobs)
+        self.cache = cache
+        # the output of each target that has run, handed to every target
+        # depending on it. Targets whose output is passed in are not run
+        # again.
+        self.outputs = dict(outputs or {})
+        self.todo = [name for name in plan.order if name not in self.outputs]
+        self.trace = BuildTrace()
+
+    def _inputs(self, target):
+        inputdict = {}
+        for depname in self.plan.deps(target.name):
+            inputdict.update(self.outputs[depname])
+        return inputdict
+
+    def _run_one(self, name):
+        target = Targets.get(name)
+        with self.trace.target(name):
+            return target._run(self.context, self._inputs(target),
+                               cache=self.cache)
+
+    def _run_serial(self):
+        for name in self.todo:
+            self.outputs[name] = self._run_one(name)
+
+    def _worker(self, work, done):
+        while True:
+            name = work.get()
+            if name is None:
+                return
+            try:
+                done.put((name, self._run_one(name), None))
+            # anything a thread lets through ends it silently, so SystemExit
+            # and the like are handed to the main thread too
+            except BaseException as e:
+                logger.debug("Target %s failed", name, exc_info=True)
+                done.put((name, None, e))
+
+    def _run_parallel(self):
+        work = Queue()
+        done = Queue()
+        workers = [
+            threading.Thread(target=self._worker, args=(work, done))
+            for _ in range(min(self.jobs, len(self.todo)))
+        ]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        pending = dict(
+            (name, len([dep for dep in self.plan.deps(name)
+                        if dep not in self.outputs]))
+            for name in self.todo
+        )
+        outstanding = 0
+        failure = None
+
+        try:
+            for name in self.todo:
+                if pending[name] == 0:
+                    work.put(name)
+                    outstanding += 1
+
+            while outstanding:
+                try:
+                    name, outputdict, error = done.get(True, WAIT_TIMEOUT)
+                except Empty:
+                    continue
+                outstanding -= 1
+
+                if error is not None:
+                    # let the targets already running finish, but don't
+                    # start anything new.
+                    if failure is None:
+                        failure = error
+                    continue
+
+                self.outputs[name] = outputdict
+                if failure is not None:
+                    continue
+
+                for dependent in self.plan.dependents[name]:
+                    if dependent not in pending:
+                        continue
+                    pending[dependent] -= 1
+                    if pending[dependent] == 0:
+                        work.put(dependent)
+                        outstanding += 1
+        finally:
+            for _ in workers:
+                work.put(None)
+
+        for worker in workers:
+            worker.join()
+
+        if failure is not None:
+            raise failure
+
+    def run(self):
+        """ Run all targets and return the output of the target being built.
+        """
+        if self.jobs == 1:
+            self._run_serial()
+        else:
+            logger.debug("Running %d targets with %d jobs",
+                         len(self.todo), self.jobs)
+            self._run_parallel()
+
+        return self.outputs[self.plan.target.name]
@@ -3,16 +3,62 @@ import os
 import imp
 from importlib import import_module
 import sys
+import threading
 
 from fusilly.config import get_fusilly_config
 
 from .targets import Target, Targets # noqa
 
 
+class LazyTarget(object):
+    """ Stands in for a *_target function until a BUILD file first calls it,
+    at which point the module defining the function is imported. This keeps
+    the modules of unused targets, and everything they import, out of
+    startup. """
+
+    lock = threading.RLock()
+
+    def __init__(self, func_name, load_module):
+        self.func_name = func_name
+        self.load_module = load_module
+        self.func = None
+
+    def resolve(self):
+        with self.lock:
+            if self.func is None:
+                func = getattr(self.load_module(), self.func_name, None)
+                if func is None:
+                    raise ImportError("target module does not define %s" %
+                                      self.func_name)
+                self.func = func
+                # later lookups through the package get the real function
+                setattr(sys.modules[__name__], self.func_name, func)
+        return self.func
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __repr__(self):
+        return '<lazy target function %s>' % self.func_name
+
+
+def target_modules(directory, ignore_list):
+    return [
+        f.split('.')[0] for f in os.listdir(directory)
+        if os.path.isfile(os.path.join(directory, f)) and
+        f not in ignore_list and f.endswith('.py')
+    ]
+
+
+def register(module_name, load_module):
+    func_name = "%s_target" % module_name
+    setattr(sys.modules[__name__], func_name,
+            LazyTarget(func_name, load_module))
+
+
 def load_internal_targets():
-    """ Load plugins from plugins/ directory in this repository. This could be
-    done with imports, but I got silly on it. Feel free to change.
-    """
+    """ Register the targets of this package. The modules are imported the
+    first time a BUILD file uses their target. """
     cdir = os.path.abspath(os.path.dirname(__file__))
 
     IGNORE_LIST = [
@@ -20,38 +66,32 @@ def load_internal_targets():
         'targets.py',
     ]
 
-    modules = [
-        f.split('.')[0] for f in os.listdir(cdir)
-        if os.path.isfile(os.path.join(cdir, f)) and
-        f not in IGNORE_LIST and f.endswith('.py')
-    ]
-
-    for module_name in modules:
-        func_name = "%s_target" % module_name
-        module = import_module('.%s' % module_name, 'fusilly.targets')
-        target_func = getattr(module, func_name)
-        if target_func:
-            setattr(sys.modules['fusilly.targets'], func_name, target_func)
+    for module_name in target_modules(cdir, IGNORE_LIST):
+        register(
+            module_name,
+            lambda name=module_name: import_module('.%s' % name,
+                                                   'fusilly.targets')
+        )
 
 
 def load_external_targets():
-    """ Load user specified targets from the configured target directory. """
+    """ Register user specified targets from the configured target directory.
+    """
     config = get_fusilly_config()
     plugin_path = config.custom_target_path()
-    if plugin_path:
-        modules = [
-            f.split('.')[0] for f in os.listdir(plugin_path)
-            if os.path.isfile(os.path.join(plugin_path, f)) and
-            f not in ['__init__.py'] and f.endswith('.py')
-        ]
-
-        for module_name in modules:
-            f, file, desc = imp.find_module(module_name, [plugin_path])
-            module = imp.load_module(module_name, f, file, desc)
-            func_name = "%s_target" % module_name
-            target_func = getattr(module, func_name)
-            if target_func:
-                setattr(sys.modules['fusilly.targets'], func_name, target_func)
+    if not plugin_path:
+        return
+
+    def load_module(module_name):
+        f, file, desc = imp.find_module(module_name, [plugin_path])
+        try:
+            return imp.load_module(module_name, f, file, desc)
+        finally:
+            if f:
+                f.close()
+
+    for module_name in target_modules(plugin_path, ['__init__.py']):
+        register(module_name, lambda name=module_name: load_module(name))
 
 
 load_internal_targets()
@@ -1,11 +1,11 @@
 import logging
 import os
 
-from glob2 import glob
-
+from fusilly import compression, globbing
+from fusilly.config import get_fusilly_config
 from fusilly.deb import Deb
 from fusilly.exceptions import BuildConfigError
-from fusilly.utils import flatten, is_installed, to_iterable
+from fusilly.utils import flatten, to_iterable
 from .targets import Target
 
 
@@ -16,33 +16,22 @@ class ArtifactTarget(Target):
     TEMPLATE_ATTRS = ['artifact_name', 'fpm_options']
 
     def _globs(self):
-        previous_dir = os.getcwd()
-
-        # globs are relative to the directory of the BUILD file,
-        # so change to that directory before expansion
-        os.chdir(self.buildFile.dir)
-
-        files_expanded = [glob(file_glob) for file_glob in self.files]
-        files_expanded = flatten(files_expanded)
-        files_expanded = set([os.path.abspath(f) for f in files_expanded])
-
-        if self.exclude_files:
-            exclude_files_expanded = [
-                glob(exclude_glob) for exclude_glob in self.exclude_files
-            ]
-            exclude_files_expanded = flatten(exclude_files_expanded)
-            exclude_files_expanded = [
-                os.path.abspath(f) for f in exclude_files_expanded
-            ]
-            exclude_files_expanded = set(exclude_files_expanded)
-        else:
-            exclude_files_expanded = set()
-
+        # globs are relative to the directory of the BUILD file
         # pylint: disable=W0201
-        self.srcs = files_expanded - exclude_files_expanded
+        self.srcs = globbing.expand(
+            self.buildFile.dir, self.files, self.exclude_files
+        )
+
+    def input_globs(self):
+        return self.files, self.exclude_files
 
-        # preserve directory caller expects
-        os.chdir(previous_dir)
+    def watch_paths(self):
+        srcs = globbing.expand(self.buildFile.dir, self.files,
+                               self.exclude_files)
+        paths = super(ArtifactTarget, self).watch_paths() + sorted(srcs)
+        # new files matching the globs appear in these
+        paths.extend(set(os.path.dirname(src) for src in srcs))
+        return paths
 
     def _get_dir_mappings(self, inputdict):
         if 'artifact_target_dir_mappings' not in inputdict:
@@ -59,38 +48,80 @@ class ArtifactTarget(Target):
 
         return expanded_mappings
 
-    def check(self):
-        if self.artifact_type is 'deb':
-            if not is_installed('fpm'):
-                logger.error("fpm not installed; %s cannot be assembled",
-                             self.artifact['name'])
-                logger.info("fpm installation instructions at http://fpm.readthedocs.io/en/latest/installing.html")
-                return 1
-        return 0
+    def _hydrate(self, args):
+        super(ArtifactTarget, self)._hydrate(args)
+        # the level given on the command line applies to every artifact
+        level = getattr(args, 'compression_level', None)
+        # pylint: disable=W0201
+        self.level = self.compression_level if level is None else level
+        self.incremental = not getattr(args, 'no_cache', False)
+        # checked once templated, and only for the artifacts being built
+        compression.check(
+            str(self.fpm_options.get('deb-compression', 'bzip2')),
+            self.level, self.reproducible
+        )
+
+    def _manifest_path(self):
+        return os.path.join(get_fusilly_config().cache_dir(), 'artifacts',
+                            '%s.json' % self.name)
+
+    def _epoch(self):
+        """ Return the time the files of the artifact are dated no later
+        than when it is reproducible, None otherwise. As other reproducible
+        builds, SOURCE_DATE_EPOCH makes the artifact reproducible. """
+        epoch = os.environ.get('SOURCE_DATE_EPOCH')
+        if epoch is not None:
+            try:
+                return int(epoch)
+            except ValueError:
+                raise BuildConfigError(
+                    "SOURCE_DATE_EPOCH must be a number of seconds, not %s" %
+                    epoch
+                )
+        if not self.reproducible:
+            return None
+
+        epoch = self.run_context.builtins.get('git_commit_timestamp')
+        if epoch is None:
+            raise BuildConfigError(
+                "Reproducible artifact %s needs SOURCE_DATE_EPOCH outside of "
+                "a git repository" % self.name
+            )
+        return epoch
 
     def run(self, inputdict):
         self._globs()
         dir_mappings = self._get_dir_mappings(inputdict)
 
-        Deb.create(
+        deb = Deb.create(
             self.buildFile.project_root,
             self.artifact_name,
             self.target_directory,
             self.srcs,
             self.fpm_options,
-            dir_mappings
+            dir_mappings,
+            level=self.level,
+            manifest_path=self._manifest_path(),
+            incremental=self.incremental,
+            epoch=self._epoch(),
         )
         logging.info("Bundling complete")
+        return dict(artifact_path=deb.path)
 
     @classmethod
     def create(cls, name, files, artifact_name, artifact_type,
-               target_directory, fpm_options, exclude_files=None, **kwargs):
+               target_directory, fpm_options, exclude_files=None,
+               compression_level=None, reproducible=False, **kwargs):
         target = ArtifactTarget(name, **kwargs)
         # pylint: disable=W0201
         target.artifact_name = artifact_name
         target.target_directory = target_directory
         target.artifact_type = artifact_type
         target.fpm_options = fpm_options
+        target.compression_level = compression_level
+        target.level = compression_level
+        target.incremental = True
+        target.reproducible = reproducible
         target.files = to_iterable(files)
         target.exclude_files = to_iterable(exclude_files)
         target.srcs = None
@@ -167,5 +198,7 @@ def artifact_target(name, **kwargs):
         target_directory=artifact['target_directory'],
         fpm_options=artifact['fpm_options'],
         exclude_files=exclude_files,
+        compression_level=artifact.get('compression_level'),
+        reproducible=artifact.get('reproducible', False),
         **kwargs
     )
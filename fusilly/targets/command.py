@@ -1,33 +1,90 @@
 import logging
 import os
 
+from fusilly import globbing
 from fusilly.command import Command as Cmd
+from fusilly.config import get_fusilly_config
 from fusilly.exceptions import BuildConfigError, CommandTargetRunFailure
+from fusilly.utils import to_iterable
+from fusilly.watcher import tree
 from .targets import Target
 
 
 logger = logging.getLogger(__name__)
 
+# keys of the command_options of a command_target
+COMMAND_OPTIONS = ['inputs', 'outputs', 'environment', 'timeout']
+
 
 class Command(Target):
-    TEMPLATE_ATTRS = ['command']
+    TEMPLATE_ATTRS = ['command', 'environment']
 
-    def run(self, _):
+    def _directory(self):
         directory = self.directory
         if directory and not directory.startswith('/'):
             directory = os.path.join(self.buildFile.dir, self.directory)
+        return directory
+
+    def fingerprint_attrs(self):
+        attrs = super(Command, self).fingerprint_attrs()
+        attrs['directory'] = self._directory()
+        attrs['outputs'] = self.outputs
+        attrs['environment'] = self.environment
+        return attrs
+
+    def input_files(self):
+        return sorted(globbing.expand(self.buildFile.dir, self.inputs))
 
-        ret = Cmd(self.command, directory).run()
+    def output_files(self):
+        return sorted(globbing.expand(self.buildFile.dir, self.outputs))
+
+    def input_globs(self):
+        if self.inputs:
+            return self.inputs, []
+        # without inputs, anything where the command runs may matter
+        return [os.path.join(self._directory() or self.buildFile.dir, '**')], []
+
+    def watch_paths(self):
+        paths = super(Command, self).watch_paths()
+        if self.inputs:
+            # new files matching the inputs appear in these
+            paths.extend(set(os.path.dirname(f) for f in self.input_files()))
+            return paths
+        # without inputs, anything where the command runs may matter
+        directory = self._directory() or self.buildFile.dir
+        return paths + tree(directory, get_fusilly_config().ignore_paths())
+
+    def run(self, _):
+        cmd = Cmd(self.command, self._directory(), name=self.name,
+                  log_file=self.log_file(), env=self.environment,
+                  timeout=self.timeout)
+        ret = cmd.run()
+        if cmd.timed_out:
+            raise CommandTargetRunFailure(
+                "command_target %s timed out after %ss" % (self.name,
+                                                           self.timeout)
+            )
         if ret != 0:
-            raise CommandTargetRunFailure()
+            raise CommandTargetRunFailure(
+                "command_target %s exited with %d" % (self.name, ret)
+            )
         return None
 
     @classmethod
-    def create(cls, name, command, directory=None, **kwargs):
+    def create(cls, name, command, directory=None, command_options=None,
+               **kwargs):
+        options = command_options or {}
         target = Command(name, **kwargs)
         # pylint: disable=W0201
         target.command = command
         target.directory = directory  # needs templating/expansion for relative
+        target.inputs = to_iterable(options.get('inputs'))
+        target.outputs = to_iterable(options.get('outputs'))
+        target.environment = options.get('environment') or {}
+        target.timeout = options.get('timeout')
+        # a command is only known to be repeatable when told what it reads
+        target.CACHEABLE = bool(target.inputs)
+        return target
 
 
 def command_target(name, **kwargs):
@@ -36,9 +93,28 @@ def command_target(name, **kwargs):
             "command_target %s must contain a 'command' key" % name
         )
 
+    # kept apart from the other keys, which are options of the command line
+    options = kwargs.pop('command_options', None) or {}
+    if not isinstance(options, dict):
+        raise BuildConfigError(
+            "command_options of command_target %s must be a dictionary" % name
+        )
+    unknown = sorted(set(options) - set(COMMAND_OPTIONS))
+    if unknown:
+        raise BuildConfigError(
+            "command_options of command_target %s has unknown keys: %s" %
+            (name, ', '.join(unknown))
+        )
+    environment = options.get('environment')
+    if environment is not None and not isinstance(environment, dict):
+        raise BuildConfigError(
+            "environment of command_target %s must be a dictionary" % name
+        )
+
     return Command.create(
         name,
         kwargs.pop('command'),
         directory=kwargs.pop('directory', None),
+        command_options=options,
         **kwargs
     )
@@ -8,6 +8,8 @@ logger = logging.getLogger(__name__)
 
 
 class Phony(Target):
+    CACHEABLE = True
+
     def run(self, _):
         return None
 
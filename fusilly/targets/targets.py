@@ -1,16 +1,21 @@
 import abc
 import collections
+import hashlib
+import json
 import logging
-import re
+import os
 
+import fusilly
+from fusilly import templates, trace
+from fusilly.cache import makedirs
 from fusilly.config import get_fusilly_config
+from fusilly.context import BUILTIN_TEMPLATE_OPTS, RunContext
 from fusilly.exceptions import (
     BuildConfigError,
     DuplicateTargetError,
-    MissingTemplateValue,
 )
+from fusilly.labels import target_name
 from fusilly.utils import (
-    filter_dict,
     to_iterable,
     classname,
 )
@@ -18,12 +23,6 @@ from fusilly.utils import (
 logger = logging.getLogger(__name__)
 
 
-BUILTIN_TEMPLATE_OPTS = [
-    'sha',
-    'sha_short',
-]
-
-
 class TargetCollection(collections.Mapping):
     def __init__(self):
         self.target_dict = {}
@@ -35,8 +34,8 @@ class TargetCollection(collections.Mapping):
             )
         self.target_dict[target.name] = target
 
-    def __getitem__(self, name):
-        return self.target_dict[name]
+    def __getitem__(self, label):
+        return self.target_dict[target_name(label)]
 
     def __len__(self):
         return len(self.target_dict)
@@ -45,6 +44,12 @@ class TargetCollection(collections.Mapping):
         for target in self.target_dict:
             yield target
 
+    def remove_defined_in(self, path):
+        """ Remove the targets defined by the BUILD file at path. """
+        for name, target in list(self.target_dict.items()):
+            if target.buildFile is not None and target.buildFile.path == path:
+                del self.target_dict[name]
+
     def maybe_set_buildfile(self, buildFile):
         for target in self.target_dict.itervalues():
             target._maybe_set_buildfile(buildFile)
@@ -60,6 +65,11 @@ class Target(object):
     # substitute values for the templates on the command line.
     TEMPLATE_ATTRS = []
 
+    # Set by targets whose result is fully determined by their fingerprint,
+    # see _fingerprint(). A cacheable target is skipped when a previous run
+    # recorded a result for the same fingerprint.
+    CACHEABLE = False
+
     def __init__(self, name, **kwargs):
         self.name = name
 
@@ -81,6 +91,16 @@ class Target(object):
 
         self.custom_options = kwargs
 
+        # TEMPLATE_ATTRS name -> parsed template, see _parse_templates()
+        self._templates = None
+
+        # the RunContext of the run the target was last hydrated for
+        self.run_context = None
+
+        # identifies the inputs of this target for the current run, None if
+        # the target cannot be cached.
+        self.fingerprint = None
+
         Targets.add(self)
 
     @abc.abstractmethod
@@ -102,104 +122,156 @@ class Target(object):
         completed. Called in the success and failure cases. """
         pass
 
+    def fingerprint_attrs(self):
+        """ Optional override returning the (hydrated) attributes that
+        determine what the target does. """
+        attrs = dict(self.custom_options)
+        for template_attr in self.TEMPLATE_ATTRS:
+            attrs[template_attr] = self.__dict__.get(template_attr)
+        return attrs
+
+    def input_files(self):
+        """ Optional override returning the files whose content the result
+        of the target depends on. """
+        return []
+
+    def output_files(self):
+        """ Optional override returning the files the target produces. A
+        cached result is only reused while these are unchanged. """
+        return []
+
+    def input_globs(self):
+        """ Optional override returning the globs of the files the target
+        reads and of those to leave out, relative to the directory of its
+        BUILD file. Used to find the targets affected by changed files. """
+        return [], []
+
+    def watch_paths(self):
+        """ Optional override returning the files and directories whose
+        change makes `fusilly watch` run the target again. """
+        paths = list(self.input_files())
+        if self.buildFile is not None:
+            paths.append(self.buildFile.path)
+        return paths
+
+    def log_file(self):
+        """ The file the output of this target's commands is written to, or
+        None. """
+        directory = get_fusilly_config().target_log_dir()
+        if directory is None:
+            return None
+        return os.path.join(directory, '%s.log' % self.name)
+
+    def _start_log(self):
+        log_file = self.log_file()
+        if log_file is not None:
+            makedirs(os.path.dirname(log_file))
+            open(log_file, 'w').close()
+
     def _classname_short(self):
         return classname(self).split('.')[-1]
 
     def _target_name_for_display(self):
         return "%s:%s" % (self._classname_short(), self.name)
 
-    def _dep_check(self):
-        for depname in self.deps:
-            target = Targets.get(depname)
-            target._dep_check()
-            target.check()
-
-    def _check(self):
-        """ Internal method called to cleanup all targets. """
-        self._dep_check()
-        self.check()
-
-    def _dep_cleanup(self):
-        for depname in self.deps:
-            target = Targets.get(depname)
-            target._dep_cleanup()
-            target.cleanup()
-
-    def _cleanup(self):
-        """ Internal method called to cleanup all targets. """
-        self._dep_cleanup()
-        self.cleanup()
-
     def _maybe_set_buildfile(self, buildFile):
         """ Internal method that associates this target with the buildFile
         where it was defined. This is ugly, but simple. """
         if self.buildFile is None:
             self.buildFile = buildFile
-
-    def _run(self, programArgs, inputdict):
-        """ Internal implementation; do not override. Run the target, running
-        each of its dependencies first and passes the combined output of each
-        dep to the next dependency.
+            self._parse_templates()
+
+    def _fingerprint(self, cache, inputdict):
+        """ Internal method that hashes everything the result of the target
+        depends on: its attributes, the content of its input files, the
+        output of its dependencies and their fingerprints. Returns None when
+        the target or one of its dependencies cannot be cached. """
+        if not self.CACHEABLE:
+            return None
+
+        dep_fingerprints = [Targets.get(dep).fingerprint for dep in self.deps]
+        if None in dep_fingerprints:
+            return None
+
+        inputs = {
+            'version': fusilly.__version__,
+            'class': classname(self),
+            'name': self.name,
+            'attrs': self.fingerprint_attrs(),
+            'files': cache.file_hashes(self.input_files()),
+            'inputdict': inputdict,
+            'deps': dep_fingerprints,
+        }
+        serialized = json.dumps(inputs, sort_keys=True, default=str)
+        return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+    def _run(self, context, inputdict, cache=None):
+        """ Internal implementation; do not override. Run the target with the
+        combined output of its dependencies, which the scheduler is
+        responsible for running first. Returns the input merged with the
+        output of this target.
         """
-        for depname in self.deps:
-            target = Targets.get(depname)
-            target._hydrate(programArgs)
-            outputdict = target._run(programArgs, inputdict)
-            if outputdict:
+        self._hydrate(context)
+
+        self.fingerprint = None
+        if cache is not None:
+            self.fingerprint = self._fingerprint(cache, inputdict)
+
+        record = trace.current()
+        if self.fingerprint is not None:
+            outputdict = cache.lookup(self)
+            if record is not None:
+                record.cache = 'miss' if outputdict is None else 'hit'
+            if outputdict is not None:
+                logger.info("%s target is up to date",
+                            self._target_name_for_display())
                 inputdict.update(outputdict)
+                return inputdict
 
-        self._hydrate(programArgs)
         logger.info("Running %s target", self._target_name_for_display())
+        self._start_log()
         outputdict = self.run(inputdict)
+        if self.fingerprint is not None:
+            cache.store(self, outputdict)
         if outputdict:
             inputdict.update(outputdict)
         return inputdict
 
     def _make_cmdline_substitions(self, argDict, options):
-        pattern = re.compile(r'{{(\w+)}}')
-
-        for key, _ in options.iteritems():
-            while True:
-                value = options[key]
-                if isinstance(value, dict):
-                    self._make_cmdline_substitions(argDict, value)
-                    break
-
-                value = str(options[key])
-                match = pattern.search(value)
-                if not match:
-                    break
-
-                replace_value = argDict.get(match.group(1))
-                if replace_value is None:
-                    err = "Found '{{%s}}' without a definition" % match.group(1)
-                    raise MissingTemplateValue(err)
-
-                start, end = match.span()
-                options[key] = value[0:start] + str(replace_value) + value[end:]
+        """ Render the templates of the values of options with argDict, in
+        place. """
+        options.update(templates.render(
+            dict((key, templates.parse(value))
+                 for key, value in options.iteritems()),
+            argDict
+        ))
+
+    def _parse_templates(self):
+        """ Internal method returning the template attributes parsed, which
+        is done once: when the BUILD file of the target is loaded or else
+        before its first run. """
+        if self._templates is None:
+            self._templates = {}
+            for template_attr in self.TEMPLATE_ATTRS:
+                if template_attr not in self.__dict__:
+                    logging.error("template attr '%s' does not exist in "
+                                  "template %s", template_attr, self.name)
+                self._templates[template_attr] = templates.parse(
+                    self.__dict__.get(template_attr)
+                )
+        return self._templates
 
     def _templating(self, cmdline_opts):
-        for template_attr in self.TEMPLATE_ATTRS:
-            if template_attr not in self.__dict__:
-                logging.error("template attr '%s' does not exist in template %s",
-                              template_attr, self.name)
-            # potential for clobbering here, should probably dunder
-            self.custom_options[template_attr] = self.__dict__.get(template_attr)
-
-        self._make_cmdline_substitions(cmdline_opts, self.custom_options)
-
-        for template_attr in self.TEMPLATE_ATTRS:
-            self.__dict__[template_attr] = self.custom_options.pop(template_attr)
-
-    def add_builtin_options(self, options):
-        """ For those options most projects will want. """
-        config = get_fusilly_config()
-        options['sha'] = config.repo_head_sha()
-        options['sha_short'] = config.repo_head_sha_short()
+        """ Set the template attributes to their templates rendered with
+        cmdline_opts. The templates are kept, so the target can be hydrated
+        again with other values. """
+        self.__dict__.update(templates.render(
+            self._parse_templates(), cmdline_opts,
+            owner=self._target_name_for_display()
+        ))
 
     def _hydrate(self, args):
-        cmdline_opts = filter_dict(args.__dict__, ['subparser_name', 'args'])
-
-        self.add_builtin_options(cmdline_opts)
-
-        self._templating(cmdline_opts)
+        """ Prepare the target to run with args, the RunContext of the run or
+        the arguments of the command line. """
+        self.run_context = RunContext.of(args)
+        self._templating(self.run_context.template_values)
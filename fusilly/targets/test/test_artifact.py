@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 
+import argparse
 import unittest
 
+from fusilly.context import Builtins, RunContext
 from fusilly.exceptions import BuildConfigError
 from fusilly.targets.artifact import artifact_target
 
@@ -47,3 +49,20 @@ class TestArtifactTarget(unittest.TestCase):
             mappings,
             ['/tmp/randomtempname/=/foo/bar/baz/virtualenv']
         )
+
+    def test_compression_is_checked_once_templated(self):
+        opts = dict(self.opts, **{'deb-compression': '{{compression}}'})
+        artifact = dict(name='foo', type='deb', target_directory='/foo',
+                        fpm_options=opts)
+        target = artifact_target('artifact_compression', files="**/*.py",
+                                 artifact=artifact, compression='gz')
+
+        def hydrate(compression):
+            args = argparse.Namespace(subparser_name='artifact_compression',
+                                      args=[], compression=compression)
+            target._hydrate(RunContext(args, Builtins()))
+
+        hydrate('xz')
+        self.assertEqual(target.fpm_options['deb-compression'], 'xz')
+        self.assertRaisesRegexp(BuildConfigError, 'Unknown compression lz4',
+                                hydrate, 'lz4')
@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 
+import argparse
 import unittest
 
+from fusilly.context import Builtins, RunContext
 from fusilly.exceptions import BuildConfigError
 from fusilly.targets.command import command_target
 
@@ -19,3 +21,32 @@ class TestCommandTarget(unittest.TestCase):
             'foo_target_name',
             **kwargs
         )
+
+    def test_command_options(self):
+        target = command_target(
+            'cmd_options', command='make {{timeout}}', timeout='fast',
+            command_options={'inputs': ['*.py'], 'timeout': 30,
+                             'environment': {'VERSION': '{{sha_short}}'}}
+        )
+        self.assertEqual(target.inputs, ['*.py'])
+        self.assertEqual(target.timeout, 30)
+        # the other keys are still options of the command line
+        self.assertEqual(target.custom_options, {'timeout': 'fast'})
+
+        args = argparse.Namespace(subparser_name='cmd_options', args=[],
+                                  timeout='fast')
+        builtins = Builtins()
+        builtins.values['sha'] = '0123456789abcdef0123456789abcdef01234567'
+        target._hydrate(RunContext(args, builtins))
+        self.assertEqual(target.command, 'make fast')
+        self.assertEqual(target.environment, {'VERSION': '0123456789ab'})
+
+    def test_unknown_command_options(self):
+        self.assertRaisesRegexp(
+            BuildConfigError,
+            "command_options of command_target \w+ has unknown keys: input",
+            command_target,
+            'cmd_unknown',
+            command='true',
+            command_options={'input': ['*.py']}
+        )
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+import types
+import unittest
+
+import fusilly.targets
+from fusilly.targets import LazyTarget
+
+
+class TestLazyTarget(unittest.TestCase):
+    def setUp(self):
+        self.loads = 0
+
+    def load_module(self):
+        self.loads += 1
+        module = types.ModuleType('fake_target')
+        module.fake_target = lambda name, **kwargs: (name, kwargs)
+        return module
+
+    def test_module_loaded_on_first_call(self):
+        lazy = LazyTarget('fake_target', self.load_module)
+        self.assertEqual(self.loads, 0)
+
+        self.assertEqual(lazy('foo', deps=[]), ('foo', {'deps': []}))
+        self.assertEqual(lazy('bar'), ('bar', {}))
+        self.assertEqual(self.loads, 1)
+
+        self.assertEqual(fusilly.targets.fake_target('baz'), ('baz', {}))
+        del fusilly.targets.fake_target
+
+    def test_internal_targets_registered(self):
+        for func_name in ('artifact_target', 'command_target', 'phony_target',
+                          'virtualenv_target'):
+            self.assertTrue(callable(getattr(fusilly.targets, func_name)))
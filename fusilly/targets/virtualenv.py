@@ -3,7 +3,14 @@ import os
 import tempfile
 import shutil
 
-from fusilly.virtualenv import Virtualenv
+from fusilly.config import get_fusilly_config
+from fusilly.virtualenv import (
+    Virtualenv,
+    VirtualenvCache,
+    Wheelhouse,
+    metadata_path,
+    read_requirements,
+)
 from fusilly.exceptions import BuildConfigError
 from .targets import Target
 
@@ -18,21 +25,61 @@ class VirtualenvTarget(Target):
             self.buildFile.dir, self.requirements
         )
 
+    def _cache(self):
+        config = get_fusilly_config()
+        directory = config.virtualenv_cache_dir()
+        if directory is None:
+            return None
+        max_size, max_age = config.virtualenv_cache_limits()
+        return VirtualenvCache(directory, max_size, max_age)
+
+    def _wheelhouse(self):
+        directory, jobs, offline = get_fusilly_config().wheelhouse()
+        if directory is None:
+            return None
+        return Wheelhouse(directory, jobs, offline)
+
+    def fingerprint_attrs(self):
+        attrs = super(VirtualenvTarget, self).fingerprint_attrs()
+        attrs['requirements'] = read_requirements(self.input_files()[0])
+        attrs['target_directory'] = self.target_directory
+        return attrs
+
+    def input_files(self):
+        return [os.path.join(self.buildFile.dir, self.requirements)]
+
+    def input_globs(self):
+        return [self.requirements], []
+
+    def output_files(self):
+        if self.virtualenv_path is None:
+            return []
+        return [metadata_path(self.virtualenv_path)]
+
     def run(self, inputdict):
         self._expand_paths()
-
-        # pylint: disable=W0201
-        self.tempdir = tempfile.mkdtemp(prefix='fusilly-%s-' % self.name)
         logger.info("Installing %s deps into virtualenv", self.requirements)
 
-        Virtualenv.create(
-            self.name,
-            self.requirements,
-            self.tempdir,
-        )
+        cache = self._cache()
+        wheelhouse = self._wheelhouse()
+        if cache is not None:
+            virtualenv = Virtualenv.cached(self.name, self.requirements, cache,
+                                           wheelhouse, self.log_file())
+        else:
+            # pylint: disable=W0201
+            self.tempdir = tempfile.mkdtemp(prefix='fusilly-%s-' % self.name)
+            virtualenv = Virtualenv.create(
+                self.name,
+                self.requirements,
+                self.tempdir,
+                wheelhouse,
+                self.log_file(),
+            )
         logging.info("virtualenv creation complete")
 
-        dirmap = "%s=%s" % (self.tempdir, self.target_directory)
+        # pylint: disable=W0201
+        self.virtualenv_path = virtualenv.path
+        dirmap = "%s=%s" % (virtualenv.path, self.target_directory)
         return dict(artifact_target_dir_mappings=dirmap)
 
     @classmethod
@@ -42,6 +89,9 @@ class VirtualenvTarget(Target):
         target.requirements = requirements
         target.target_directory = target_directory
         target.tempdir = None
+        target.virtualenv_path = None
+        # a cached virtualenv outlives the run, so its location can be reused
+        target.CACHEABLE = get_fusilly_config().virtualenv_cache_dir() is not None
 
         return target
 
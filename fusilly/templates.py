@@ -0,0 +1,135 @@
+import re
+
+from fusilly.exceptions import MissingTemplateValue
+
+
+PLACEHOLDER = re.compile(r'{{(\w+)}}')
+
+# str and unicode in python 2, str in python 3
+STRING_TYPES = (type(''), type(u''))
+
+
+class Template(object):
+    """ A string with {{name}} placeholders, split once into the text around
+    them and their names, so rendering is a single join. """
+
+    def __init__(self, text):
+        self.text = text
+        # the text between placeholders at even positions, names at odd ones
+        self.parts = PLACEHOLDER.split(text)
+        self.names = self.parts[1::2]
+        self.variables = frozenset(self.names)
+
+    def render(self, values):
+        parts = list(self.parts)
+        parts[1::2] = [str(values[name]) for name in self.names]
+        return ''.join(parts)
+
+
+class _Dict(object):
+    def __init__(self, items):
+        self.items = items
+        self.variables = variables(*items.values())
+
+    def render(self, values):
+        return dict((key, _render(node, values))
+                    for key, node in self.items.items())
+
+
+class _Sequence(object):
+    def __init__(self, kind, items):
+        self.kind = kind
+        self.items = items
+        self.variables = variables(*items)
+
+    def render(self, values):
+        return self.kind(_render(node, values) for node in self.items)
+
+
+NODES = (Template, _Dict, _Sequence)
+
+
+def _render(node, values):
+    if isinstance(node, NODES):
+        return node.render(values)
+    return node
+
+
+def parse(value):
+    """ Return value with the strings holding placeholders, alone or in
+    dicts, lists and tuples, parsed into templates. Whatever holds no
+    placeholder is returned as it is, and left alone when rendering. """
+    if isinstance(value, STRING_TYPES):
+        if PLACEHOLDER.search(value):
+            return Template(value)
+        return value
+    if isinstance(value, dict):
+        items = dict((key, parse(item)) for key, item in value.items())
+        if any(isinstance(node, NODES) for node in items.values()):
+            return _Dict(items)
+        return value
+    if isinstance(value, (list, tuple)):
+        items = [parse(item) for item in value]
+        if any(isinstance(node, NODES) for node in items):
+            return _Sequence(type(value), items)
+        return value
+    return value
+
+
+def variables(*nodes):
+    """ Return the names of the placeholders of the parsed values. """
+    names = set()
+    for node in nodes:
+        if isinstance(node, NODES):
+            names.update(node.variables)
+    return frozenset(names)
+
+
+def render(nodes, values, owner=None):
+    """ Render nodes, a dict of parsed values, with values, a dict of the
+    values of the placeholders. A value holding placeholders itself, such as
+    an option defaulting to '{{sha_short}}', is rendered with the others
+    first, as are the values it refers to in turn. Raises
+    MissingTemplateValue naming every placeholder without a value, or the
+    placeholders whose values refer back to themselves.
+    """
+    resolved = {}
+    missing = set()
+
+    def resolve(name, resolving):
+        if name in resolved:
+            return resolved[name]
+        value = values.get(name)
+        if value is None:
+            missing.add(name)
+            return None
+        if isinstance(value, STRING_TYPES) and '{{' in value:
+            if name in resolving:
+                cycle = resolving[resolving.index(name):] + [name]
+                err = "Found %s referring to itself" % ' -> '.join(
+                    "'{{%s}}'" % n for n in cycle
+                )
+                if owner is not None:
+                    err += " in %s" % owner
+                raise MissingTemplateValue(err)
+            template = Template(value)
+            parts = dict((n, resolve(n, resolving + [name]))
+                         for n in template.variables)
+            if any(part is None for part in parts.values()):
+                return None
+            value = template.render(parts)
+        resolved[name] = value
+        return value
+
+    for name in sorted(variables(*nodes.values())):
+        resolve(name, [])
+
+    if missing:
+        err = "Found %s without a definition" % ', '.join(
+            "'{{%s}}'" % name for name in sorted(missing)
+        )
+        if owner is not None:
+            err += " in %s" % owner
+        raise MissingTemplateValue(err)
+
+    return dict((key, _render(node, resolved)) for key, node in nodes.items())
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+import unittest
+
+from fusilly.affected import directly_affected, roots, with_dependents
+from fusilly.buildfiles import BuildFile
+from fusilly.targets import Target, Targets
+
+
+class StubTarget(Target):
+    def run(self, inputdict):
+        pass
+
+    def input_globs(self):
+        return self.globs, []
+
+    @classmethod
+    def create(cls, name, build_dir, globs=None, **kwargs):
+        Targets.target_dict.pop(name, None)
+        target = StubTarget(name, **kwargs)
+        target.buildFile = BuildFile('/p', '/p/%s/BUILD.fs' % build_dir)
+        # pylint: disable=W0201
+        target.globs = globs or []
+        return target
+
+
+class TestAffected(unittest.TestCase):
+    def setUp(self):
+        self.targets = [
+            StubTarget.create('aff_lib', 'libs/common'),
+            StubTarget.create('aff_api', 'services/api', deps=['aff_lib']),
+            StubTarget.create('aff_docs', 'docs', globs=['../libs/**/*.md']),
+            StubTarget.create('aff_all', 'services', deps=['aff_api']),
+        ]
+
+    def tearDown(self):
+        for target in self.targets:
+            Targets.target_dict.pop(target.name, None)
+
+    def test_closest_build_file_owns_path(self):
+        self.assertEqual(
+            directly_affected(['/p/libs/common/src/a.c'], self.targets),
+            set(['aff_lib'])
+        )
+        self.assertEqual(
+            directly_affected(['/p/services/api/BUILD.fs'], self.targets),
+            set(['aff_api'])
+        )
+        self.assertEqual(directly_affected(['/p/README'], self.targets),
+                         set())
+
+    def test_input_globs_match_deleted_files(self):
+        self.assertEqual(
+            directly_affected(['/p/libs/common/gone.md'], self.targets),
+            set(['aff_lib', 'aff_docs'])
+        )
+
+    def test_dependents_and_roots(self):
+        affected = with_dependents(['aff_lib'], self.targets)
+
+        self.assertEqual(affected, set(['aff_lib', 'aff_api', 'aff_all']))
+        self.assertEqual(roots(affected), ['aff_all'])
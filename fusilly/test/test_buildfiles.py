@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from fusilly.buildfiles import BuildFile, BuildFiles
+from fusilly.targets import Targets
+
+
+class TestBuildFileCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.directory, '.fusilly')
+        self.path = os.path.join(self.directory, 'BUILD.fs')
+        self.write("value = 1\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, source):
+        with open(self.path, 'w') as f:
+            f.write(source)
+
+    def evaluate(self, buildFile):
+        scope = {}
+        # pylint: disable=W0122
+        exec(buildFile.code(), scope)
+        return scope['value']
+
+    def test_warm_start_does_not_read_source(self):
+        self.assertEqual(
+            self.evaluate(BuildFile(self.directory, self.path, self.cache_dir)),
+            1
+        )
+
+        buildFile = BuildFile(self.directory, self.path, self.cache_dir)
+        self.assertEqual(self.evaluate(buildFile), 1)
+        self.assertEqual(buildFile._source, None)
+
+    def test_changed_file_is_recompiled(self):
+        self.evaluate(BuildFile(self.directory, self.path, self.cache_dir))
+        self.write("value = 22\n")
+
+        buildFile = BuildFile(self.directory, self.path, self.cache_dir)
+        self.assertEqual(self.evaluate(buildFile), 22)
+
+
+class TestLazyLoading(unittest.TestCase):
+    BUILD_FILES = {
+        'services/api': "phony_target(name='lazy_api', "
+                        "deps=['//libs/common:lazy_common'])\n",
+        'libs/common': "command_target(name='lazy_common', command='true')\n",
+        'unrelated': "command_target(name='lazy_unrelated', command='true')\n",
+    }
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for package, source in self.BUILD_FILES.items():
+            os.makedirs(os.path.join(self.directory, package))
+            with open(os.path.join(self.directory, package, 'BUILD.fs'),
+                      'w') as f:
+                f.write(source)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        for name in ('lazy_api', 'lazy_common', 'lazy_unrelated'):
+            Targets.target_dict.pop(name, None)
+
+    def test_loads_only_what_the_label_needs(self):
+        buildFiles = BuildFiles(self.directory,
+                                os.path.join(self.directory, '.fusilly'))
+        buildFiles.load_for('//services/api:lazy_api')
+
+        self.assertIn('lazy_api', Targets)
+        self.assertIn('lazy_common', Targets)
+        self.assertNotIn('lazy_unrelated', Targets)
+        self.assertEqual(
+            Targets.get('lazy_common').buildFile.path,
+            os.path.join(self.directory, 'libs', 'common', 'BUILD.fs')
+        )
+
+    def test_reload_replaces_targets_of_changed_file(self):
+        buildFiles = BuildFiles(self.directory,
+                                os.path.join(self.directory, '.fusilly'))
+        buildFiles.load_for('//services/api:lazy_api')
+        path = os.path.join(self.directory, 'libs', 'common', 'BUILD.fs')
+        with open(path, 'w') as f:
+            f.write("command_target(name='lazy_common', command='false')\n")
+
+        buildFiles.reload([path])
+
+        self.assertEqual(Targets.get('lazy_common').command, 'false')
+        self.assertIn('lazy_api', Targets)
+
+        os.remove(path)
+        buildFiles.reload([path])
+        self.assertNotIn('lazy_common', Targets)
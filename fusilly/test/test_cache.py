@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import shutil
+import tempfile
+import unittest
+
+from fusilly.buildfiles import BuildFile
+from fusilly.cache import BuildCache
+from fusilly.targets import Target, Targets
+
+
+class CachedTarget(Target):
+    CACHEABLE = True
+
+    def run(self, inputdict):
+        self.runs += 1
+        with open(self.output, 'w') as f:
+            f.write('built')
+        return {'built': self.output}
+
+    def input_files(self):
+        return [self.input]
+
+    def output_files(self):
+        return [self.output]
+
+    @classmethod
+    def create(cls, name, directory, **kwargs):
+        target = CachedTarget(name, **kwargs)
+        # pylint: disable=W0201
+        target.input = os.path.join(directory, 'input.txt')
+        target.output = os.path.join(directory, 'output.txt')
+        target.runs = 0
+        target.buildFile = BuildFile(directory,
+                                     os.path.join(directory, 'BUILD.fs'))
+        return target
+
+
+class TestBuildCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with open(os.path.join(self.directory, 'input.txt'), 'w') as f:
+            f.write('v1')
+
+        if 'cache_target' in Targets:
+            Targets.target_dict.pop('cache_target')
+        self.target = CachedTarget.create('cache_target', self.directory)
+        self.args = argparse.Namespace(subparser_name=None, args=[])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_target(self):
+        cache = BuildCache(os.path.join(self.directory, '.fusilly'))
+        output = self.target._run(self.args, {}, cache=cache)
+        cache.save()
+        return output
+
+    def test_unchanged_inputs_are_skipped(self):
+        self.assertEqual(self.run_target(), {'built': self.target.output})
+        self.assertEqual(self.run_target(), {'built': self.target.output})
+        self.assertEqual(self.target.runs, 1)
+
+    def test_changed_input_runs(self):
+        self.run_target()
+        with open(self.target.input, 'w') as f:
+            f.write('v2 is longer')
+        self.run_target()
+        self.assertEqual(self.target.runs, 2)
+
+    def test_removed_output_runs(self):
+        self.run_target()
+        os.remove(self.target.output)
+        self.run_target()
+        self.assertEqual(self.target.runs, 2)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from StringIO import StringIO
+
+from fusilly import command
+from fusilly.command import Command
+
+
+class TestCommand(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.script = os.path.join(self.directory, 'noisy')
+        with open(self.script, 'w') as f:
+            f.write('#!/bin/sh\n'
+                    'for i in $(seq 1 100); do echo line $i; done\n'
+                    'echo oops >&2\n'
+                    'exit 3\n')
+        os.chmod(self.script, stat.S_IRWXU)
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.directory)
+
+    def test_output_is_streamed_and_logged(self):
+        log_file = os.path.join(self.directory, 'noisy.log')
+        cmd = Command(self.script, name='noisy', log_file=log_file)
+
+        self.assertEqual(cmd.run(), 3)
+
+        lines = sys.stdout.getvalue().splitlines()
+        self.assertEqual(lines[0], '[noisy] line 1')
+        self.assertEqual(lines[-1], '[noisy] oops')
+        with open(log_file) as f:
+            self.assertEqual(f.read().splitlines(), lines)
+
+        self.assertEqual(len(cmd.output_tail), command.TAIL_LINES)
+        self.assertEqual(cmd.output_tail[-1], 'oops\n')
+
+    def _script(self, name, body):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write('#!/bin/sh\n' + body)
+        os.chmod(path, stat.S_IRWXU)
+        return path
+
+    def _alive(self, pid):
+        # an orphan that was killed may linger as a zombie until reaped
+        try:
+            with open('/proc/%d/stat' % pid) as f:
+                return f.read().split(')')[-1].split()[0] != 'Z'
+        except IOError:
+            return False
+
+    def test_environment_and_directory_are_per_command(self):
+        script = self._script('show', 'echo $GREETING $(pwd)\n')
+        cwd = os.getcwd()
+
+        ret, stdout = Command(script, directory=self.directory,
+                              env={'GREETING': 'hi'}).run(capture_stdout=True)
+
+        self.assertEqual(ret, 0)
+        self.assertEqual(stdout.split(),
+                         ['hi', os.path.realpath(self.directory)])
+        self.assertEqual(os.getcwd(), cwd)
+        self.assertNotIn('GREETING', os.environ)
+
+    def test_timeout_terminates_process_group(self):
+        pidfile = os.path.join(self.directory, 'pid')
+        script = self._script('hang', 'sleep 30 &\necho $! > %s\nwait\n'
+                              % pidfile)
+        cmd = Command(script, timeout=0.5)
+
+        start = time.time()
+        self.assertNotEqual(cmd.run(), 0)
+        self.assertTrue(cmd.timed_out)
+        self.assertLess(time.time() - start, 10)
+
+        # the background sleep was in the command's group and went with it,
+        # though it may take a moment to act on the signal
+        with open(pidfile) as f:
+            pid = int(f.read())
+        deadline = time.time() + 5
+        while self._alive(pid) and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(self._alive(pid))
+        self.assertEqual(command.PROCESSES, set())
+
+    def test_sigterm_while_processes_are_being_tracked(self):
+        # the handler runs on the thread it interrupts, which may be adding
+        # or removing a process
+        done = threading.Event()
+
+        def interrupted():
+            with command.PROCESSES_LOCK:
+                Command.sigterm_handler()
+            done.set()
+
+        thread = threading.Thread(target=interrupted)
+        thread.daemon = True
+        thread.start()
+        self.assertTrue(done.wait(5))
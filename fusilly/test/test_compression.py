@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+import gzip
+import io
+import os
+import random
+import subprocess
+import tempfile
+import unittest
+
+from fusilly import compression
+from fusilly.exceptions import BuildConfigError
+
+
+def sample(size):
+    rand = random.Random(0)
+    words = [b'fusilly', b'target', b'build', b'deb', b'\n', b' ']
+    return b''.join(rand.choice(words) for _ in range(size))
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.block_size = compression.BLOCK_SIZE
+
+    def tearDown(self):
+        compression.BLOCK_SIZE = self.block_size
+
+    def compress(self, fileobj, data, name, **kwargs):
+        writer = compression.writer(fileobj, name, **kwargs)
+        # written in pieces, as a tar stream is
+        for i in range(0, len(data), 10000):
+            writer.write(data[i:i + 10000])
+        writer.close()
+
+    def test_parallel_gzip_is_a_single_gzip_stream(self):
+        compression.BLOCK_SIZE = 64 * 1024
+        data = sample(100000)
+        buf = io.BytesIO()
+        self.compress(buf, data, 'gz', jobs=4)
+
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(buf.getvalue()))
+                         .read(), data)
+        self.assertLess(len(buf.getvalue()), len(data) // 3)
+
+    def test_levels(self):
+        data = sample(50000)
+        sizes = []
+        for level in (1, 9):
+            buf = io.BytesIO()
+            self.compress(buf, data, 'gz', level=level)
+            sizes.append(len(buf.getvalue()))
+        self.assertGreater(sizes[0], sizes[1])
+
+        self.assertRaisesRegexp(BuildConfigError, 'between 1 and 9',
+                                compression.check, 'bzip2', 0)
+        self.assertRaisesRegexp(BuildConfigError, 'Unknown compression',
+                                compression.check, 'lz4')
+
+    def test_reproducible_xz_needs_the_program(self):
+        program = compression._program
+        compression._program = lambda name: None
+        try:
+            self.assertRaisesRegexp(BuildConfigError, 'needs xz',
+                                    compression.check, 'xz',
+                                    reproducible=True)
+            self.assertRaisesRegexp(BuildConfigError, 'needs xz',
+                                    compression.writer, io.BytesIO(), 'xz',
+                                    reproducible=True)
+        finally:
+            compression._program = program
+
+    @unittest.skipIf(compression._program('zstd') is None,
+                     'zstd is not installed')
+    def test_external_program(self):
+        data = sample(50000)
+        with tempfile.TemporaryFile() as f:
+            f.write(b'header')
+            self.compress(f, data, 'zstd', jobs=2)
+            end = f.tell()
+            f.seek(0)
+            content = f.read()
+        self.assertEqual(end, len(content))
+        self.assertEqual(content[:6], b'header')
+
+        process = subprocess.Popen(['zstd', '-d', '-c'], stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE,
+                                   stderr=open(os.devnull, 'w'))
+        self.assertEqual(process.communicate(content[6:])[0], data)
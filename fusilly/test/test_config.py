@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from fusilly.config import _read_toml, find_project_root
+
+
+class TestConfig(unittest.TestCase):
+    def setUp(self):
+        self.directory = os.path.realpath(tempfile.mkdtemp())
+        self.cwd = os.getcwd()
+        self.environ = os.environ.pop('FUSILLY_ROOT', None)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        if self.environ is not None:
+            os.environ['FUSILLY_ROOT'] = self.environ
+        else:
+            os.environ.pop('FUSILLY_ROOT', None)
+        shutil.rmtree(self.directory)
+
+    def test_find_project_root(self):
+        nested = os.path.join(self.directory, 'a', 'b')
+        os.makedirs(nested)
+        open(os.path.join(self.directory, '.fusilly.toml'), 'w').close()
+
+        os.chdir(nested)
+        self.assertEqual(find_project_root(), self.directory)
+
+        os.environ['FUSILLY_ROOT'] = nested
+        self.assertEqual(find_project_root(), nested)
+
+    def test_read_toml_reuses_parsed_config(self):
+        path = os.path.join(self.directory, '.fusilly.toml')
+        with open(path, 'w') as f:
+            f.write("[build_files]\nignore_paths = ['vendor']\n")
+
+        expected = {'build_files': {'ignore_paths': ['vendor']}}
+        self.assertEqual(_read_toml(self.directory, path), expected)
+        self.assertTrue(os.path.isfile(
+            os.path.join(self.directory, '.fusilly', 'config.json')
+        ))
+        self.assertEqual(_read_toml(self.directory, path), expected)
+
+        with open(path, 'w') as f:
+            f.write("[build_files]\nignore_paths = ['node_modules']\n")
+        os.utime(path, (0, 0))
+        self.assertEqual(_read_toml(self.directory, path),
+                         {'build_files': {'ignore_paths': ['node_modules']}})
+
+    def test_read_missing_toml(self):
+        self.assertEqual(
+            _read_toml(self.directory,
+                       os.path.join(self.directory, '.fusilly.toml')),
+            None
+        )
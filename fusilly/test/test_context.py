@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+import argparse
+import unittest
+
+from fusilly.context import Builtins, RunContext
+from fusilly.exceptions import BuildConfigError
+from fusilly.targets import Target, Targets
+
+
+class CountingRepo(object):
+    def __init__(self):
+        self.reads = []
+
+    def head_sha(self):
+        self.reads.append('sha')
+        return '0123456789abcdef0123456789abcdef01234567'
+
+    def branch(self):
+        self.reads.append('branch')
+        return 'main'
+
+    def is_dirty(self):
+        self.reads.append('dirty')
+        return True
+
+    def head_timestamp(self):
+        self.reads.append('commit_timestamp')
+        return 1500000000
+
+
+class ContextTarget(Target):
+    TEMPLATE_ATTRS = ['command']
+
+    def run(self, inputdict):
+        return None
+
+    @classmethod
+    def create(cls, name, command, **kwargs):
+        if name in Targets:
+            return Targets.get(name)
+        target = ContextTarget(name, **kwargs)
+        # pylint: disable=W0201
+        target.command = command
+        return target
+
+
+class TestRunContext(unittest.TestCase):
+    def setUp(self):
+        self.repo = CountingRepo()
+        self.args = argparse.Namespace(subparser_name='ctx', args=[], jobs=2,
+                                       env='stage')
+        self.context = RunContext(self.args, Builtins(self.repo))
+
+    def test_builtins_are_read_once_when_used(self):
+        first = ContextTarget.create('ctx_first', '{{sha_short}}{{git_dirty}}')
+        second = ContextTarget.create('ctx_second', '{{env}} {{sha}}')
+        first._hydrate(self.context)
+        second._hydrate(self.context)
+
+        self.assertEqual(first.command, '0123456789ab-dirty')
+        self.assertEqual(
+            second.command, 'stage 0123456789abcdef0123456789abcdef01234567'
+        )
+        self.assertEqual(sorted(self.repo.reads), ['dirty', 'sha'])
+        self.assertIs(first.run_context, second.run_context)
+
+    def test_template_values(self):
+        values = self.context.template_values
+        self.assertEqual(values['git_branch'], 'main')
+        self.assertEqual(values['git_commit_timestamp'], 1500000000)
+        self.assertEqual(values['env'], 'stage')
+        self.assertNotIn('jobs', values)
+        self.assertNotIn('subparser_name', values)
+
+    def test_arguments(self):
+        self.assertEqual(self.context.jobs, 2)
+        self.assertIs(RunContext.of(self.context), self.context)
+        self.assertEqual(RunContext.of(self.args).args, self.args)
+        with self.assertRaises(AttributeError):
+            self.context.nothing
+
+    def test_builtins_are_reserved(self):
+        with self.assertRaises(BuildConfigError):
+            ContextTarget.create('ctx_reserved', 'true',
+                                 git_branch='main')
+
+    def test_options_named_like_git_values(self):
+        target = ContextTarget.create('ctx_branch', '{{branch}}',
+                                      branch='release')
+        self.args.branch = 'release'
+        target._hydrate(RunContext(self.args, Builtins(self.repo)))
+        self.assertEqual(target.command, 'release')
+        self.assertEqual(self.repo.reads, [])
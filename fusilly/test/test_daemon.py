@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from StringIO import StringIO
+
+from fusilly.buildfiles import BuildFiles
+from fusilly.client import connect, request
+from fusilly.daemon import Daemon
+
+
+def open_files():
+    """ Return what the file descriptors of the process refer to. """
+    files = []
+    for fd in os.listdir('/proc/self/fd'):
+        try:
+            files.append(os.readlink('/proc/self/fd/%s' % fd))
+        except OSError:
+            # the descriptor listing the directory
+            pass
+    return files
+
+
+def handler(argv):
+    if argv == ['fds']:
+        sys.stdout.write('\n'.join(open_files()) + '\n')
+        sys.exit(0)
+    sys.stdout.write('%s in %s\n' % (' '.join(argv), os.getcwd()))
+    sys.exit(int(argv[-1]))
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.directory = os.path.realpath(tempfile.mkdtemp())
+        self.path = os.path.join(self.directory, 'daemon.sock')
+        buildFiles = BuildFiles(self.directory, self.directory)
+        self.daemon = Daemon(self.path, buildFiles, handler)
+        self.thread = threading.Thread(target=self.daemon.serve)
+        self.thread.start()
+
+    def tearDown(self):
+        self.daemon.stop()
+        self.thread.join()
+        shutil.rmtree(self.directory)
+
+    def connect(self):
+        for _ in range(50):
+            sock = connect(self.path)
+            if sock is not None:
+                return sock
+            threading.Event().wait(0.1)
+        self.fail("daemon is not listening")
+
+    def test_request_output_and_status(self):
+        output = StringIO()
+        cwd = os.getcwd()
+        os.chdir(self.directory)
+        try:
+            status = request(self.connect(), ['run', 'x', '3'], output)
+        finally:
+            os.chdir(cwd)
+
+        self.assertEqual(status, 3)
+        self.assertEqual(output.getvalue(),
+                         'run x 3 in %s\n' % self.directory)
+
+    @unittest.skipUnless(os.path.isdir('/proc/self/fd'), 'needs /proc')
+    def test_child_does_not_keep_the_daemon_files(self):
+        output = StringIO()
+        self.assertEqual(request(self.connect(), ['fds'], output), 0)
+        files = output.getvalue().split()
+        self.assertNotIn(os.readlink('/proc/self/fd/%d' %
+                                     self.daemon.sock.fileno()), files)
+        if hasattr(self.daemon.watcher, 'fd'):
+            inotify = 'anon_inode:inotify'
+            self.assertEqual(files.count(inotify),
+                             open_files().count(inotify) - 1)
+
+    def test_socket_removed_on_stop(self):
+        self.connect().close()
+        self.daemon.stop()
+        self.thread.join()
+        self.assertFalse(os.path.exists(self.path))
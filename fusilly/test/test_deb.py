@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from fusilly import deb
+from fusilly.deb import Deb, Manifest
+from fusilly.exceptions import BuildConfigError
+
+
+def read_ar_bytes(content):
+    """ Return the (name, data) of the members of the ar archive content. """
+    f = io.BytesIO(content)
+    members = []
+    assert f.read(8) == b'!<arch>\n'
+    while True:
+        header = f.read(60)
+        if not header:
+            return members
+        assert header[58:] == b'`\n'
+        size = int(header[48:58])
+        members.append((header[:16].decode('ascii').strip(), f.read(size)))
+        if size % 2:
+            f.read(1)
+
+
+def read_ar(path):
+    with open(path, 'rb') as f:
+        return read_ar_bytes(f.read())
+
+
+class DebTestCase(unittest.TestCase):
+    options = {
+        'deb-user': 'nobody',
+        'deb-group': 'nogroup',
+        'maintainer': 'shaw',
+        'version': '1.2',
+        'architecture': 'amd64',
+    }
+
+    def setUp(self):
+        self.directory = os.path.realpath(tempfile.mkdtemp())
+        self.root = os.path.join(self.directory, 'project')
+        self.venv = os.path.join(self.directory, 'venv')
+        for path, content in [('project/app/main.py', 'print(1)\n'),
+                              ('project/app/data/a.txt', 'a'),
+                              ('venv/bin/python', '#!python\n')]:
+            path = os.path.join(self.directory, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(content)
+        os.chmod(os.path.join(self.venv, 'bin', 'python'), 0o755)
+        os.symlink('python', os.path.join(self.venv, 'bin', 'python3'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def create(self, manifest_path=None, **options):
+        opts = dict(self.options, **options)
+        return Deb.create(
+            self.root, 'app', '/srv/app',
+            [os.path.join(self.root, 'app', 'main.py'),
+             os.path.join(self.root, 'app', 'data')],
+            opts, ['%s/=/srv/app/venv' % self.venv],
+            directory=self.directory, manifest_path=manifest_path,
+        )
+
+
+class TestDeb(DebTestCase):
+    def test_package_layout(self):
+        package = self.create(**{'deb-compression': 'gz'})
+
+        self.assertEqual(package.path,
+                         os.path.join(self.directory, 'app_1.2_amd64.deb'))
+        members = read_ar(package.path)
+        self.assertEqual([name for name, _ in members],
+                         ['debian-binary', 'control.tar.gz', 'data.tar.gz'])
+        self.assertEqual(members[0][1], b'2.0\n')
+
+        control = tarfile.open(fileobj=io.BytesIO(members[1][1]))
+        content = control.extractfile('./control').read().decode('utf-8')
+        self.assertIn('Package: app\n', content)
+        self.assertIn('Version: 1.2\n', content)
+        self.assertIn('Maintainer: shaw\n', content)
+
+        data = tarfile.open(fileobj=io.BytesIO(members[2][1]))
+        names = data.getnames()
+        # directories come before what they contain
+        self.assertEqual(names[:4], ['.', './srv', './srv/app',
+                                     './srv/app/app'])
+        self.assertEqual(sorted(names[4:]), [
+            './srv/app/app/data', './srv/app/app/data/a.txt',
+            './srv/app/app/main.py', './srv/app/venv', './srv/app/venv/bin',
+            './srv/app/venv/bin/python', './srv/app/venv/bin/python3',
+        ])
+
+        main = data.getmember('./srv/app/app/main.py')
+        self.assertEqual((main.uname, main.gname), ('nobody', 'nogroup'))
+        self.assertEqual(data.extractfile(main).read(), b'print(1)\n')
+        python = data.getmember('./srv/app/venv/bin/python')
+        self.assertEqual(python.mode, 0o755)
+        link = data.getmember('./srv/app/venv/bin/python3')
+        self.assertTrue(link.issym())
+        self.assertEqual(link.linkname, 'python')
+
+    def test_default_compression_is_bzip2(self):
+        members = read_ar(self.create().path)
+        self.assertEqual(members[2][0], 'data.tar.bz2')
+        data = tarfile.open(fileobj=io.BytesIO(members[2][1]), mode='r:bz2')
+        self.assertIn('./srv/app/app/main.py', data.getnames())
+
+    def test_unknown_compression(self):
+        self.assertRaisesRegexp(BuildConfigError, 'Unknown compression',
+                                self.create, **{'deb-compression': 'lz4'})
+
+
+class TestIncrementalDeb(DebTestCase):
+    def setUp(self):
+        super(TestIncrementalDeb, self).setUp()
+        self.segment_size = deb.SEGMENT_SIZE
+        deb.SEGMENT_SIZE = 1
+        self.manifest_path = os.path.join(self.directory, 'manifest.json')
+        for i in range(20):
+            with open(os.path.join(self.venv, 'lib%d.py' % i), 'w') as f:
+                f.write('x = %d\n' % i)
+
+    def tearDown(self):
+        deb.SEGMENT_SIZE = self.segment_size
+        super(TestIncrementalDeb, self).tearDown()
+
+    def build(self, **options):
+        return self.create(self.manifest_path,
+                           **dict({'deb-compression': 'gz'}, **options))
+
+    def test_unchanged_package_is_not_written_again(self):
+        first = self.build()
+        mtime = os.stat(first.path).st_mtime
+        second = self.build()
+
+        self.assertTrue(second.unchanged)
+        self.assertEqual(os.stat(second.path).st_mtime, mtime)
+
+    def test_unchanged_segments_are_copied(self):
+        first = self.build()
+        with open(os.path.join(self.venv, 'lib3.py'), 'a') as f:
+            f.write('y = 1\n')
+        # a new version is a new package, written from the previous one
+        second = self.build(version='1.3')
+
+        self.assertFalse(second.unchanged)
+        old = Manifest.load(self.manifest_path)
+        self.assertEqual(old.deb[0], second.path)
+        first_keys = set(Manifest(dict(segments=first.manifest.segments))
+                         .keys())
+        changed = [key for key in old.keys() if key not in first_keys]
+        self.assertEqual(len(changed), 1)
+
+        data = tarfile.open(fileobj=io.BytesIO(read_ar(second.path)[2][1]))
+        self.assertEqual(
+            data.extractfile('./srv/app/venv/lib3.py').read(),
+            b'x = 3\ny = 1\n'
+        )
+        self.assertEqual(data.extractfile('./srv/app/venv/lib4.py').read(),
+                         b'x = 4\n')
+
+
+class TestReproducibleDeb(DebTestCase):
+    def build(self, jobs, **options):
+        directory = os.path.join(self.directory, 'out%d' % jobs)
+        os.mkdir(directory)
+        package = Deb(
+            'app', dict(self.options, **options), jobs=jobs, epoch=1000000
+        )
+        files = [os.path.join(self.root, 'app', 'main.py'),
+                 os.path.join(self.root, 'app', 'data')]
+        if jobs > 1:
+            files.reverse()
+        for filename in files:
+            package.add(filename, os.path.join(
+                '/srv/app', os.path.relpath(filename, self.root)))
+        package.add_tree(self.venv, '/srv/app/venv')
+        package.write(os.path.join(directory, package.filename))
+        with open(package.path, 'rb') as f:
+            return f.read()
+
+    def check_reproducible(self, **options):
+        first = self.build(1, **options)
+        main = os.path.join(self.root, 'app', 'main.py')
+        os.utime(main, (2000000, 2000000))
+        os.chmod(main, 0o664)
+        second = self.build(3, **options)
+        self.assertEqual(first, second)
+
+        data = tarfile.open(fileobj=io.BytesIO(read_ar_bytes(second)[2][1]))
+        info = data.getmember('./srv/app/app/main.py')
+        self.assertEqual((info.mtime, info.mode), (1000000, 0o644))
+        self.assertEqual(data.getmember('./srv').mtime, 1000000)
+
+    def test_gz(self):
+        self.check_reproducible(**{'deb-compression': 'gz'})
+
+    def test_bzip2(self):
+        self.check_reproducible()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from fusilly import globbing
+from fusilly.globbing import expand, matcher
+
+
+class TestExpand(unittest.TestCase):
+    FILES = [
+        'setup.py',
+        'pkg/a.py',
+        'pkg/b.txt',
+        'pkg/sub/c.py',
+        'pkg/test/test_a.py',
+        'pkg/test/data/d.py',
+        '.hidden/e.py',
+    ]
+
+    def setUp(self):
+        self.directory = os.path.realpath(tempfile.mkdtemp())
+        for relpath in self.FILES:
+            path = os.path.join(self.directory, relpath)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').close()
+        # listings of directories changed just now are not reused
+        self.age(self.directory)
+
+    def age(self, directory):
+        earlier = time.time() - 60
+        for root, dirs, _ in os.walk(directory):
+            for name in dirs + ['.']:
+                os.utime(os.path.join(root, name), (earlier, earlier))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def expand(self, globs, exclude_globs=None):
+        return sorted(
+            os.path.relpath(path, self.directory)
+            for path in expand(self.directory, globs, exclude_globs)
+        )
+
+    def test_recursive_with_excluded_directory(self):
+        self.assertEqual(self.expand(['**/*.py'], ['**/test/**']),
+                         ['pkg/a.py', 'pkg/sub/c.py', 'setup.py'])
+        # the excluded directory was not entered
+        self.assertNotIn(os.path.join(self.directory, 'pkg', 'test'),
+                         globbing._listings)
+
+    def test_plain_paths_and_single_level_globs(self):
+        self.assertEqual(self.expand(['setup.py', 'pkg/*', 'missing.py']),
+                         ['pkg/a.py', 'pkg/b.txt', 'pkg/sub', 'pkg/test',
+                          'setup.py'])
+
+    def test_new_files_are_seen(self):
+        self.assertEqual(self.expand(['pkg/*.txt']), ['pkg/b.txt'])
+        open(os.path.join(self.directory, 'pkg', 'new.txt'), 'w').close()
+        # make sure the directory mtime moves on coarse filesystems
+        os.utime(os.path.join(self.directory, 'pkg'), (0, 0))
+        self.assertEqual(self.expand(['pkg/*.txt']),
+                         ['pkg/b.txt', 'pkg/new.txt'])
+
+    def test_entry_added_in_the_same_tick(self):
+        pkg = os.path.join(self.directory, 'pkg')
+        mtime = time.time()
+        os.utime(pkg, (mtime, mtime))
+        self.assertEqual(self.expand(['pkg/*.txt']), ['pkg/b.txt'])
+        open(os.path.join(pkg, 'new.txt'), 'w').close()
+        # as if the new file had been created within the same mtime tick
+        os.utime(pkg, (mtime, mtime))
+        self.assertEqual(self.expand(['pkg/*.txt']),
+                         ['pkg/b.txt', 'pkg/new.txt'])
+
+    def test_listings_are_bounded(self):
+        maximum = globbing.MAX_LISTINGS
+        globbing.MAX_LISTINGS = 2
+        try:
+            self.expand(['**/*.py'])
+            self.assertLessEqual(len(globbing._listings), 2)
+        finally:
+            globbing.MAX_LISTINGS = maximum
+
+    def test_symlink_cycle(self):
+        os.symlink('..', os.path.join(self.directory, 'pkg', 'up'))
+        os.symlink(os.path.join('..', '..', 'pkg'),
+                   os.path.join(self.directory, 'pkg', 'sub', 'pkg'))
+        self.assertEqual(self.expand(['**/*.py'], ['**/test/**']),
+                         ['pkg/a.py', 'pkg/sub/c.py', 'setup.py'])
+        # links are entries like any other
+        self.assertIn('pkg/up', self.expand(['pkg/*']))
+        # and can be named in a pattern
+        self.assertEqual(self.expand(['pkg/sub/pkg/*.py']),
+                         ['pkg/sub/pkg/a.py'])
+
+
+class TestMatcher(unittest.TestCase):
+    def test_recursive_globs_and_excludes(self):
+        match = matcher('/p', ['**/*.py'], ['**/test/**'])
+
+        self.assertTrue(match('/p/a.py'))
+        self.assertTrue(match('/p/x/y/b.py'))
+        self.assertFalse(match('/p/x/test/c.py'))
+        self.assertFalse(match('/p/.hidden/a.py'))
+        self.assertFalse(match('/p/a.pyc'))
+        self.assertFalse(match('/q/a.py'))
+
+    def test_relative_to_directory(self):
+        match = matcher('/p/sub', ['../lib/**', 'req[0-9].txt'])
+
+        self.assertTrue(match('/p/lib/a/b'))
+        self.assertTrue(match('/p/sub/req1.txt'))
+        self.assertFalse(match('/p/sub/reqa.txt'))
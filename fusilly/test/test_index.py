@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+from fusilly.index import DiscoveryIndex, git_build_files
+
+
+class TestDiscoveryIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.directory, '.fusilly')
+        os.mkdir(self.cache_dir)
+        for package in ('a', 'a/b', 'node_modules/c', '.hidden'):
+            self.add_build_file(package)
+        # directories changed within RACY_SECONDS of being listed are
+        # listed again, which the tests do not wait for
+        earlier = time.time() - 60
+        for root, dirs, _ in os.walk(self.directory):
+            for name in dirs + ['.']:
+                os.utime(os.path.join(root, name), (earlier, earlier))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def add_build_file(self, package):
+        directory = os.path.join(self.directory, package)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        open(os.path.join(directory, 'BUILD.fs'), 'w').close()
+        return os.path.join(directory, 'BUILD.fs')
+
+    def index(self):
+        return DiscoveryIndex(self.directory, self.cache_dir, 'BUILD.fs',
+                              ['node_modules'])
+
+    def test_build_files(self):
+        self.assertEqual(self.index().build_files(), [
+            os.path.join(self.directory, 'a', 'BUILD.fs'),
+            os.path.join(self.directory, 'a', 'b', 'BUILD.fs'),
+        ])
+
+    def test_only_changed_directories_are_listed(self):
+        self.index().build_files()
+        new_build_file = self.add_build_file('a/b/new')
+
+        listed = []
+        index = self.index()
+        list_directory = index._list
+
+        def _list(directory):
+            listed.append(directory)
+            return list_directory(directory)
+        index._list = _list
+
+        self.assertIn(new_build_file, index.build_files())
+        self.assertEqual(listed, [
+            os.path.join(self.directory, 'a', 'b'),
+            os.path.join(self.directory, 'a', 'b', 'new'),
+        ])
+
+    def test_build_file_added_in_the_same_tick(self):
+        directory = os.path.join(self.directory, 'a')
+        mtime = time.time()
+        os.utime(directory, (mtime, mtime))
+        self.index().build_files()
+        new_build_file = self.add_build_file('a/new')
+        # as if the new directory had been created within the same mtime tick
+        os.utime(directory, (mtime, mtime))
+        self.assertIn(new_build_file, self.index().build_files())
+
+    def test_removed_directory(self):
+        self.index().build_files()
+        shutil.rmtree(os.path.join(self.directory, 'a', 'b'))
+        self.assertEqual(self.index().build_files(), [
+            os.path.join(self.directory, 'a', 'BUILD.fs'),
+        ])
+
+    def test_git_build_files(self):
+        subprocess.check_call(['git', 'init', '-q', self.directory])
+        with open(os.path.join(self.directory, '.gitignore'), 'w') as f:
+            f.write('a/b/\n')
+
+        self.assertEqual(
+            git_build_files(self.directory, 'BUILD.fs', ['node_modules']),
+            [os.path.join(self.directory, 'a', 'BUILD.fs')]
+        )
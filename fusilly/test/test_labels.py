@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+
+import unittest
+
+from fusilly.exceptions import BuildConfigError
+from fusilly.labels import parse_label
+
+
+class TestLabels(unittest.TestCase):
+    def test_parse_label(self):
+        self.assertEqual(parse_label('//services/api:artifact'),
+                         ('services/api', 'artifact'))
+        self.assertEqual(parse_label('//services/api'),
+                         ('services/api', 'api'))
+        self.assertEqual(parse_label('//:artifact'), ('', 'artifact'))
+        self.assertEqual(parse_label('artifact'), (None, 'artifact'))
+
+    def test_invalid_label(self):
+        self.assertRaises(BuildConfigError, parse_label, '//')
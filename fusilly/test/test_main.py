@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+import argparse
+import unittest
+
+from fusilly import main
+from fusilly.plan import BuildPlan
+from fusilly.targets import Target, Targets
+
+
+class OptionTarget(Target):
+    def run(self, inputdict):
+        return None
+
+    @classmethod
+    def create(cls, name, **kwargs):
+        if name in Targets:
+            return Targets.get(name)
+        return OptionTarget(name, **kwargs)
+
+
+class TestTargetParser(unittest.TestCase):
+    def setUp(self):
+        OptionTarget.create('cli_shared', cli_shared_opt='shared')
+        OptionTarget.create('cli_left', deps=['cli_shared'],
+                            cli_side='left')
+        OptionTarget.create('cli_right', deps=['cli_shared'],
+                            cli_side='right')
+        OptionTarget.create('cli_top', deps=['cli_left', 'cli_right'])
+        OptionTarget.create('cli_other', cli_other_opt='other')
+
+        self.looked_up = []
+        self.target_names = main.target_names
+
+        def target_names(buildFiles):
+            self.looked_up.append(buildFiles)
+            return ['cli_other', 'cli_top']
+        main.target_names = target_names
+
+    def tearDown(self):
+        main.target_names = self.target_names
+
+    def parse(self, args):
+        argParser = main.target_parser('run', 'Run target', args, None)
+        return main.parse_target_args(argParser, args)
+
+    def test_options_of_the_dependencies_once(self):
+        args = self.parse(['-j', '2', 'cli_top', '--cli_shared_opt', 'x'])
+        self.assertEqual(args.subparser_name, 'cli_top')
+        self.assertEqual(args.jobs, 2)
+        self.assertEqual(args.cli_shared_opt, 'x')
+        # the first target to run defining an option gives its default
+        self.assertEqual(args.cli_side, 'left')
+        self.assertFalse(hasattr(args, 'cli_other_opt'))
+        self.assertEqual(self.looked_up, [])
+
+    def test_plan_options(self):
+        plan = BuildPlan(Targets.get('cli_top'))
+        self.assertEqual(main.plan_options(plan),
+                         [('cli_shared_opt', 'shared'), ('cli_side', 'left')])
+
+    def test_unknown_target(self):
+        with self.assertRaises(SystemExit):
+            self.parse(['cli_nowhere'])
+        with self.assertRaises(SystemExit):
+            self.parse(['-j', '2'])
+
+    def test_help_lists_the_targets(self):
+        argParser = main.target_parser('run', 'Run target', ['-h'], None)
+        self.assertEqual(self.looked_up, [])
+        self.assertIn('targets:\n  cli_other\n  cli_top\n',
+                      argParser.format_help())
+        self.assertEqual(self.looked_up, [None])
+
+    def test_plan_args(self):
+        subArgs = argparse.Namespace(jobs=1, no_cache=False,
+                                     compression_level=None)
+        args = main.plan_args(BuildPlan(Targets.get('cli_right')), subArgs)
+        self.assertEqual(args.cli_side, 'right')
+        self.assertEqual(args.cli_shared_opt, 'shared')
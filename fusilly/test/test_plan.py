@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import unittest
+
+from fusilly.exceptions import BuildConfigError, DependencyCycleError
+from fusilly.plan import BuildPlan
+from fusilly.targets import Target, Targets
+
+
+class CountingTarget(Target):
+    def run(self, inputdict):
+        return None
+
+    def check(self):
+        self.checks += 1
+        return 0
+
+    @classmethod
+    def create(cls, name, **kwargs):
+        if name in Targets:
+            return Targets.get(name)
+        target = CountingTarget(name, **kwargs)
+        # pylint: disable=W0201
+        target.checks = 0
+        return target
+
+
+class TestBuildPlan(unittest.TestCase):
+    def setUp(self):
+        CountingTarget.create('plan_shared')
+        CountingTarget.create('plan_left', deps=['plan_shared'])
+        CountingTarget.create('plan_right', deps=['plan_shared'])
+        CountingTarget.create('plan_top', deps=['plan_left', 'plan_right'])
+
+        CountingTarget.create('plan_cycle_a', deps=['plan_cycle_b'])
+        CountingTarget.create('plan_cycle_b', deps=['plan_cycle_c'])
+        CountingTarget.create('plan_cycle_c', deps=['plan_cycle_a'])
+
+        CountingTarget.create('plan_unknown', deps=['plan_nowhere'])
+
+    def test_diamond_visited_once(self):
+        plan = BuildPlan(Targets.get('plan_top'))
+        self.assertEqual(
+            plan.order,
+            ['plan_shared', 'plan_left', 'plan_right', 'plan_top']
+        )
+        self.assertEqual(plan.dependents['plan_shared'],
+                         ['plan_left', 'plan_right'])
+
+        checks = Targets.get('plan_shared').checks
+        self.assertEqual(plan.check(), 0)
+        self.assertEqual(Targets.get('plan_shared').checks, checks + 1)
+
+    def test_cycle_reports_chain(self):
+        self.assertRaisesRegexp(
+            DependencyCycleError,
+            'plan_cycle_a -> plan_cycle_b -> plan_cycle_c -> plan_cycle_a',
+            BuildPlan,
+            Targets.get('plan_cycle_a')
+        )
+
+    def test_unknown_dep(self):
+        self.assertRaisesRegexp(
+            BuildConfigError,
+            "'plan_unknown' depends on unknown target 'plan_nowhere'",
+            BuildPlan,
+            Targets.get('plan_unknown')
+        )
+
+    def test_deep_graph(self):
+        names = ['plan_chain_%d' % i for i in range(3000)]
+        for name, depname in zip(names, names[1:]):
+            CountingTarget.create(name, deps=[depname])
+        CountingTarget.create(names[-1])
+
+        plan = BuildPlan(Targets.get(names[0]))
+        self.assertEqual(plan.order, list(reversed(names)))
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+from fusilly import repo
+from fusilly.repo import GitRepo
+
+
+class FilesOnlyRepo(GitRepo):
+    def _git(self, cmd):
+        raise AssertionError("ran %s" % cmd)
+
+
+class TestGitRepo(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.git('init', '-q')
+        os.mkdir(os.path.join(self.directory, 'sub'))
+        self.write('a', 'a\n')
+        self.write('sub/b', 'b\n')
+        os.symlink('a', os.path.join(self.directory, 'link'))
+        # files changed within the second the index is written are hashed
+        # rather than trusted by their stat, which the tests do not wait for
+        earlier = time.time() - 10
+        for name in ('a', 'sub/b'):
+            os.utime(os.path.join(self.directory, name), (earlier, earlier))
+        self.git('add', '.')
+        self.commit()
+        self.repo = FilesOnlyRepo(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def git(self, *args):
+        return subprocess.check_output(
+            ('git',) + args, cwd=self.directory
+        ).decode('utf-8').strip()
+
+    def commit(self):
+        self.git('-c', 'user.name=fusilly', '-c', 'user.email=fusilly@test',
+                 'commit', '-q', '--allow-empty', '-m', 'commit')
+
+    def write(self, name, content):
+        with open(os.path.join(self.directory, name), 'w') as f:
+            f.write(content)
+
+    def assertHead(self, repo):
+        self.assertEqual(repo.head_sha(), self.git('rev-parse', 'HEAD'))
+        self.assertEqual(repo.head_sha_short(),
+                         self.git('rev-parse', 'HEAD')[:12])
+        self.assertEqual(repo.head_timestamp(),
+                         int(self.git('log', '-1', '--format=%ct')))
+
+    def test_head(self):
+        self.assertHead(self.repo)
+        self.assertEqual(self.repo.branch(),
+                         self.git('rev-parse', '--abbrev-ref', 'HEAD'))
+        self.assertHead(FilesOnlyRepo(os.path.join(self.directory, 'sub')))
+
+    def test_packed(self):
+        self.commit()
+        self.git('gc', '-q')
+        self.assertFalse(os.listdir(
+            os.path.join(self.directory, '.git', 'refs', 'heads')
+        ))
+        self.assertHead(self.repo)
+
+    def test_detached(self):
+        self.commit()
+        self.git('checkout', '-q', 'HEAD~1')
+        self.assertHead(self.repo)
+        self.assertIsNone(self.repo.branch())
+
+    def test_outside_of_a_repository(self):
+        directory = tempfile.mkdtemp()
+        try:
+            repo = GitRepo(directory)
+            self.assertIsNone(repo.head_sha())
+            self.assertIsNone(repo.head_timestamp())
+            self.assertIsNone(repo.is_dirty())
+        finally:
+            shutil.rmtree(directory)
+
+    def test_clean(self):
+        self.assertFalse(self.repo.is_dirty())
+        # same content, other mtime
+        self.write('a', 'a\n')
+        self.assertFalse(self.repo.is_dirty())
+
+    def test_dirty(self):
+        self.write('sub/b', 'longer\n')
+        self.assertTrue(self.repo.is_dirty())
+        # the index no longer tells the tree it was written as
+        self.git('add', 'sub/b')
+        self.assertTrue(GitRepo(self.directory).is_dirty())
+
+    def test_removed(self):
+        os.remove(os.path.join(self.directory, 'a'))
+        self.assertTrue(self.repo.is_dirty())
+
+    def test_untracked_files_are_not_changes(self):
+        self.write('c', 'c\n')
+        self.assertFalse(self.repo.is_dirty())
+
+    def test_same_size_change_asks_git(self):
+        self.write('a', 'b\n')
+        self.assertTrue(GitRepo(self.directory).is_dirty())
+
+    def test_unreadable_file_asks_git(self):
+        path = os.path.join(self.directory, 'a')
+        read = repo._read
+        repo._read = lambda name: None if name == path else read(name)
+        try:
+            self.write('a', 'a\n')
+            self.assertFalse(GitRepo(self.directory).is_dirty())
+            with self.assertRaises(AssertionError):
+                self.repo.is_dirty()
+        finally:
+            repo._read = read
+
+    def test_refs_git_keeps_elsewhere(self):
+        os.mkdir(os.path.join(self.directory, '.git', 'reftable'))
+        with self.assertRaises(AssertionError):
+            self.repo.head_sha()
+        self.assertHead(GitRepo(self.directory))
+        self.assertEqual(GitRepo(self.directory).branch(),
+                         self.git('rev-parse', '--abbrev-ref', 'HEAD'))
+
+    def test_git_directory_from_the_environment(self):
+        os.environ['GIT_DIR'] = os.path.join(self.directory, '.git')
+        try:
+            with self.assertRaises(AssertionError):
+                self.repo.head_sha()
+            self.assertHead(GitRepo(self.directory))
+            self.assertFalse(GitRepo(self.directory).is_dirty())
+        finally:
+            del os.environ['GIT_DIR']
+
+    def test_split_index_asks_git(self):
+        self.git('update-index', '--split-index')
+        with self.assertRaises(AssertionError):
+            self.repo.is_dirty()
+        self.assertFalse(GitRepo(self.directory).is_dirty())
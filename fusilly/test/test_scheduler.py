@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+import argparse
+import threading
+import unittest
+
+from fusilly.plan import BuildPlan
+from fusilly.scheduler import Scheduler
+from fusilly.targets import Target, Targets
+
+
+class RecordingTarget(Target):
+    def run(self, inputdict):
+        # pylint: disable=W0201
+        self.inputdict = dict(inputdict)
+        if self.wait_for:
+            self.ran_concurrently = Targets.get(self.wait_for).started.wait(5)
+        self.started.set()
+        return {self.name: True}
+
+    @classmethod
+    def create(cls, name, wait_for=None, **kwargs):
+        if name in Targets:
+            return Targets.get(name)
+        target = RecordingTarget(name, **kwargs)
+        # pylint: disable=W0201
+        target.wait_for = wait_for
+        target.started = threading.Event()
+        target.ran_concurrently = None
+        target.inputdict = None
+        return target
+
+
+class ExitingTarget(Target):
+    def run(self, inputdict):
+        raise SystemExit(1)
+
+
+def program_args(jobs):
+    return argparse.Namespace(subparser_name=None, args=[], jobs=jobs)
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        RecordingTarget.create('sched_left', wait_for='sched_right')
+        RecordingTarget.create('sched_right')
+        RecordingTarget.create('sched_top', deps=['sched_left', 'sched_right'])
+
+    def test_parallel_run_merges_dep_outputs(self):
+        top = Targets.get('sched_top')
+        output = Scheduler(BuildPlan(top), program_args(2), jobs=2).run()
+
+        self.assertTrue(Targets.get('sched_left').ran_concurrently)
+        self.assertEqual(top.inputdict,
+                         {'sched_left': True, 'sched_right': True})
+        self.assertEqual(output, {'sched_left': True, 'sched_right': True,
+                                  'sched_top': True})
+
+    def test_given_outputs_are_not_run_again(self):
+        top = Targets.get('sched_top')
+        right = Targets.get('sched_right')
+        right.inputdict = None
+        # sched_left waits for it
+        right.started.set()
+        outputs = {'sched_right': {'sched_right': 'previous'}}
+
+        for jobs in (1, 2):
+            scheduler = Scheduler(BuildPlan(top), program_args(jobs),
+                                  jobs=jobs, outputs=outputs)
+            self.assertEqual(scheduler.todo, ['sched_left', 'sched_top'])
+            output = scheduler.run()
+
+            self.assertEqual(right.inputdict, None)
+            self.assertEqual(output['sched_right'], 'previous')
+            self.assertEqual(output['sched_top'], True)
+
+    def test_exit_in_a_worker_reaches_the_main_thread(self):
+        if 'sched_exit' not in Targets:
+            ExitingTarget('sched_exit', deps=['sched_right'])
+        plan = BuildPlan(Targets.get('sched_exit'))
+        with self.assertRaises(SystemExit):
+            Scheduler(plan, program_args(2), jobs=2).run()
@@ -3,6 +3,7 @@
 import json
 import unittest
 
+from fusilly import templates
 from fusilly.exceptions import MissingTemplateValue
 from fusilly.targets import Target, Targets
 
@@ -103,3 +104,71 @@ class TestTemplating(unittest.TestCase):
             self.test_target.command,
             'npm run build --maintainer=shaw@wish.com --build_opts=foobar',
         )
+
+    def test_list_of_dicts(self):
+        build_spec = {'steps': [{'run': "deploy {{env}}"}, ("{{sha1}}", 3)]}
+        args = {'env': 'production', 'sha1': '1234'}
+        self.test_target._make_cmdline_substitions(args, build_spec)
+        self.assertEqual(
+            build_spec,
+            {'steps': [{'run': "deploy production"}, ("1234", 3)]}
+        )
+
+    def test_missing_options_reported_together(self):
+        build_spec = dict(build="npm build --env={{env}} --sha1={{sha1}}",
+                          other="{{region}}")
+        with self.assertRaises(MissingTemplateValue) as raised:
+            self.test_target._make_cmdline_substitions({}, build_spec)
+        self.assertIn("'{{env}}', '{{region}}', '{{sha1}}'",
+                      str(raised.exception))
+
+    def test_option_holding_a_template(self):
+        build_spec = dict(build="npm build --version={{version}}")
+        args = {'version': '{{sha_short}}-{{env}}', 'sha_short': 'abc',
+                'env': '{{region}}', 'region': 'eu'}
+        self.test_target._make_cmdline_substitions(args, build_spec)
+        # placeholders of the values referred to are rendered in turn
+        self.assertEqual(build_spec,
+                         dict(build="npm build --version=abc-eu"))
+
+    def test_option_referring_to_a_missing_value(self):
+        build_spec = dict(build="npm build --version={{version}}")
+        args = {'version': '{{tag}}', 'tag': '{{region}}'}
+        with self.assertRaises(MissingTemplateValue) as raised:
+            self.test_target._make_cmdline_substitions(args, build_spec)
+        self.assertIn("'{{region}}' without a definition",
+                      str(raised.exception))
+
+    def test_options_referring_to_each_other(self):
+        build_spec = dict(build="npm build --version={{version}}")
+        args = {'version': '{{tag}}', 'tag': 'v{{version}}'}
+        with self.assertRaises(MissingTemplateValue) as raised:
+            self.test_target._make_cmdline_substitions(args, build_spec)
+        self.assertIn("'{{version}}' -> '{{tag}}' -> '{{version}}'",
+                      str(raised.exception))
+
+    def test_templating_again(self):
+        target = TargetTest.create(name='test_again',
+                                   command='deploy {{env}}', env='dev')
+        target._templating({'env': 'stage'})
+        self.assertEqual(target.command, 'deploy stage')
+        target._templating({'env': 'production'})
+        self.assertEqual(target.command, 'deploy production')
+
+
+class TestTemplate(unittest.TestCase):
+    def test_parse(self):
+        value = {'a': ['x', 1], 'b': None}
+        self.assertIs(templates.parse(value), value)
+        node = templates.parse({'a': ['{{x}}', '{{y}}{{x}}'], 'b': 2})
+        self.assertEqual(templates.variables(node), frozenset(['x', 'y']))
+
+    def test_render(self):
+        nodes = {
+            'command': templates.parse('{{a}} and {{b}}, {{a}}'),
+            'literal': 'no {placeholder}',
+        }
+        self.assertEqual(templates.render(nodes, {'a': 1, 'b': 'two'}), {
+            'command': '1 and two, 1',
+            'literal': 'no {placeholder}',
+        })
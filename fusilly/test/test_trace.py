@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from fusilly.command import Command
+from fusilly.plan import BuildPlan
+from fusilly.scheduler import Scheduler
+from fusilly.targets import Target, Targets
+from fusilly.trace import BuildTrace
+
+
+class SleepingTarget(Target):
+    def run(self, inputdict):
+        time.sleep(self.seconds)
+        if self.command:
+            Command(self.command).run()
+        return {}
+
+    @classmethod
+    def create(cls, name, seconds=0, command=None, **kwargs):
+        if name in Targets:
+            return Targets.get(name)
+        target = SleepingTarget(name, **kwargs)
+        # pylint: disable=W0201
+        target.seconds = seconds
+        target.command = command
+        return target
+
+
+class TestBuildTrace(unittest.TestCase):
+    def setUp(self):
+        SleepingTarget.create('trace_slow', seconds=0.2)
+        SleepingTarget.create('trace_fast', command='true')
+        SleepingTarget.create('trace_top', deps=['trace_fast', 'trace_slow'])
+        self.plan = BuildPlan(Targets.get('trace_top'))
+        args = argparse.Namespace(subparser_name=None, args=[], jobs=2)
+        self.scheduler = Scheduler(self.plan, args, jobs=2)
+        self.scheduler.run()
+        self.trace = self.scheduler.trace
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_critical_path_follows_the_slowest_dependency(self):
+        self.assertEqual(self.trace.critical_path(self.plan),
+                         ['trace_slow', 'trace_top'])
+
+    def test_records(self):
+        records = dict((r.name, r) for r in self.trace.records)
+        self.assertEqual(sorted(records),
+                         ['trace_fast', 'trace_slow', 'trace_top'])
+        self.assertGreaterEqual(records['trace_slow'].wall, 0.2)
+        # the process started by the target is accounted to it
+        self.assertGreater(records['trace_fast'].children_max_rss_kb, 0)
+        self.assertEqual(records['trace_slow'].children_max_rss_kb, 0)
+
+    def test_chrome_trace(self):
+        path = os.path.join(self.directory, 'trace.json')
+        self.trace.write(path)
+        with open(path) as f:
+            events = json.load(f)['traceEvents']
+
+        spans = [e for e in events if e['ph'] == 'X']
+        self.assertEqual(sorted(e['name'] for e in spans),
+                         ['trace_fast', 'trace_slow', 'trace_top'])
+        top = [e for e in spans if e['name'] == 'trace_top'][0]
+        slow = [e for e in spans if e['name'] == 'trace_slow'][0]
+        self.assertGreaterEqual(top['ts'], slow['ts'] + slow['dur'])
+
+    def test_failed_target(self):
+        trace = BuildTrace()
+        with self.assertRaises(ValueError):
+            with trace.target('boom'):
+                raise ValueError()
+        self.assertTrue(trace.records[0].failed)
+        self.assertIsNotNone(trace.records[0].end)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from fusilly.virtualenv import (
+    VirtualenvCache,
+    read_requirements,
+    requirement_name,
+)
+
+
+class TestVirtualenvCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = VirtualenvCache(os.path.join(self.directory, 'cache'),
+                                     max_size=10 ** 9, max_age=3600)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def build(self, requirements):
+        """ Stand-in for a virtualenv build: a bin/ script referring to the
+        directory it was built in. """
+        tmppath = self.cache.mkdtemp()
+        os.mkdir(os.path.join(tmppath, 'bin'))
+        with open(os.path.join(tmppath, 'bin', 'pip'), 'w') as f:
+            f.write('#!%s/bin/python\n' % tmppath)
+        key = self.cache.key(requirements)
+        return self.cache.publish(tmppath, key, requirements)
+
+    def test_read_requirements(self):
+        base = os.path.join(self.directory, 'base.txt')
+        with open(base, 'w') as f:
+            f.write('# pinned\ntoml==0.9.4\n\nglob2==0.6  # globbing\n')
+        reqs = os.path.join(self.directory, 'requirements.txt')
+        with open(reqs, 'w') as f:
+            f.write('-r base.txt\nipdb\n')
+
+        self.assertEqual(read_requirements(reqs),
+                         ['toml==0.9.4', 'glob2==0.6', 'ipdb'])
+        self.assertEqual(requirement_name('Glob2==0.6'), 'glob2')
+        self.assertEqual(requirement_name('requests[security]>=2'),
+                         'requests')
+        self.assertEqual(requirement_name('--index-url http://pypi'), None)
+
+    def test_publish_and_get(self):
+        requirements = ['toml==0.9.4']
+        path = self.build(requirements)
+
+        self.assertEqual(self.cache.get(self.cache.key(requirements)), path)
+        self.assertEqual(self.cache.get(self.cache.key(['glob2==0.6'])), None)
+        with open(os.path.join(path, 'bin', 'pip')) as f:
+            self.assertEqual(f.read(), '#!%s/bin/python\n' % path)
+
+    def test_bookkeeping_is_kept_out_of_the_virtualenv(self):
+        path = self.build(['toml==0.9.4'])
+        self.assertEqual(os.listdir(path), ['bin'])
+        self.assertEqual(sorted(os.listdir(self.cache.directory)), [
+            os.path.basename(path),
+            os.path.basename(path) + '.json',
+            os.path.basename(path) + '.last-used',
+        ])
+
+    def test_nearest(self):
+        path = self.build(['toml==0.9.4'])
+        self.build(['toml==0.9.4', 'glob2==0.6'])
+
+        nearest, metadata = self.cache.nearest(['toml==0.9.4', 'ipdb'])
+        self.assertEqual(nearest, path)
+        self.assertEqual(metadata['requirements'], ['toml==0.9.4'])
+
+        # the dependencies of a requirement would be left behind by
+        # uninstalling it, so none is
+        self.assertEqual(self.cache.nearest(['glob2==0.6', 'ipdb']), None)
+
+    def test_evicts_least_recently_used(self):
+        old = self.build(['toml==0.9.4'])
+        os.utime(old + '.last-used', (0, 0))
+
+        self.cache.max_size = 1
+        new = self.build(['glob2==0.6'])
+        self.assertFalse(os.path.exists(old))
+        self.assertFalse(os.path.exists(old + '.json'))
+        self.assertTrue(os.path.exists(new))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import shutil
+import tempfile
+import unittest
+
+from fusilly.targets import Target, Targets
+from fusilly.watch import WatchSession
+
+
+class CountingTarget(Target):
+    def run(self, inputdict):
+        # pylint: disable=W0201
+        self.runs += 1
+        self.inputdict = dict(inputdict)
+        return {self.name: self.runs}
+
+    @classmethod
+    def create(cls, name, **kwargs):
+        Targets.target_dict.pop(name, None)
+        target = cls(name, **kwargs)
+        # pylint: disable=W0201
+        target.runs = 0
+        target.inputdict = None
+        return target
+
+
+class WritingTarget(CountingTarget):
+    """ Watches its input and writes its output, and on its first run
+    writes the content given to the file named edit as it runs. """
+
+    def watch_paths(self):
+        return [self.input, self.output]
+
+    def output_files(self):
+        return [self.output]
+
+    def run(self, inputdict):
+        with open(self.output, 'w') as f:
+            f.write(str(self.runs))
+        for path, content in self.edits.pop(0) if self.edits else ():
+            with open(path, 'w') as f:
+                f.write(content)
+        return super(WritingTarget, self).run(inputdict)
+
+
+class TestWatchSession(unittest.TestCase):
+    def setUp(self):
+        CountingTarget.create('watch_left')
+        CountingTarget.create('watch_right')
+        CountingTarget.create('watch_top', deps=['watch_left', 'watch_right'])
+        args = argparse.Namespace(subparser_name='watch_top', args=[], jobs=1)
+        self.session = WatchSession(None, 'watch_top', args)
+        self.session._update_plan()
+
+    def tearDown(self):
+        self.session.watcher.close()
+
+    def test_only_affected_targets_run_again(self):
+        self.session._build(set(self.session.plan.order))
+
+        dirty = self.session._with_dependents(['watch_right'])
+        self.assertEqual(dirty, set(['watch_right', 'watch_top']))
+        self.assertEqual(self.session._build(dirty), dirty)
+
+        self.assertEqual(Targets.get('watch_left').runs, 1)
+        self.assertEqual(Targets.get('watch_right').runs, 2)
+        self.assertEqual(Targets.get('watch_top').inputdict,
+                         {'watch_left': 1, 'watch_right': 2})
+
+    def write_session(self, edits):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        target = WritingTarget.create('watch_writing')
+        # pylint: disable=W0201
+        target.input = os.path.join(directory, 'input.py')
+        target.output = os.path.join(directory, 'output.txt')
+        target.edits = [[(target.input, content)] for content in edits]
+        with open(target.input, 'w') as f:
+            f.write('before\n')
+
+        args = argparse.Namespace(subparser_name='watch_writing', args=[],
+                                  jobs=1)
+        session = WatchSession(None, 'watch_writing', args)
+        self.addCleanup(session.watcher.close)
+        session._update_plan()
+        ran = session._build(set(session.plan.order))
+        return session, session._ignore_own_changes(ran), target
+
+    def test_input_edited_during_a_run(self):
+        _, pending, target = self.write_session(['after\n'])
+        self.assertEqual(pending, set([target.input]))
+
+    def test_own_changes_are_ignored(self):
+        # the input is written again as it was, the output is declared
+        _, pending, _ = self.write_session(['before\n'])
+        self.assertEqual(pending, set())
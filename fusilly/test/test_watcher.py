@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from fusilly.watcher import PollingWatcher, watcher
+
+
+class WatcherTests(object):
+    """ Tests run against each kind of watcher. """
+
+    def setUp(self):
+        self.directory = os.path.realpath(tempfile.mkdtemp())
+        self.path = os.path.join(self.directory, 'BUILD.fs')
+        self.write(self.path, 'one')
+        self.subdir = os.path.join(self.directory, 'src')
+        os.mkdir(self.subdir)
+        self.watcher = self.make_watcher()
+        self.watcher.watch([self.path, self.subdir])
+
+    def tearDown(self):
+        self.watcher.close()
+        shutil.rmtree(self.directory)
+
+    def write(self, path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_no_changes(self):
+        self.write(os.path.join(self.directory, 'unwatched'), 'x')
+        self.assertEqual(self.watcher.changes(0.1), set())
+
+    def test_modified_file(self):
+        self.write(self.path, 'two, longer')
+        self.assertEqual(self.watcher.changes(2), set([self.path]))
+        self.assertEqual(self.watcher.changes(0), set())
+
+    def test_replaced_file(self):
+        tmp = os.path.join(self.directory, 'BUILD.fs.tmp')
+        self.write(tmp, 'replacement')
+        os.rename(tmp, self.path)
+        self.assertEqual(self.watcher.changes(2), set([self.path]))
+
+    def test_entry_added_to_directory(self):
+        self.write(os.path.join(self.subdir, 'new.py'), 'x')
+        self.assertEqual(self.watcher.changes(2), set([self.subdir]))
+
+
+class TestWatcher(WatcherTests, unittest.TestCase):
+    def make_watcher(self):
+        return watcher()
+
+
+class TestPollingWatcher(WatcherTests, unittest.TestCase):
+    def make_watcher(self):
+        return PollingWatcher()
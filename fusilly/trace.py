@@ -0,0 +1,180 @@
+import contextlib
+import json
+import os
+import resource
+import threading
+import time
+
+
+# resource.RUSAGE_THREAD is missing from python 2, where linux still
+# understands it
+RUSAGE_THREAD = getattr(resource, 'RUSAGE_THREAD', 1)
+
+# the record of the target run by the current thread
+_current = threading.local()
+
+
+def _thread_cpu():
+    """ Return the CPU time used by the current thread, or None where that
+    cannot be told. """
+    if hasattr(time, 'thread_time'):
+        return time.thread_time()
+    try:
+        usage = resource.getrusage(RUSAGE_THREAD)
+    except (ValueError, resource.error):
+        return None
+    return usage.ru_utime + usage.ru_stime
+
+
+class TargetRecord(object):
+    """ What running a target took. Times are in seconds. """
+
+    def __init__(self, name, thread):
+        self.name = name
+        self.thread = thread
+        self.start = time.time()
+        self.end = None
+        # CPU time of the thread running the target, None if unknown
+        self.cpu = None
+        # resource usage of the processes the target started
+        self.children_user = 0.0
+        self.children_sys = 0.0
+        self.children_max_rss_kb = 0
+        # 'hit' or 'miss' for cacheable targets, None for the others
+        self.cache = None
+        self.failed = False
+
+    @property
+    def wall(self):
+        return (self.end or time.time()) - self.start
+
+    def add_child(self, rusage):
+        self.children_user += rusage.ru_utime
+        self.children_sys += rusage.ru_stime
+        self.children_max_rss_kb = max(self.children_max_rss_kb,
+                                       rusage.ru_maxrss)
+
+    def args(self):
+        return {
+            'cpu_ms': None if self.cpu is None else round(self.cpu * 1000, 1),
+            'children_user_ms': round(self.children_user * 1000, 1),
+            'children_sys_ms': round(self.children_sys * 1000, 1),
+            'children_max_rss_kb': self.children_max_rss_kb,
+            'cache': self.cache,
+            'failed': self.failed,
+        }
+
+
+def current():
+    """ Return the record of the target run by the current thread, or None.
+    """
+    return getattr(_current, 'record', None)
+
+
+def record_child(rusage):
+    """ Add the resource usage of a process that exited to the target that
+    started it. """
+    record = current()
+    if record is not None:
+        record.add_child(rusage)
+
+
+class BuildTrace(object):
+    """ Records of the targets run in a build, in the order they started.
+    Written as Chrome trace events, one lane per thread running targets, for
+    chrome://tracing or https://ui.perfetto.dev. """
+
+    def __init__(self):
+        self.start = time.time()
+        self.records = []
+        self.lock = threading.Lock()
+        self.lanes = {}
+
+    @contextlib.contextmanager
+    def target(self, name):
+        """ Record the target run in the block. """
+        thread = threading.current_thread()
+        with self.lock:
+            lane = self.lanes.setdefault(thread.ident, len(self.lanes) + 1)
+            record = TargetRecord(name, lane)
+            self.records.append(record)
+
+        cpu = _thread_cpu()
+        _current.record = record
+        try:
+            yield record
+        except Exception:
+            record.failed = True
+            raise
+        finally:
+            _current.record = None
+            record.end = time.time()
+            if cpu is not None:
+                record.cpu = _thread_cpu() - cpu
+
+    def events(self):
+        pid = os.getpid()
+        events = [{
+            'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': lane,
+            'args': {'name': 'worker %d' % lane},
+        } for lane in sorted(self.lanes.values())]
+        for record in self.records:
+            events.append({
+                'name': record.name,
+                'cat': 'target',
+                'ph': 'X',
+                'pid': pid,
+                'tid': record.thread,
+                'ts': int((record.start - self.start) * 1e6),
+                'dur': int(record.wall * 1e6),
+                'args': record.args(),
+            })
+        return events
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events(),
+                       'displayTimeUnit': 'ms'}, f, indent=1)
+
+    def critical_path(self, plan):
+        """ Return the names of the chain of dependencies of the target of
+        plan that took the longest to run, first to run first. Targets not
+        run in this build count for nothing. """
+        walls = dict((record.name, record.wall) for record in self.records)
+        finish = {}
+        previous = {}
+        for name in plan.order:
+            deps = plan.deps(name)
+            before = max(deps, key=lambda dep: finish[dep]) if deps else None
+            previous[name] = before
+            finish[name] = walls.get(name, 0.0) + \
+                (finish[before] if before else 0.0)
+
+        path = []
+        name = plan.target.name
+        while name is not None:
+            path.append(name)
+            name = previous[name]
+        return path[::-1]
+
+    def log_summary(self, logger, plan):
+        if not self.records:
+            return
+        records = dict((record.name, record) for record in self.records)
+        path = [name for name in self.critical_path(plan) if name in records]
+        logger.info("Build took %.1fs, %.1fs on the critical path:",
+                    time.time() - self.start,
+                    sum(records[name].wall for name in path))
+        for name in path:
+            self._log_record(logger.info, records[name])
+        for record in sorted(self.records, key=lambda r: -r.wall):
+            if record.name not in path:
+                self._log_record(logger.debug, record)
+
+    def _log_record(self, log, record):
+        cpu = '-' if record.cpu is None else '%.1fs' % record.cpu
+        log("  %-24s %7.1fs wall %7s cpu %7.1fs children %8dKB max rss%s",
+            record.name, record.wall, cpu,
+            record.children_user + record.children_sys,
+            record.children_max_rss_kb,
+            ' (cache %s)' % record.cache if record.cache else '')
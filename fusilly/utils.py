@@ -1,4 +1,6 @@
+import contextlib
 import distutils.spawn
+import time
 
 
 def is_iterable(var):
@@ -42,3 +44,31 @@ def flatten(lists):
 
 def classname(klass):
     return klass.__module__ + "." + klass.__class__.__name__
+
+
+class Timings(object):
+    """ Durations of named steps, in the order they completed. """
+
+    def __init__(self):
+        self.durations = []
+
+    def add(self, name, seconds):
+        self.durations.append((name, seconds))
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - start)
+
+    def log(self, logger, title):
+        total = sum(seconds for _, seconds in self.durations)
+        logger.debug("%s: %.1fms", title, total * 1000)
+        for name, seconds in self.durations:
+            logger.debug("  %-24s %8.1fms", name, seconds * 1000)
+
+
+# filled in as fusilly starts up and logged once logging is configured
+startup_timings = Timings()
@@ -1,14 +1,331 @@
+import distutils.spawn
+import errno
+import hashlib
+import json
+import logging
 import os
+import re
+import shutil
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
 
+from .cache import read_json, makedirs, write_json_atomic
 from .command import Command
 from .exceptions import VirtualenvCreationFailure
 
 
+logger = logging.getLogger(__name__)
+
+VIRTUALENV_OPTIONS = '--distribute'
+
+# The bookkeeping of a cached virtualenv is kept next to it, named after it
+# with these suffixes, so that it is not packaged along with the virtualenv.
+# The metadata is written once the virtualenv is complete and never changes
+# afterwards, so its presence marks the virtualenv as usable.
+METADATA_SUFFIX = '.json'
+# Touched whenever a cached virtualenv is used, for LRU eviction.
+LAST_USED_SUFFIX = '.last-used'
+
+
+def read_requirements(path):
+    """ Return the requirement lines of a pip requirements file, with comments
+    removed and included requirement files (-r) expanded in place. """
+    requirements = []
+    with open(path) as f:
+        for line in f:
+            line = re.sub(r'(^|\s)#.*$', '', line).strip()
+            if not line:
+                continue
+            match = re.match(r'(-r|--requirement)[\s=]+(\S+)$', line)
+            if match:
+                include = os.path.join(os.path.dirname(path), match.group(2))
+                requirements.extend(read_requirements(include))
+            else:
+                requirements.append(line)
+    return requirements
+
+
+def requirement_name(line):
+    """ Return the lower-cased project name of a requirement line, or None for
+    options and urls. """
+    match = re.match(r'([A-Za-z0-9][A-Za-z0-9._-]*)\s*(\[|[<>=!~;]|$)', line)
+    if match is None:
+        return None
+    return match.group(1).lower()
+
+
+def interpreter():
+    """ Return the real path of the python interpreter that virtualenv builds
+    environments with, as named by the #! line of the virtualenv script. """
+    virtualenv = distutils.spawn.find_executable('virtualenv')
+    if virtualenv is None:
+        return None
+    with open(virtualenv) as f:
+        shebang = f.readline()
+    if not shebang.startswith('#!'):
+        return None
+
+    parts = shebang[2:].split()
+    if not parts:
+        return None
+    python = parts[0]
+    if os.path.basename(python) == 'env' and len(parts) > 1:
+        python = distutils.spawn.find_executable(parts[1])
+    return os.path.realpath(python) if python else None
+
+
+def relocate(path, old_path, new_path):
+    """ Point the scripts of the virtualenv at path, which embed the absolute
+    path of the virtualenv they were installed into, at new_path. """
+    bindir = os.path.join(path, 'bin')
+    for name in os.listdir(bindir):
+        filename = os.path.join(bindir, name)
+        if os.path.islink(filename) or not os.path.isfile(filename):
+            continue
+        with open(filename, 'rb') as f:
+            content = f.read()
+        if old_path in content:
+            with open(filename, 'wb') as f:
+                f.write(content.replace(old_path, new_path))
+
+
+def metadata_path(path):
+    """ Return the path of the metadata of the cached virtualenv at path. """
+    return path + METADATA_SUFFIX
+
+
+def directory_size(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            size += os.lstat(os.path.join(root, name)).st_size
+    return size
+
+
+class VirtualenvCache(object):
+    """ A directory of ready-made virtualenvs keyed by the requirements they
+    were built from, the interpreter and the virtualenv options.
+
+    Virtualenvs are built in a temporary directory next to the cache entries
+    and renamed into place once complete, so a cache entry is never seen half
+    built. Entries unused for longer than max_age seconds are removed, then the
+    least recently used ones until the cache fits in max_size bytes.
+    """
+
+    def __init__(self, directory, max_size, max_age):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+
+    def key(self, requirements):
+        key = json.dumps({
+            'requirements': requirements,
+            'python': interpreter(),
+            'options': VIRTUALENV_OPTIONS,
+        }, sort_keys=True)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _metadata(self, path):
+        return read_json(metadata_path(path))
+
+    def _touch(self, path):
+        with open(path + LAST_USED_SUFFIX, 'a'):
+            os.utime(path + LAST_USED_SUFFIX, None)
+
+    def _last_used(self, path):
+        try:
+            return os.stat(path + LAST_USED_SUFFIX).st_mtime
+        except OSError:
+            return 0
+
+    def entries(self):
+        """ Return (path, metadata) of each complete cache entry. """
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for name in os.listdir(self.directory):
+            path = self.path(name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            metadata = self._metadata(path)
+            if metadata is not None:
+                entries.append((path, metadata))
+        return entries
+
+    def get(self, key):
+        path = self.path(key)
+        if self._metadata(path) is None:
+            return None
+        self._touch(path)
+        return path
+
+    def nearest(self, requirements):
+        """ Return (path, metadata) of the cached virtualenv for the same
+        interpreter with the most requirements, all of which are among
+        requirements, or None. Installing the others into a copy of it then
+        gives what installing them all into a new virtualenv would, which
+        uninstalling requirements would not: what they depend on would be
+        left behind. """
+        python = interpreter()
+        wanted = set(requirements)
+        best, best_shared = None, 0
+        for path, metadata in self.entries():
+            if metadata['python'] != python:
+                continue
+            if not wanted.issuperset(metadata['requirements']):
+                continue
+            shared = len(metadata['requirements'])
+            if shared > best_shared:
+                best, best_shared = (path, metadata), shared
+        return best
+
+    def mkdtemp(self):
+        makedirs(self.directory)
+        return tempfile.mkdtemp(dir=self.directory, prefix='.tmp-')
+
+    def publish(self, tmppath, key, requirements):
+        """ Move the virtualenv built at tmppath into the cache and return its
+        path in the cache. If another build published the same key first, that
+        one is used and tmppath is discarded. """
+        path = self.path(key)
+        relocate(tmppath, tmppath, path)
+        metadata = {
+            'requirements': requirements,
+            'python': interpreter(),
+            'size': directory_size(tmppath),
+        }
+
+        try:
+            os.rename(tmppath, path)
+        except OSError as e:
+            if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+            logger.debug("virtualenv %s was published concurrently", key)
+            shutil.rmtree(tmppath)
+        # the virtualenv at path is complete either way, whether or not the
+        # build that put it there got to write its metadata
+        if self._metadata(path) is None:
+            write_json_atomic(metadata_path(path), metadata)
+        self._touch(path)
+
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        now = time.time()
+        entries = []
+        for path, metadata in self.entries():
+            if path != keep:
+                entries.append((self._last_used(path), path, metadata['size']))
+        entries.sort()
+
+        total = sum(size for _, _, size in entries)
+        if keep is not None:
+            total += self._metadata(keep)['size']
+
+        for last_used, path, size in entries:
+            if now - last_used < self.max_age and total <= self.max_size:
+                break
+            logger.info("Evicting cached virtualenv %s", path)
+            # no longer usable once its metadata is gone
+            for name in (metadata_path(path), path + LAST_USED_SUFFIX):
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+class Wheelhouse(object):
+    """ A directory of wheels that virtualenvs are installed from without
+    consulting a package index.
+
+    Wheels missing from the wheelhouse are built once, one pip process per
+    requirement with up to `jobs` running at a time, so C extensions are only
+    ever compiled once per version. In offline mode nothing is built and the
+    wheelhouse must already hold every wheel needed.
+    """
+
+    def __init__(self, directory, jobs, offline=False):
+        self.directory = directory
+        self.jobs = max(1, jobs)
+        self.offline = offline
+
+    def _install(self, pip, requirements_file, command):
+        cmd = '%s install --no-index --find-links %s -r %s' % (
+            pip, self.directory, requirements_file
+        )
+        return command(cmd).run()
+
+    def _build_wheel(self, pip, options, requirement, command):
+        cmd = '%s wheel --no-deps --wheel-dir %s --find-links %s' % (
+            pip, self.directory, self.directory
+        )
+        cmd = ' '.join([cmd] + options + [requirement])
+        return command(cmd).run()
+
+    def build(self, pip, requirements_file, command=Command):
+        """ Build wheels for the requirements, and then for whatever they
+        depend on that is still missing. """
+        makedirs(self.directory)
+
+        requirements = read_requirements(requirements_file)
+        options = [
+            r for r in requirements
+            if r.startswith('-') and not r.startswith(('-e', '--editable'))
+        ]
+        projects = [r for r in requirements if requirement_name(r)]
+
+        logger.info("Building %d wheels into %s", len(projects),
+                    self.directory)
+        pool = ThreadPool(min(self.jobs, len(projects)) or 1)
+        try:
+            rets = pool.map(
+                lambda r: self._build_wheel(pip, options, r, command), projects
+            )
+        finally:
+            pool.close()
+            pool.join()
+        if any(rets):
+            raise VirtualenvCreationFailure()
+
+        cmd = '%s wheel --wheel-dir %s --find-links %s -r %s' % (
+            pip, self.directory, self.directory, requirements_file
+        )
+        if command(cmd).run() != 0:
+            raise VirtualenvCreationFailure()
+
+    def install(self, pip, requirements_file, command=Command):
+        """ Install the requirements with pip. command makes the Command
+        running each pip invocation from its command line. """
+        if self._install(pip, requirements_file, command) == 0:
+            return
+        if self.offline:
+            logger.error("Wheels for %s missing from %s in offline mode",
+                         requirements_file, self.directory)
+            raise VirtualenvCreationFailure()
+
+        self.build(pip, requirements_file, command)
+        if self._install(pip, requirements_file, command) != 0:
+            raise VirtualenvCreationFailure()
+
+
 class Virtualenv(object):
-    def __init__(self, identifier, requirements_file, path):
+    def __init__(self, identifier, requirements_file, path, wheelhouse=None,
+                 log_file=None):
         self.id = identifier
         self.reqs = requirements_file
         self.path = path
+        self.wheelhouse = wheelhouse
+        self.log_file = log_file
+
+    def _command(self, cmd):
+        return Command(cmd, name=self.id, log_file=self.log_file)
 
     def update_local(self):
         """On some systems virtualenv has a local directory that symlinks back
@@ -44,23 +361,70 @@ class Virtualenv(object):
             os.symlink(target, distutils)
 
     def _create(self):
-        ret = Command('virtualenv --distribute %s' % self.path).run()
+        cmd = 'virtualenv %s %s' % (VIRTUALENV_OPTIONS, self.path)
+        ret = self._command(cmd).run()
         if ret != 0:
             raise VirtualenvCreationFailure()
 
         self.update_links()
 
+    def _clone(self, source):
+        """ Copy the virtualenv at source, built from some of the
+        requirements. _load() then only installs what is missing. """
+        os.rmdir(self.path)
+        shutil.copytree(source, self.path, symlinks=True)
+        relocate(self.path, source, self.path)
+        self.update_links()
+
     def _load(self):
         pip = os.path.join(self.path, 'bin', 'pip')
+        if self.wheelhouse is not None:
+            self.wheelhouse.install(pip, self.reqs, self._command)
+            return
+
         cmd = '%s install -r %s' % (pip, self.reqs)
-        ret = Command(cmd).run()
+        ret = self._command(cmd).run()
         if ret != 0:
             raise VirtualenvCreationFailure()
 
     @classmethod
-    def create(cls, identifier, pip_requirements_files, virtualenv_path):
+    def create(cls, identifier, pip_requirements_files, virtualenv_path,
+               wheelhouse=None, log_file=None):
         virtualenv = Virtualenv(identifier, pip_requirements_files,
-                                virtualenv_path)
+                                virtualenv_path, wheelhouse, log_file)
         virtualenv._create()
         virtualenv._load()
         return virtualenv
+
+    @classmethod
+    def cached(cls, identifier, pip_requirements_files, cache,
+               wheelhouse=None, log_file=None):
+        """ Return a virtualenv from cache with the requirements installed,
+        building and caching it first if needed. A new virtualenv starts as a
+        copy of the cached one sharing the most requirements, if any. """
+        requirements = read_requirements(pip_requirements_files)
+        key = cache.key(requirements)
+
+        path = cache.get(key)
+        if path is not None:
+            logger.info("Using cached virtualenv %s", path)
+            return Virtualenv(identifier, pip_requirements_files, path,
+                              wheelhouse, log_file)
+
+        virtualenv = Virtualenv(identifier, pip_requirements_files,
+                                cache.mkdtemp(), wheelhouse, log_file)
+        try:
+            nearest = cache.nearest(requirements)
+            if nearest is not None:
+                source, _ = nearest
+                logger.info("Creating virtualenv from cached %s", source)
+                virtualenv._clone(source)
+            else:
+                virtualenv._create()
+            virtualenv._load()
+            virtualenv.path = cache.publish(virtualenv.path, key, requirements)
+        except Exception:
+            shutil.rmtree(virtualenv.path, ignore_errors=True)
+            raise
+
+        return virtualenv
@@ -0,0 +1,191 @@
+import hashlib
+import logging
+import os
+
+from fusilly.exceptions import BuildConfigError
+from fusilly.plan import BuildPlan
+from fusilly.scheduler import Scheduler
+from fusilly.targets import Targets
+from fusilly.watcher import watcher
+
+
+logger = logging.getLogger(__name__)
+
+# a burst of changes is over once nothing changed for this many seconds
+DEBOUNCE = 0.3
+# seconds to wait for a change at once, short enough to keep ctrl-c working
+WAIT = 60 * 60
+
+
+def _signature(path):
+    """ Return what a change of the watched path is told by: the entries of
+    a directory, the hash of the content of a file, None if it is gone. """
+    try:
+        if os.path.isdir(path):
+            return sorted(os.listdir(path))
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except (IOError, OSError):
+        return None
+
+
+class WatchSession(object):
+    """ Runs a target, then waits for the files its build depends on to
+    change and runs again only the targets affected by the change and the
+    targets depending on them. The others hand their output from the previous
+    run to the targets being run.
+
+    The files of a target are given by its watch_paths(). A changed BUILD
+    file is executed again before its targets run.
+    """
+
+    def __init__(self, buildFiles, target_name, programArgs, jobs=1,
+                 cache=None):
+        self.buildFiles = buildFiles
+        self.target_name = target_name
+        self.programArgs = programArgs
+        self.jobs = jobs
+        self.cache = cache
+        self.watcher = watcher()
+        self.plan = None
+        # watched path -> names of the targets watching it
+        self.paths = {}
+        self.outputs = {}
+        # watched path -> its signature before the targets watching it ran
+        self.before = {}
+
+    def _update_plan(self):
+        target = Targets.get(self.target_name)
+        if target is None:
+            raise BuildConfigError("Target '%s' is no longer defined" %
+                                   self.target_name)
+        self.plan = BuildPlan(target)
+        self.paths = {}
+        for target in self.plan.targets():
+            for path in target.watch_paths():
+                self.paths.setdefault(path, set()).add(target.name)
+        self.watcher.watch(self.paths)
+
+    def _wait(self):
+        """ Return the paths changed by the next burst of changes. """
+        changed = set()
+        while not changed:
+            changed = self.watcher.changes(WAIT)
+        while True:
+            more = self.watcher.changes(DEBOUNCE)
+            if not more:
+                return changed
+            changed |= more
+
+    def _with_dependents(self, names):
+        dirty = set()
+        pending = [name for name in names if name in self.plan.dependents]
+        while pending:
+            name = pending.pop()
+            if name not in dirty:
+                dirty.add(name)
+                pending.extend(self.plan.dependents[name])
+        return dirty
+
+    def _reload(self, paths):
+        """ Execute the changed BUILD files at paths again. Returns the names
+        of the targets they now define. """
+        self.buildFiles.reload(paths)
+        return set(
+            name for name, target in Targets.iteritems()
+            if target.buildFile is not None and target.buildFile.path in paths
+        )
+
+    def _build(self, dirty):
+        """ Run the targets named in dirty, which must include every target
+        depending on them, reusing the output of the others. Returns the names
+        of the targets that were run. """
+        for name in dirty:
+            if name in self.outputs:
+                del self.outputs[name]
+                Targets.get(name).cleanup()
+
+        scheduler = Scheduler(self.plan, self.programArgs, jobs=self.jobs,
+                              cache=self.cache, outputs=self.outputs)
+        todo = set(scheduler.todo)
+        self.before = dict(
+            (os.path.abspath(path), _signature(path))
+            for path, names in self.paths.items() if names <= todo
+        )
+        logger.info("Running %d of %d targets", len(scheduler.todo),
+                    len(self.plan.order))
+        try:
+            scheduler.run()
+            logger.info("%s is up to date, watching for changes",
+                        self.target_name)
+        except Exception as e:
+            logger.error("Build failed: %s", e)
+            logger.debug("Build failed", exc_info=True)
+        finally:
+            # targets that did not get to run are run after the next change
+            self.outputs = scheduler.outputs
+            if self.cache is not None:
+                self.cache.save()
+        return todo
+
+    def _ignore_own_changes(self, ran):
+        """ Forget the changes made while targets ran to their declared
+        outputs, and to the paths only they watch that are as they were
+        before the run, such as files written again with the same content.
+        Anything else may have been changed by the user meanwhile. """
+        outputs = set()
+        for name in ran:
+            outputs.update(os.path.abspath(path)
+                           for path in Targets.get(name).output_files())
+
+        changed = set()
+        for path in self.watcher.changes(0):
+            if path in outputs:
+                continue
+            if path in self.before and _signature(path) == self.before[path]:
+                continue
+            changed.add(path)
+        return changed
+
+    def run(self):
+        try:
+            self._update_plan()
+            if self.plan.check():
+                return 1
+            ran = self._build(set(self.plan.order))
+            pending = self._ignore_own_changes(ran)
+
+            while True:
+                changed = pending or self._wait()
+                logger.debug("Changed: %s", ', '.join(sorted(changed)))
+
+                dirty = set()
+                for path in changed:
+                    dirty.update(self.paths.get(path, ()))
+
+                # the targets of a changed BUILD file are replaced by new
+                # ones, so the old ones are done with
+                build_files = sorted(p for p in changed
+                                     if p in self.buildFiles.loaded)
+                if build_files:
+                    dirty = self._with_dependents(dirty)
+                    for name in dirty:
+                        self.outputs.pop(name, None)
+                        Targets.get(name).cleanup()
+                    try:
+                        dirty.update(self._reload(build_files))
+                        self._update_plan()
+                    except BuildConfigError as e:
+                        logger.error("%s", e)
+                        pending = set()
+                        continue
+
+                dirty = self._with_dependents(dirty)
+                pending = set()
+                if dirty:
+                    ran = self._build(dirty)
+                    pending = self._ignore_own_changes(ran)
+        finally:
+            if self.plan is not None:
+                self.plan.cleanup()
+            self.watcher.close()
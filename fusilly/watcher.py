@@ -0,0 +1,229 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# seconds between two scans of the polling watcher
+POLL_INTERVAL = 0.5
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+              IN_MOVE_SELF | IN_ONLYDIR)
+
+# events changing the entries of a directory
+ENTRY_MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class Watcher(object):
+    """ Reports changes to a set of watched files and directories. A watched
+    file changes when it is written, created, replaced or removed, a watched
+    directory when an entry is added to or removed from it.
+
+    changes() returns the watched paths that changed since the previous call,
+    waiting up to timeout seconds for one to.
+    """
+
+    def __init__(self):
+        self.files = set()
+        self.dirs = set()
+
+    def watch(self, paths):
+        for path in paths:
+            path = os.path.abspath(path)
+            if os.path.isdir(path):
+                self.dirs.add(path)
+            else:
+                self.files.add(path)
+
+    def changes(self, timeout=0):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class PollingWatcher(Watcher):
+    """ Watcher stat'ing every watched path, for systems without inotify. """
+
+    def __init__(self):
+        super(PollingWatcher, self).__init__()
+        self.stats = {}
+
+    def _stat(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size, st.st_ino)
+
+    def watch(self, paths):
+        paths = [os.path.abspath(path) for path in paths]
+        super(PollingWatcher, self).watch(paths)
+        for path in paths:
+            if path not in self.stats:
+                self.stats[path] = self._stat(path)
+
+    def _scan(self):
+        changed = set()
+        for path, stat in self.stats.items():
+            current = self._stat(path)
+            if current != stat:
+                self.stats[path] = current
+                changed.add(path)
+        return changed
+
+    def changes(self, timeout=0):
+        deadline = time.time() + timeout
+        while True:
+            changed = self._scan()
+            remaining = deadline - time.time()
+            if changed or remaining <= 0:
+                return changed
+            time.sleep(min(POLL_INTERVAL, remaining))
+
+
+class InotifyWatcher(Watcher):
+    """ Watcher using inotify(7). Files are watched through the directory
+    containing them, so that files replaced by a rename, as editors do, stay
+    watched. """
+
+    def __init__(self, libc):
+        super(InotifyWatcher, self).__init__()
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        # watch descriptor -> watched directory
+        self.wds = {}
+        self.watched = set()
+
+    def _add_watch(self, directory):
+        if directory in self.watched:
+            return
+        wd = self.libc.inotify_add_watch(self.fd, directory.encode('utf-8'),
+                                         WATCH_MASK)
+        if wd < 0:
+            logger.debug("Cannot watch %s: %s", directory,
+                         os.strerror(ctypes.get_errno()))
+            return
+        self.wds[wd] = directory
+        self.watched.add(directory)
+
+    def watch(self, paths):
+        paths = [os.path.abspath(path) for path in paths]
+        super(InotifyWatcher, self).watch(paths)
+        for path in paths:
+            if path in self.dirs:
+                self._add_watch(path)
+            else:
+                self._add_watch(os.path.dirname(path))
+
+    def _read(self):
+        try:
+            return os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return b''
+            raise
+
+    def _events(self, data):
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            yield wd, mask, name.decode('utf-8', 'replace')
+
+    def _changed(self, data):
+        changed = set()
+        for wd, mask, name in self._events(data):
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, anything may have changed
+                return self.files | self.dirs
+            directory = self.wds.get(wd)
+            if directory is None:
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                del self.wds[wd]
+                self.watched.discard(directory)
+            if directory in self.dirs and mask & ENTRY_MASK:
+                changed.add(directory)
+            path = os.path.join(directory, name)
+            if path in self.files:
+                changed.add(path)
+        return changed
+
+    def changes(self, timeout=0):
+        deadline = time.time() + timeout
+        while True:
+            changed = self._changed(self._read())
+            remaining = deadline - time.time()
+            if changed or remaining <= 0:
+                return changed
+            select.select([self.fd], [], [], remaining)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def tree(directory, ignore_paths=()):
+    """ Return directory and the files and directories below it, skipping
+    hidden directories and those named in ignore_paths. """
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if not d.startswith('.') and
+                   d not in ignore_paths]
+        paths.append(root)
+        paths.extend(os.path.join(root, f) for f in files)
+    return paths
+
+
+def _libc():
+    name = ctypes.util.find_library('c')
+    if name is None:
+        return None
+    libc = ctypes.CDLL(name, use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        return None
+    return libc
+
+
+def watcher(paths=()):
+    """ Return a watcher of paths, using inotify where available. """
+    libc = _libc()
+    if libc is not None:
+        try:
+            w = InotifyWatcher(libc)
+        except OSError as e:
+            logger.debug("inotify unavailable, polling instead: %s", e)
+        else:
+            w.watch(paths)
+            return w
+    w = PollingWatcher()
+    w.watch(paths)
+    return w
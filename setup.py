@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+import re
+
 from setuptools import setup, find_packages
 
 
@@ -16,7 +18,8 @@ def get_requirements(env):
 install_requires = get_requirements('base')
 dev_requires = install_requires + get_requirements('dev')
 
-version = '0.0.1'
+with open('fusilly/__init__.py') as f:
+    version = re.search(r"__version__ = '(.*)'", f.read()).group(1)
 
 setup(
     name='fusilly',
@@ -39,7 +42,7 @@ setup(
     zip_safe=False,
     entry_points={
         'console_scripts': [
-            'fusilly = fusilly.main:main',
+            'fusilly = fusilly.client:main',
         ],
     },
     extras_require={